@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import (logger, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_NGRAM, ANSWER_CACHE_DIM, ANSWER_CACHE_ENTRIES,
+                    ANSWER_CACHE_DATASETS)
+from prompt_registry import PROMPTS_VERSION
+
+# Слова, не меняющие смысла вопроса о наборе данных
+FILLER_WORDS = frozenset((
+    "а", "и", "ну", "же", "ли", "бы", "пожалуйста", "подскажи", "подскажите", "скажи", "скажите", "покажи",
+    "покажите", "мне", "можешь", "можете", "вот", "тут", "здесь", "это", "в", "у", "о", "об", "по", "за", "на",
+    "какой", "какая", "какое", "какие", "каков", "какова", "каково", "каковы", "есть", "был", "была", "было",
+    "были", "графике", "дашборде", "ряд", "ряда", "ряду", "данные", "данных"
+))
+
+# Признаки вопроса, продолжающего разговор: союз в начале («а за прошлый год?»), слова и основы,
+# отсылающие к предыдущим сообщениям, и вопрос из одних вопросительных слов («почему?»)
+CONTINUATION_WORDS = frozenset(("а", "и", "но", "так", "тогда"))
+REFERRING_WORDS = frozenset((
+    "этот", "эта", "эти", "этого", "этой", "этом", "этим", "этих", "этому", "тот", "та", "те", "того", "той",
+    "том", "тем", "тех", "там", "тоже", "также", "еще", "выше", "ранее", "аналогично"
+))
+REFERRING_STEMS = ("прошл", "позапрошл", "предыдущ", "следующ", "упомянут")
+QUESTION_WORDS = frozenset(("почему", "зачем", "как", "где", "когда", "сколько", "откуда", "что", "так"))
+
+# Ответы, которые не сохраняются: ошибки и просьба переформулировать вопрос
+UNCACHEABLE_PREFIXES = ("Ошибка", "Пожалуйста, переформулируйте")
+
+
+def normalize_question(text: str) -> str:
+    """Нижний регистр, ё -> е, без знаков препинания и слов-паразитов."""
+    words = re.findall(r"\w+", text.lower().replace("ё", "е"))
+    return " ".join(word for word in words if word not in FILLER_WORDS)
+
+
+def depends_on_context(text: str) -> bool:
+    """Вопрос понятен только вместе с историей чата: продолжает разговор или ссылается на предыдущие сообщения.
+
+    Ответ на такой вопрос зависит от контекста, поэтому при непустой истории он не берется из кэша
+    и не сохраняется в него.
+    """
+    words = re.findall(r"\w+", text.lower().replace("ё", "е"))
+    if not words or words[0] in CONTINUATION_WORDS:
+        return True
+    if all(word in QUESTION_WORDS for word in normalize_question(text).split()):
+        return True
+    return any(word in REFERRING_WORDS or word.startswith(REFERRING_STEMS) for word in words)
+
+
+def question_vector(normalized: str, ngram: int = ANSWER_CACHE_NGRAM, dim: int = ANSWER_CACHE_DIM) -> np.ndarray:
+    """Нормированный вектор символьных n-грамм и слов вопроса (хеширование в dim корзин).
+
+    N-граммы сближают словоформы («тренд» и «тренды»), целые слова разводят вопросы,
+    различающиеся одним словом с общими n-граммами («минимальное» и «максимальное»).
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in normalized.split():
+        vector[zlib.crc32(word.encode("utf-8")) % dim] += 1.0
+        padded = f"#{word}#"
+        if len(padded) <= ngram:
+            vector[zlib.crc32(padded.encode("utf-8")) % dim] += 1.0
+            continue
+        for i in range(len(padded) - ngram + 1):
+            vector[zlib.crc32(padded[i:i + ngram].encode("utf-8")) % dim] += 1.0
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+
+def question_numbers(normalized: str) -> frozenset:
+    return frozenset(word for word in normalized.split() if any(char.isdigit() for char in word))
+
+
+def features_version(*features: Optional[Dict]) -> str:
+    """Отпечаток характеристик набора и версии промптов: при изменении любого из них прежние ответы
+    становятся недействительными."""
+    payload = json.dumps([PROMPTS_VERSION, features], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def dataset_key(image_path: Optional[str], data_path: Optional[str]) -> str:
+    parts = []
+    for path in (image_path, data_path):
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}")
+        else:
+            parts.append("")
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class AnswerCache:
+    """Кэш ответов чата по набору данных с поиском похожих вопросов.
+
+    Вопрос приводится к нормальной форме и представляется вектором символьных n-грамм; новый вопрос
+    получает сохраненный ответ, если косинусное сходство с одним из прежних вопросов того же набора
+    не ниже порога. Записи набора сбрасываются, когда меняется отпечаток его характеристик.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_entries: int = ANSWER_CACHE_ENTRIES,
+                 max_datasets: int = ANSWER_CACHE_DATASETS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_datasets = max_datasets
+        self._lock = threading.Lock()
+        self._datasets: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def _entries(self, dataset: str, version: str, create: bool = False) -> Optional[Dict]:
+        entries = self._datasets.get(dataset)
+        if entries is not None and entries["version"] != version:
+            logger.info(f"Кэш ответов набора {dataset} сброшен: характеристики изменились")
+            entries = None
+            del self._datasets[dataset]
+        if entries is None and create:
+            entries = {"version": version, "questions": [], "numbers": [], "answers": [], "hits": [],
+                       "vectors": np.zeros((0, ANSWER_CACHE_DIM), dtype=np.float32)}
+            self._datasets[dataset] = entries
+            while len(self._datasets) > self.max_datasets:
+                self._datasets.popitem(last=False)
+        if entries is not None:
+            self._datasets.move_to_end(dataset)
+        return entries
+
+    def lookup(self, dataset: str, version: str, question: str) -> Optional[Dict]:
+        """Сохраненный ответ на похожий вопрос: {answer, question, score} или None."""
+        normalized = normalize_question(question)
+        if not normalized:
+            return None
+        vector = question_vector(normalized)
+        with self._lock:
+            entries = self._entries(dataset, version)
+            if not entries or not entries["questions"]:
+                return None
+            # Вопросы с разными числами (годы, даты, значения) не считаются похожими
+            numbers = question_numbers(normalized)
+            scores = np.where([item == numbers for item in entries["numbers"]], entries["vectors"] @ vector, -1.0)
+            best = int(np.argmax(scores))
+            score = 1.0 if entries["questions"][best] == normalized else float(scores[best])
+            if score < self.threshold:
+                return None
+            entries["hits"][best] += 1
+            return {"answer": entries["answers"][best], "question": entries["questions"][best], "score": score}
+
+    def add(self, dataset: str, version: str, question: str, answer: str) -> None:
+        normalized = normalize_question(question)
+        if not normalized or not answer or answer.startswith(UNCACHEABLE_PREFIXES):
+            return
+        vector = question_vector(normalized)
+        with self._lock:
+            entries = self._entries(dataset, version, create=True)
+            if normalized in entries["questions"]:
+                entries["answers"][entries["questions"].index(normalized)] = answer
+                return
+            if len(entries["questions"]) >= self.max_entries:
+                # Вытесняется вопрос, который реже всего получал ответ из кэша
+                self._remove(entries, int(np.argmin(entries["hits"])))
+            entries["questions"].append(normalized)
+            entries["numbers"].append(question_numbers(normalized))
+            entries["answers"].append(answer)
+            entries["hits"].append(0)
+            entries["vectors"] = np.vstack([entries["vectors"], vector])
+
+    @staticmethod
+    def _remove(entries: Dict, index: int) -> None:
+        for key in ("questions", "numbers", "answers", "hits"):
+            del entries[key][index]
+        entries["vectors"] = np.delete(entries["vectors"], index, axis=0)
+
+    def questions(self, dataset: str, version: str) -> List[str]:
+        with self._lock:
+            entries = self._entries(dataset, version)
+            return list(entries["questions"]) if entries else []
+
+    def invalidate(self, dataset: Optional[str] = None) -> None:
+        with self._lock:
+            if dataset is None:
+                self._datasets.clear()
+            else:
+                self._datasets.pop(dataset, None)
+
+
+answer_cache = AnswerCache()
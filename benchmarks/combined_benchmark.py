@@ -0,0 +1,167 @@
+"""Сравнение режимов графа: раздельные запросы (multi) и один совмещенный запрос (combined).
+
+Для каждого режима граф аннотации прогоняется несколько раз на одних и тех же изображении и данных,
+каждый прогон — в новой временной рабочей директории, чтобы индекс изображений, снимки инкрементальной
+аннотации и хранилище результатов не подменяли обращения к модели. Считаются время до готовой аннотации,
+число запросов и токены (из usage ответов шлюза), а также согласие извлеченных полей между режимами:
+метрика, область и числа в минимуме и максимуме — на совпадение, тренд и сезонность — по косинусной
+близости текстов.
+
+По умолчанию запросы обслуживает заглушка (benchmarks/fake_gateway.py); с --upstream они пересылаются
+в настоящий шлюз, и токены берутся из его ответов:
+    python benchmarks/combined_benchmark.py --runs 5
+    API_KEY=... python benchmarks/combined_benchmark.py --upstream https://llm.glowbyteconsulting.com/api
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fake_gateway import FakeGateway  # noqa: E402
+from load_test import synthetic_inputs  # noqa: E402
+
+MODES = ("multi", "combined")
+TEXT_FIELDS = ("trend", "seasonality")
+
+
+def initial_state(image_path: str, data_path: str) -> dict:
+    return {"image_path": image_path, "data_path": data_path, "dash_features": None, "domain_features": None,
+            "ts_features": None, "final_annotation": None, "user_query": None, "chat_history": [],
+            "response": None, "incremental": None, "image_match": None, "session_id": None}
+
+
+def run_once(mode: str, image: Path, data: Path, gateway: FakeGateway) -> dict:
+    from graph_workflow import create_graph
+
+    workdir = Path(tempfile.mkdtemp(prefix=f"combined_{mode}_"))
+    previous = os.getcwd()
+    try:
+        os.chdir(workdir)
+        for name, source in (("uploads", image), ("data", data)):
+            (workdir / name).mkdir()
+            shutil.copy(source, workdir / name / source.name)
+        graph = create_graph(mode)
+        before = dict(gateway.stats)
+        started = time.perf_counter()
+        state = graph.invoke(initial_state(str(Path("uploads") / image.name), str(Path("data") / data.name)))
+        seconds = time.perf_counter() - started
+        after = dict(gateway.stats)
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+    ts_features = state.get("ts_features") or {}
+    return {
+        "seconds": seconds,
+        "requests": after["requests"] - before["requests"],
+        "errors": after["errors"] - before["errors"],
+        "prompt_tokens": after["prompt_tokens"] - before["prompt_tokens"],
+        "completion_tokens": after["completion_tokens"] - before["completion_tokens"],
+        "fields": {
+            "main_metric": (state.get("dash_features") or {}).get("main_metric", "неизвестно"),
+            "domain": (state.get("domain_features") or {}).get("domain", "неизвестно"),
+            **{key: ts_features.get(key, "неизвестно") for key in ("trend", "seasonality", "min_value", "max_value")}
+        },
+        "local": ts_features.get("source") == "local",
+        "annotation": bool(state.get("final_annotation"))
+    }
+
+
+def numbers(text) -> list:
+    return re.findall(r"-?\d+(?:[.,]\d+)?", str(text).replace(" ", ""))
+
+
+def agreement(left: dict, right: dict) -> dict:
+    """Согласие полей двух прогонов: 1/0 для метрики, области и чисел экстремумов, косинус для текстов."""
+    from answer_cache import normalize_question, question_vector
+
+    result = {}
+    for key in ("main_metric", "domain"):
+        result[key] = float(str(left[key]).strip().lower() == str(right[key]).strip().lower())
+    for key in ("min_value", "max_value"):
+        result[key] = float(numbers(left[key])[:1] == numbers(right[key])[:1])
+    for key in TEXT_FIELDS:
+        result[key] = round(float(question_vector(normalize_question(str(left[key])))
+                                  @ question_vector(normalize_question(str(right[key])))), 3)
+    return result
+
+
+def summarize(runs: list) -> dict:
+    def mean(key):
+        return round(statistics.mean(run[key] for run in runs), 1)
+
+    seconds = sorted(run["seconds"] for run in runs)
+    return {
+        "runs": len(runs),
+        "mean_ms": round(statistics.mean(seconds) * 1000, 1),
+        "p50_ms": round(seconds[len(seconds) // 2] * 1000, 1),
+        "max_ms": round(seconds[-1] * 1000, 1),
+        "requests": mean("requests"),
+        "errors": mean("errors"),
+        "prompt_tokens": mean("prompt_tokens"),
+        "completion_tokens": mean("completion_tokens"),
+        "local_fallbacks": sum(run["local"] for run in runs),
+        "fields": runs[-1]["fields"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение раздельного и совмещенного анализа")
+    parser.add_argument("--runs", type=int, default=3, help="прогонов на режим")
+    parser.add_argument("--latency", type=float, default=300, help="задержка ответа заглушки, мс")
+    parser.add_argument("--upstream", help="адрес настоящего шлюза вместо заготовленных ответов")
+    parser.add_argument("--image", type=Path, help="изображение дашборда (по умолчанию синтетическое)")
+    parser.add_argument("--data", type=Path, help="файл данных CSV/XLSX (по умолчанию синтетический)")
+    parser.add_argument("--json", help="путь для сохранения отчета в JSON")
+    args = parser.parse_args()
+
+    gateway = FakeGateway(latency=args.latency / 1000, upstream=args.upstream).start()
+    # Адрес шлюза читается config при импорте, поэтому задается до первого импорта модулей приложения
+    os.environ["API_BASE_URL"] = gateway.base_url
+    os.environ.setdefault("API_KEY", "combined-benchmark")
+    # Фоновые ответы на вероятные вопросы не относятся к сравниваемому анализу
+    os.environ["FOLLOWUP_PRECOMPUTE"] = "0"
+    logging.disable(logging.INFO)
+
+    inputs_dir = Path(tempfile.mkdtemp(prefix="combined_inputs_"))
+    image, data = synthetic_inputs(inputs_dir)
+    image, data = (args.image or image).resolve(), (args.data or data).resolve()
+
+    runs = {mode: [] for mode in MODES}
+    # Режимы чередуются, чтобы дрейф задержки шлюза не приходился на один из них
+    for _ in range(args.runs):
+        for mode in MODES:
+            runs[mode].append(run_once(mode, image, data, gateway))
+    gateway.stop()
+    shutil.rmtree(inputs_dir, ignore_errors=True)
+
+    pairs = [agreement(multi["fields"], combined["fields"]) for multi, combined in zip(runs["multi"], runs["combined"])]
+    report = {
+        "gateway": args.upstream or f"заглушка, {args.latency:g} мс",
+        "image": str(image),
+        "data": str(data),
+        "modes": {mode: summarize(mode_runs) for mode, mode_runs in runs.items()},
+        "agreement": {key: round(statistics.mean(pair[key] for pair in pairs), 3) for key in pairs[0]}
+    }
+    multi, combined = report["modes"]["multi"], report["modes"]["combined"]
+    report["speedup"] = round(multi["mean_ms"] / max(combined["mean_ms"], 1e-9), 2)
+    report["prompt_tokens_saved"] = round(multi["prompt_tokens"] - combined["prompt_tokens"], 1)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Разбор столбцов дат: прежний путь (автоопределение pandas по элементам) и date_parsing.DateNormalizer.
+
+Для каждого формата (ISO, дд.мм.гггг, номер года, «Занлись N», квартал, месяц на русском) создается
+столбец из --rows значений. Прежний путь — две пробные проверки pd.to_datetime из read_data и разбор
+столбца parse_dates в том виде, в каком он был до DateNormalizer; новый — определение формата по
+выборке и векторный разбор (без запомненного формата и с форматом, запомненным для схемы файла).
+Для каждого пути — медианное время и доля правильно разобранных дат.
+
+Запуск из корня проекта:
+    python benchmarks/date_parsing_benchmark.py --rows 100000 1000000 --repeat 3
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+MONTHS = ("январь", "февраль", "март", "апрель", "май", "июнь", "июль", "август", "сентябрь", "октябрь",
+          "ноябрь", "декабрь")
+
+
+def make_column(kind: str, rows: int):
+    """Столбец дат формата kind и ожидаемые даты (datetime64[ns])."""
+    if kind in ("iso", "dmy"):
+        truth = np.datetime64("1990-01-01", "ns") + np.arange(rows).astype("timedelta64[m]") * 17
+        truth = truth.astype("datetime64[D]").astype("datetime64[ns]")
+        text = pd.Series(truth).dt.strftime("%Y-%m-%d" if kind == "iso" else "%d.%m.%Y")
+        return text.astype(object), truth
+    if kind == "year":
+        years = 1900 + np.arange(rows) % 300
+        return pd.Series(years), (years - 1970).astype("datetime64[Y]").astype("datetime64[ns]")
+    if kind == "zanlis":
+        numbers = np.arange(rows) % 80
+        return (pd.Series(numbers).map(lambda n: f"Занлись {n}").astype(object),
+                (numbers + 1945 - 1970).astype("datetime64[Y]").astype("datetime64[ns]"))
+    months = (np.arange(rows) % (200 * 12)) if kind == "month" else (np.arange(rows) % 800) * 3
+    truth = (months + 12 * 30).astype("datetime64[M]").astype("datetime64[ns]")
+    years, month = 2000 + months // 12, months % 12
+    if kind == "month":
+        text = [f"{MONTHS[m]} {y}" for y, m in zip(years, month)]
+    else:
+        text = [f"{y} Q{m // 3 + 1}" for y, m in zip(years, month)]
+    return pd.Series(text, dtype=object), truth
+
+
+def legacy_parse_dates(column: pd.Series):
+    """TimeSeriesAnalyzer.parse_dates до DateNormalizer (для строк — столбец типа object, как в pandas 2)."""
+    if pd.api.types.is_numeric_dtype(column):
+        return pd.to_datetime(column.astype(int).astype(str) + "-01-01", errors="coerce")
+    if column.str.match(r"Занлись \d+").any():
+        column = column.str.extract(r"Занлись (\d+)")[0].astype(float).astype(int) + 1945
+        return pd.to_datetime(column.astype(str) + "-01-01")
+    return pd.to_datetime(column, errors="coerce")
+
+
+def legacy_path(column: pd.Series):
+    # Две пробные проверки из read_data, результат которых не использовался
+    pd.to_datetime(column, errors="coerce")
+    pd.to_datetime(column, errors="coerce")
+    return legacy_parse_dates(column)
+
+
+def engine_path(column: pd.Series, cold: bool):
+    from date_parsing import date_normalizer
+
+    if cold:
+        date_normalizer._formats.clear()
+    return date_normalizer.normalize(column, ("Дата", "Значение"))[0]
+
+
+def timed(function, repeat: int):
+    timings, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return round(statistics.median(timings) * 1000, 1), result
+
+
+def correct_share(parsed, truth: np.ndarray) -> float:
+    values = pd.Series(parsed).to_numpy(dtype="datetime64[ns]")
+    return round(float(np.mean(values == truth)), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Разбор столбцов дат: прежний путь и DateNormalizer")
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000], help="размеры столбцов")
+    parser.add_argument("--kinds", nargs="+", default=["iso", "dmy", "year", "zanlis", "quarter", "month"])
+    parser.add_argument("--repeat", type=int, default=3, help="повторов замера")
+    parser.add_argument("--legacy-max-rows", type=int, default=200_000,
+                        help="наибольший размер столбца для прежнего пути (поэлементный разбор медленный)")
+    parser.add_argument("--json", help="путь для сохранения отчета в JSON")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    warnings.simplefilter("ignore", UserWarning)
+
+    report = {}
+    for rows in args.rows:
+        for kind in args.kinds:
+            column, truth = make_column(kind, rows)
+            entry = {}
+            if rows <= args.legacy_max_rows:
+                try:
+                    ms, parsed = timed(lambda: legacy_path(column), args.repeat)
+                    entry["legacy"] = {"ms": ms, "correct": correct_share(parsed, truth)}
+                except Exception as e:
+                    entry["legacy"] = {"error": str(e)}
+            for name, cold in (("engine", True), ("engine_cached_format", False)):
+                ms, parsed = timed(lambda: engine_path(column, cold), args.repeat)
+                entry[name] = {"ms": ms, "correct": correct_share(parsed, truth)}
+            if "ms" in entry.get("legacy", {}):
+                entry["speedup"] = round(entry["legacy"]["ms"] / max(entry["engine"]["ms"], 0.1), 1)
+            report[f"{kind}/{rows}"] = entry
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
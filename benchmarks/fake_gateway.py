@@ -0,0 +1,201 @@
+"""Локальная заглушка шлюза LLM с OpenAI-совместимым методом POST /chat/completions.
+
+Отвечает заготовками по виду промпта (метрика дашборда, область, характеристики ряда, совмещенный
+анализ, ответ в чате) с настраиваемой задержкой и долей ошибок, считает запросы, объем принятых данных
+и токены из usage. capacity ограничивает число одновременно обслуживаемых запросов, как квота шлюза:
+остальные ждут своей очереди. С upstream запросы пересылаются в настоящий шлюз, а заглушка только ведет учет.
+Используется нагрузочным тестом; запускается и отдельно, чтобы направить на нее приложение:
+    python benchmarks/fake_gateway.py --port 8900 --latency 300
+    API_BASE_URL=http://127.0.0.1:8900 streamlit run server.py
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DASHBOARD_ANSWER = '```json\n{"main_metric": "Цена золота, руб. за грамм"}\n```'
+DOMAIN_ANSWER = '```json\n{"domain": "Финансы"}\n```'
+TIMESERIES_ANSWER = "```json\n" + json.dumps({
+    "metric": "Цена золота, руб. за грамм",
+    "domain": "Финансы",
+    "trend": "На всем периоде наблюдается восходящий тренд с коррекцией в середине периода",
+    "seasonality": "Выраженной сезонности не обнаружено",
+    "min_value": "1000 на 1 января 2015 года",
+    "max_value": "6000 на 1 декабря 2023 года",
+    "anomalies": [],
+    "hypotheses": "Рост цены связан с ослаблением рубля и спросом на защитные активы"
+}, ensure_ascii=False) + "\n```"
+COMBINED_ANSWER = TIMESERIES_ANSWER.replace('{"metric"', '{"main_metric"', 1)
+TEXT_ANSWER = "Цена золота за период выросла примерно в шесть раз, выраженной сезонности нет."
+
+
+def prompt_text(payload: dict) -> str:
+    """Текст всех сообщений запроса (части с изображениями пропускаются)."""
+    parts = []
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "\n".join(parts)
+
+
+def answer_for(text: str) -> str:
+    if "- main_metric:" in text and "- trend:" in text:
+        return COMBINED_ANSWER
+    if '"main_metric"' in text:
+        return DASHBOARD_ANSWER
+    if '"domain"' in text and "область применения" in text:
+        return DOMAIN_ANSWER
+    if "Извлеки следующие характеристики" in text:
+        return TIMESERIES_ANSWER
+    return TEXT_ANSWER
+
+
+class FakeGateway:
+    """HTTP-сервер заглушки в фоновом потоке; base_url передается клиенту API."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.2, jitter: float = 0.05,
+                 error_rate: float = 0.0, seed: int = 0, upstream: str = None, capacity: int = 0):
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.capacity = threading.BoundedSemaphore(capacity) if capacity else None
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "request_bytes": 0, "images": 0,
+                      "prompt_tokens": 0, "completion_tokens": 0, "models": {}}
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handler(self):
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                payload = json.loads(body or b"{}")
+                images = body.count(b"data:image/")
+                with gateway.lock:
+                    gateway.stats["requests"] += 1
+                    gateway.stats["request_bytes"] += len(body)
+                    gateway.stats["images"] += images
+                    model = payload.get("model", "fake")
+                    gateway.stats["models"][model] = gateway.stats["models"].get(model, 0) + 1
+                    failed = gateway.random.random() < gateway.error_rate
+                    delay = max(0.0, gateway.latency + gateway.random.uniform(-gateway.jitter, gateway.jitter))
+                if gateway.upstream:
+                    self.forward(body)
+                    return
+                if gateway.capacity:
+                    with gateway.capacity:
+                        time.sleep(delay)
+                else:
+                    time.sleep(delay)
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.reply(404, {"error": {"message": f"Неизвестный метод {self.path}"}})
+                    return
+                if failed:
+                    with gateway.lock:
+                        gateway.stats["errors"] += 1
+                    self.reply(503, {"error": {"message": "Заглушка: имитация отказа шлюза", "type": "server_error"}})
+                    return
+                text = prompt_text(payload)
+                content = answer_for(text)
+                # Оценка usage: ~3 байта текста на токен и 765 токенов на изображение (высокая детализация)
+                usage = {"prompt_tokens": len(text.encode("utf-8")) // 3 + 765 * images,
+                         "completion_tokens": len(content.encode("utf-8")) // 3}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                gateway.record_usage(usage)
+                self.reply(200, {
+                    "id": f"chatcmpl-fake-{gateway.stats['requests']}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": payload.get("model", "fake"),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": "stop"}],
+                    "usage": usage
+                })
+
+            def forward(self, body: bytes):
+                headers = {key: value for key, value in self.headers.items()
+                           if key.lower() in ("authorization", "content-type", "accept")}
+                request = urllib.request.Request(gateway.upstream + self.path, data=body, headers=headers, method="POST")
+                try:
+                    with urllib.request.urlopen(request, timeout=300) as response:
+                        status, raw = response.status, response.read()
+                except urllib.error.HTTPError as e:
+                    status, raw = e.code, e.read()
+                if status >= 400:
+                    with gateway.lock:
+                        gateway.stats["errors"] += 1
+                else:
+                    try:
+                        gateway.record_usage(json.loads(raw).get("usage") or {})
+                    except ValueError:
+                        pass
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+            def reply(self, status: int, data: dict):
+                raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(raw)))
+                self.end_headers()
+                self.wfile.write(raw)
+
+        return Handler
+
+    def record_usage(self, usage: dict):
+        with self.lock:
+            self.stats["prompt_tokens"] += int(usage.get("prompt_tokens") or 0)
+            self.stats["completion_tokens"] += int(usage.get("completion_tokens") or 0)
+
+    def start(self) -> "FakeGateway":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка шлюза LLM")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=300, help="задержка ответа, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов с ошибкой 503")
+    parser.add_argument("--capacity", type=int, default=0, help="одновременно обслуживаемых запросов (0 — без предела)")
+    parser.add_argument("--upstream", help="адрес настоящего шлюза: запросы пересылаются туда с учетом usage")
+    args = parser.parse_args()
+    gateway = FakeGateway(port=args.port, latency=args.latency / 1000, error_rate=args.error_rate,
+                          upstream=args.upstream, capacity=args.capacity)
+    print(f"Заглушка шлюза: {gateway.base_url}")
+    try:
+        gateway.server.serve_forever()
+    except KeyboardInterrupt:
+        gateway.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Размер изображений дашборда для модели с обрезкой до областей содержимого и без нее.
+
+Для каждого изображения и каждой ступени уменьшения (IMAGE_SIDE_LADDER и исходный размер) считаются
+размер после кодирования в base64, оценка токенов изображения и время подготовки (с поиском областей
+и с обрезкой из кэша). По умолчанию берутся изображения из uploads/ и синтетический дашборд с широкими
+полями, как у полноэкранного снимка.
+
+Запуск из корня проекта:
+    python benchmarks/image_roi_benchmark.py
+    python benchmarks/image_roi_benchmark.py path/to/dashboard.png --repeat 10
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+
+def full_screen_capture(directory: Path) -> Path:
+    """Снимок экрана 1920x1080: график с заголовком и легендой в середине, по краям — пустые поля."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (1920, 1080), "white")
+    draw = ImageDraw.Draw(image)
+    draw.text((420, 140), "Gold price, RUB per gram", fill="black")
+    draw.rectangle((420, 200, 1500, 760), outline=(220, 220, 220))
+    points = [(420 + i * 9, 700 - (i * 37 % 400) - i) for i in range(120)]
+    draw.line(points, fill="goldenrod", width=3)
+    draw.text((900, 800), "— Gold (Bank of Russia)", fill="gray")
+    path = directory / "full_screen.png"
+    image.save(path)
+    return path
+
+
+def measure(path: Path, repeat: int) -> dict:
+    import image_roi
+    from config import IMAGE_SIDE_LADDER
+    from token_budget import encode_image_scaled, estimate_image_tokens
+
+    result = {}
+    for enabled in (False, True):
+        image_roi.IMAGE_ROI_ENABLED = enabled
+        steps = {}
+        for side in (None,) + tuple(IMAGE_SIDE_LADDER):
+            cold, warm = [], []
+            for _ in range(repeat):
+                # Первый вызов после сброса кэша включает поиск областей, второй берет обрезку из кэша
+                image_roi._cropped.cache_clear()
+                for timings in (cold, warm):
+                    started = time.perf_counter()
+                    encoded, (width, height) = encode_image_scaled(str(path), side)
+                    timings.append(time.perf_counter() - started)
+            steps[str(side or "исходный")] = {"size": f"{width}x{height}", "base64_bytes": len(encoded),
+                                              "image_tokens": estimate_image_tokens(width, height),
+                                              "encode_ms": round(statistics.median(cold) * 1000, 1),
+                                              "cached_encode_ms": round(statistics.median(warm) * 1000, 1)}
+        result["roi" if enabled else "full"] = steps
+    result["saving"] = {
+        side: {"bytes": round(1 - result["roi"][side]["base64_bytes"] / result["full"][side]["base64_bytes"], 3),
+               "tokens": round(1 - result["roi"][side]["image_tokens"] / result["full"][side]["image_tokens"], 3)}
+        for side in result["full"]
+    }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Размер изображений дашборда с обрезкой до областей и без нее")
+    parser.add_argument("images", nargs="*", type=Path, help="изображения (по умолчанию uploads/ и синтетическое)")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов замера времени")
+    parser.add_argument("--json", help="путь для сохранения отчета в JSON")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    images = list(args.images)
+    if not images:
+        images = sorted(path for path in (ROOT / "uploads").glob("*") if path.suffix.lower() in (".png", ".jpg", ".jpeg"))
+        images.append(full_screen_capture(Path(tempfile.mkdtemp(prefix="roi_"))))
+    report = {path.name: measure(path, args.repeat) for path in images}
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Нагрузочный тест: N одновременных сессий server.py против локальной заглушки шлюза LLM.
+
+Каждая сессия — отдельный headless-клиент Streamlit (AppTest) в общем процессе, как сессии
+одного процесса `streamlit run`: открытие страницы, загрузка изображения и данных через виджеты,
+нажатие «Запустить» и несколько вопросов в чат. Запросы к модели уходят в FakeGateway
+(benchmarks/fake_gateway.py) с заданной задержкой и долей отказов.
+
+Директории загрузки общие для всех сессий процесса: одновременные загрузки перезаписывают файлы
+друг друга, а анализ одних и тех же файлов выполняет первая сессия, остальные получают результат
+из хранилища (как и в рабочем режиме). С --no-upload файлы кладутся в директории заранее.
+Тест выполняется во временной рабочей директории и не затрагивает uploads/, data/ и cache/ проекта.
+
+Запуск из корня проекта:
+    python benchmarks/load_test.py --sessions 20 --concurrency 10 --turns 3 --latency 300
+"""
+import argparse
+import json
+import logging
+import mimetypes
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fake_gateway import FakeGateway  # noqa: E402
+
+STEP_KINDS = ("open", "upload", "annotate", "chat")
+
+QUESTIONS = (
+    "Какая метрика показана на дашборде?",
+    "Какой тренд у ряда?",
+    "Когда было максимальное значение?",
+    "Есть ли сезонность?",
+    "Что написано в легенде графика?"
+)
+
+
+def rss_mb() -> float:
+    """Текущий резидентный объем памяти процесса (на Linux — из /proc, иначе пиковый)."""
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def synthetic_inputs(directory: Path):
+    """Дашборд (PNG с линейным графиком) и CSV месячного ряда за 10 лет."""
+    import numpy as np
+    import pandas as pd
+    from PIL import Image, ImageDraw
+
+    rng = np.random.default_rng(0)
+    dates = pd.date_range("2014-01-01", periods=120, freq="MS")
+    values = 1000 + np.cumsum(rng.normal(40, 60, len(dates)))
+    data_path = directory / "gold.csv"
+    pd.DataFrame({"Дата": dates.strftime("%Y-%m-%d"), "Цена": values.round(2)}).to_csv(data_path, index=False)
+
+    image = Image.new("RGB", (1200, 700), "white")
+    draw = ImageDraw.Draw(image)
+    scaled = 650 - (values - values.min()) / (values.max() - values.min()) * 600
+    draw.line([(50 + i * 9, float(y)) for i, y in enumerate(scaled)], fill="goldenrod", width=3)
+    draw.text((50, 10), "Gold price, RUB", fill="black")
+    image_path = directory / "dashboard.png"
+    image.save(image_path)
+    return image_path, data_path
+
+
+def prepare_workdir(image: Path, data: Path, place_files: bool) -> Path:
+    workdir = Path(tempfile.mkdtemp(prefix="loadtest_"))
+    for name, source in (("uploads", image), ("data", data)):
+        (workdir / name).mkdir()
+        if place_files:
+            shutil.copy(source, workdir / name / source.name)
+    return workdir
+
+
+def share_test_runtime():
+    """Позволяет прогонять несколько AppTest одновременно в потоках одного процесса.
+
+    AppTest подставляет глобальный Runtime на время прогона и обнуляет его по окончании, поэтому
+    завершившаяся сессия ломает еще идущие («Runtime hasn't been created»). После подмены Runtime
+    остается доступным последний подставленный экземпляр.
+    """
+    from streamlit.runtime.runtime import Runtime
+
+    original = Runtime.instance.__func__
+    last = {}
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+            return cls._instance
+        return last["runtime"] if "runtime" in last else original(cls)
+
+    Runtime.instance = classmethod(instance)
+
+
+# Ответы, которыми приложение заменяет недоступную модель: отказ всех агентов в чате и локальная аннотация
+DEGRADED_MARKERS = ("Пожалуйста, переформулируйте", "рассчитаны локально")
+
+
+def is_degraded(app) -> bool:
+    history = app.session_state["chat_history"] if "chat_history" in app.session_state else []
+    return bool(history) and any(marker in str(history[-1]["content"]) for marker in DEGRADED_MARKERS)
+
+
+def check_step(app, kind: str, messages_before: int):
+    """Ошибка шага: исключение скрипта, сообщение об ошибке в состоянии или ответ, начинающийся с «Ошибка»."""
+    if app.exception:
+        return f"{kind}: исключение {app.exception[0].message}"
+    state = app.session_state
+    if "error_message" in state and state["error_message"]:
+        return f"{kind}: {state['error_message']}"
+    history = state["chat_history"] if "chat_history" in state else []
+    if len(history) <= messages_before:
+        return f"{kind}: нет ответа в чате"
+    if str(history[-1]["content"]).startswith("Ошибка"):
+        return f"{kind}: {history[-1]['content'][:120]}"
+    return None
+
+
+def run_session(index: int, turns: int, timeout: float, uploads):
+    """Сценарий одной сессии; возвращает записи шагов и объект AppTest (он удерживает состояние сессии)."""
+    from streamlit.testing.v1 import AppTest
+
+    steps = []
+    app = AppTest.from_file(str(ROOT / "server.py"), default_timeout=timeout)
+
+    def step(kind: str, action, check: bool = True):
+        before = len(app.session_state["chat_history"]) if "chat_history" in app.session_state else 0
+        started = time.perf_counter()
+        error, degraded = None, False
+        try:
+            action()
+            if check:
+                error = check_step(app, kind, before)
+                degraded = error is None and is_degraded(app)
+        except Exception as e:
+            error = f"{kind}: {type(e).__name__}: {e}"
+        steps.append({"session": index, "kind": kind, "seconds": time.perf_counter() - started, "error": error,
+                      "degraded": degraded})
+        return error is None
+
+    step("open", app.run, check=False)
+    for key, (name, content, mime) in uploads.items():
+        step("upload", lambda: app.file_uploader(key=key).upload(name, content, mime).run(), check=False)
+    if not step("annotate", lambda: app.button(key="run_button").click().run()):
+        return steps, app
+    for turn in range(turns):
+        question = QUESTIONS[(index + turn) % len(QUESTIONS)]
+        step("chat", lambda: app.chat_input(key="chat_input_main").set_value(question).run())
+    return steps, app
+
+
+def percentiles(values):
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+
+    def at(share):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * share))] * 1000, 1)
+
+    return {"count": len(ordered), "mean_ms": round(statistics.mean(ordered) * 1000, 1),
+            "p50_ms": at(0.5), "p90_ms": at(0.9), "p95_ms": at(0.95), "p99_ms": at(0.99),
+            "max_ms": round(ordered[-1] * 1000, 1)}
+
+
+def rates(kind_steps):
+    total = max(1, len(kind_steps))
+    errors = sum(1 for s in kind_steps if s["error"])
+    degraded = sum(1 for s in kind_steps if s["degraded"])
+    return {"count": errors, "rate": round(errors / total, 4),
+            "degraded": degraded, "degraded_rate": round(degraded / total, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест server.py с заглушкой шлюза LLM")
+    parser.add_argument("--sessions", type=int, default=10, help="число сессий")
+    parser.add_argument("--concurrency", type=int, default=5, help="сессий одновременно")
+    parser.add_argument("--turns", type=int, default=3, help="вопросов в чат на сессию")
+    parser.add_argument("--latency", type=float, default=300, help="задержка ответа заглушки, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля отказов заглушки (503)")
+    parser.add_argument("--timeout", type=float, default=300, help="таймаут одного прогона скрипта, с")
+    parser.add_argument("--image", type=Path, help="изображение дашборда (по умолчанию синтетическое)")
+    parser.add_argument("--data", type=Path, help="файл данных CSV/XLSX (по умолчанию синтетический)")
+    parser.add_argument("--no-upload", action="store_true", help="не загружать файлы через виджеты в каждой сессии")
+    parser.add_argument("--json", help="путь для сохранения отчета в JSON")
+    args = parser.parse_args()
+
+    gateway = FakeGateway(latency=args.latency / 1000, error_rate=args.error_rate).start()
+    # Адрес шлюза читается config при импорте, поэтому задается до первого импорта модулей приложения
+    os.environ["API_BASE_URL"] = gateway.base_url
+    os.environ.setdefault("API_KEY", "load-test")
+    logging.disable(logging.INFO)
+
+    inputs_dir = Path(tempfile.mkdtemp(prefix="loadtest_inputs_"))
+    image, data = synthetic_inputs(inputs_dir)
+    image, data = args.image or image, args.data or data
+    workdir = prepare_workdir(image, data, args.no_upload)
+    os.chdir(workdir)
+    uploads = {} if args.no_upload else {
+        "image_uploader": (image.name, image.read_bytes(), mimetypes.guess_type(image.name)[0] or "image/png"),
+        "data_uploader": (data.name, data.read_bytes(), mimetypes.guess_type(data.name)[0] or "text/csv")
+    }
+
+    # Прогрев: импорт модулей приложения и первый прогон скрипта не относятся к нагрузке сессий
+    from streamlit.testing.v1 import AppTest
+    share_test_runtime()
+    AppTest.from_file(str(ROOT / "server.py"), default_timeout=args.timeout).run()
+
+    memory_before = rss_mb()
+    live_sessions = []
+    lock = threading.Lock()
+    steps = []
+
+    def session(index):
+        session_steps, app = run_session(index, args.turns, args.timeout, uploads)
+        with lock:
+            steps.extend(session_steps)
+            live_sessions.append(app)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(session, range(args.sessions)))
+    wall = time.perf_counter() - started
+    memory_after = rss_mb()
+    gateway.stop()
+
+    report = {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "turns": args.turns,
+        "gateway_latency_ms": args.latency,
+        "wall_seconds": round(wall, 2),
+        "throughput": {
+            "sessions_per_minute": round(args.sessions / wall * 60, 2),
+            "chat_turns_per_second": round(sum(s["kind"] == "chat" for s in steps) / wall, 3),
+            "steps_per_second": round(len(steps) / wall, 3)
+        },
+        "latency": {kind: percentiles([s["seconds"] for s in steps if s["kind"] == kind])
+                    for kind in STEP_KINDS},
+        "errors": {kind: rates([s for s in steps if s["kind"] == kind]) for kind in STEP_KINDS},
+        "error_samples": sorted({s["error"] for s in steps if s["error"]})[:10],
+        "memory": {
+            "rss_before_mb": round(memory_before, 1),
+            "rss_after_mb": round(memory_after, 1),
+            "per_session_mb": round((memory_after - memory_before) / max(1, len(live_sessions)), 2)
+        },
+        "gateway": gateway.stats
+    }
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+    shutil.rmtree(inputs_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Профиль процессора и памяти по этапам для одного прохода обработки: загрузка данных и граф аннотации.
+
+Загрузка данных выполняется так же, как в upload_data_callback (разбор файла из буфера и колоночная
+копия), затем граф аннотации прогоняется --runs раз в новой временной рабочей директории. Запросы
+к модели обслуживает заглушка шлюза (benchmarks/fake_gateway.py), поэтому в профиле остается
+собственная работа приложения. Каждый этап профилируется StageProfiler (profiling.py): профили
+cProfile, стеки для flamegraph и снимки tracemalloc сохраняются в --output, по ним печатается сводка.
+
+Запуск из корня проекта:
+    python benchmarks/profile_pipeline.py --runs 3
+    python benchmarks/profile_pipeline.py --image uploads/dashboard.png --data data/series.xlsx --output /tmp/profiles
+"""
+import argparse
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fake_gateway import FakeGateway  # noqa: E402
+from load_test import synthetic_inputs  # noqa: E402
+from combined_benchmark import initial_state  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Профиль процессора и памяти по этапам обработки")
+    parser.add_argument("--runs", type=int, default=1, help="прогонов графа аннотации")
+    parser.add_argument("--latency", type=float, default=50, help="задержка ответа заглушки, мс")
+    parser.add_argument("--image", type=Path, help="изображение дашборда (по умолчанию синтетическое)")
+    parser.add_argument("--data", type=Path, help="файл данных CSV/XLSX (по умолчанию синтетический)")
+    parser.add_argument("--output", type=Path, default=ROOT / "cache" / "profiles", help="директория профилей")
+    parser.add_argument("--no-memory", action="store_true", help="без снимков tracemalloc")
+    args = parser.parse_args()
+
+    gateway = FakeGateway(latency=args.latency / 1000).start()
+    # Адрес шлюза и режим профилирования читаются config при импорте
+    os.environ["API_BASE_URL"] = gateway.base_url
+    os.environ.setdefault("API_KEY", "profile-pipeline")
+    os.environ["PROFILE"] = "1"
+    os.environ["PROFILE_MEMORY"] = "0" if args.no_memory else "1"
+    os.environ["FOLLOWUP_PRECOMPUTE"] = "0"
+    logging.disable(logging.INFO)
+
+    from columnar_store import save_columnar
+    from graph_workflow import create_graph
+    from profiling import stage_profiler, summarize
+    from timeseries_analyzer import TimeSeriesAnalyzer
+
+    stage_profiler.directory = str(args.output.resolve())
+    inputs_dir = Path(tempfile.mkdtemp(prefix="profile_inputs_"))
+    image, data = synthetic_inputs(inputs_dir)
+    image, data = (args.image or image).resolve(), (args.data or data).resolve()
+
+    previous = os.getcwd()
+    for _ in range(args.runs):
+        workdir = Path(tempfile.mkdtemp(prefix="profile_run_"))
+        try:
+            os.chdir(workdir)
+            for name in ("uploads", "data"):
+                (workdir / name).mkdir()
+            shutil.copy(image, workdir / "uploads" / image.name)
+            data_path = workdir / "data" / data.name
+            with stage_profiler.profile("upload_data"):
+                df, message = TimeSeriesAnalyzer().read_data(Path(data.name), source=io.BytesIO(data.read_bytes()))
+                if df is None:
+                    sys.exit(message)
+                shutil.copy(data, data_path)
+                save_columnar(data_path, df)
+            create_graph().invoke(initial_state(str(Path("uploads") / image.name), str(Path("data") / data.name)))
+        finally:
+            os.chdir(previous)
+            shutil.rmtree(workdir, ignore_errors=True)
+    gateway.stop()
+    shutil.rmtree(inputs_dir, ignore_errors=True)
+
+    print(f"Профили: {stage_profiler.run_dir()}\n")
+    print(summarize(stage_profiler.run_dir(), top_n=10))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""Масштабирование локальной обработки данных: время и пиковая память этапов от 1e3 до 1e7 точек.
+
+Для каждого размера ряда и формата (CSV, XLSX) создается синтетический файл «Дата, Значение» и
+замеряются этапы:
+- read_data — TimeSeriesAnalyzer.read_data без колоночной копии и кэша листов Excel (первое чтение
+  загруженного файла, включая создание колоночной копии);
+- read_data_columnar — повторное чтение из колоночной копии;
+- prompt_frame — таблица «Дата, Значение» для промпта по всем точкам ряда (бывший temp_df
+  в analyze_time_series);
+- encode_data — TimeSeriesAnalyzer.encode_data этой таблицы (CSV в base64);
+- domain_encode_data — DomainSpecificAnalyzer.encode_data без колоночной копии;
+- read_data_preview — превью для интерфейса без колоночной копии.
+
+Как в pytest-benchmark, этап повторяется --rounds раз (но не дольше --max-time секунд) и по
+раундам считаются min/median/mean; пиковая память — отдельным прогоном под tracemalloc (учитываются
+выделения Python и NumPy; буферы pyarrow в нее не входят). По медианам для каждого этапа и формата
+оценивается показатель степени зависимости времени от числа точек (наклон в логарифмическом масштабе).
+
+Результаты сравниваются с сохраненной базовой линией (benchmarks/baselines/scaling.json): замедление
+лучшего раунда больше --time-threshold или рост памяти больше --memory-threshold (и больше абсолютных
+порогов шума) считаются регрессией, и скрипт завершается с кодом 1. Базовая линия зависит от машины
+(сохраненная снята на виртуальной машине с одним ядром, где время колеблется от запуска к запуску
+до полутора раз), поэтому при смене машины ее нужно сохранить заново; память от машины почти
+не зависит. Файлы XLSX больше 1 048 576 строк не поддерживаются Excel, поэтому XLSX ограничен
+--xlsx-max-rows.
+
+Запуск из корня проекта (без сети и шлюза):
+    python benchmarks/scaling_benchmark.py
+    python benchmarks/scaling_benchmark.py --sizes 1000 10000 100000 1000000 10000000 --xlsx-max-rows 1000000
+    python benchmarks/scaling_benchmark.py --save-baseline
+    python benchmarks/scaling_benchmark.py --check
+"""
+import argparse
+import json
+import logging
+import math
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+BASELINE_PATH = ROOT / "benchmarks" / "baselines" / "scaling.json"
+FORMATS = ("csv", "xlsx")
+# Абсолютные пороги шума: различия меньше них не считаются регрессией
+TIME_NOISE_MS = 5.0
+MEMORY_NOISE_KB = 512.0
+
+
+def make_input(directory: Path, fmt: str, rows: int) -> Path:
+    """Ряд из rows точек с шагом в минуту (1e7 точек укладываются в диапазон дат pandas)."""
+    path = directory / f"series_{rows}.{fmt}"
+    if path.exists():
+        return path
+    rng = np.random.default_rng(rows)
+    dates = pd.date_range("2000-01-01", periods=rows, freq="min")
+    values = np.round(1000 + np.cumsum(rng.normal(0, 5, rows)), 2)
+    if fmt == "csv":
+        pd.DataFrame({"Дата": dates.strftime("%Y-%m-%d %H:%M:%S"), "Значение": values}).to_csv(path, index=False)
+        return path
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Данные")
+    sheet.append(["Дата", "Значение"])
+    for date, value in zip(dates.to_pydatetime(), values.tolist()):
+        sheet.append([date, value])
+    workbook.save(path)
+    return path
+
+
+def reset_caches(path: Path):
+    """Удаляет колоночные копии и кэши процесса, чтобы этап читал исходный файл."""
+    import data_ingestion
+    import timeseries_analyzer
+    from config import COLUMNAR_DIRNAME
+
+    shutil.rmtree(path.parent / COLUMNAR_DIRNAME, ignore_errors=True)
+    data_ingestion._excel_cache.clear()
+    timeseries_analyzer._series_cache.clear()
+
+
+def stages():
+    """Этапы: имя -> (подготовка(path) -> аргумент, замеряемая функция(аргумент))."""
+    from columnar_store import read_data_preview, save_columnar
+    from domain_specific_analyzer import DomainSpecificAnalyzer
+    from timeseries_analyzer import TimeSeriesAnalyzer
+
+    analyzer = TimeSeriesAnalyzer()
+    domain_analyzer = DomainSpecificAnalyzer()
+
+    def raw(path):
+        reset_caches(path)
+        return path
+
+    def columnar(path):
+        reset_caches(path)
+        df, message = analyzer.read_data(path)
+        if df is None:
+            raise RuntimeError(message)
+        save_columnar(path, df)
+        return path
+
+    def series(path):
+        return analyzer.load_series(columnar(path))[0]
+
+    def frame(path):
+        return analyzer.prompt_frame(series(path))
+
+    return {
+        "read_data": (raw, lambda path: analyzer.read_data(path)),
+        "read_data_columnar": (columnar, lambda path: analyzer.read_data(path)),
+        "prompt_frame": (series, analyzer.prompt_frame),
+        "encode_data": (frame, analyzer.encode_data),
+        "domain_encode_data": (raw, lambda path: domain_analyzer.encode_data(str(path))),
+        "read_data_preview": (raw, lambda path: read_data_preview(str(path))),
+    }
+
+
+def measure(setup, run, path: Path, rounds: int, max_time: float) -> dict:
+    timings = []
+    while len(timings) < rounds and (not timings or sum(timings) < max_time):
+        argument = setup(path)
+        started = time.perf_counter()
+        run(argument)
+        timings.append(time.perf_counter() - started)
+    argument = setup(path)
+    tracemalloc.start()
+    try:
+        run(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"rounds": len(timings), "min_ms": round(min(timings) * 1000, 2),
+            "median_ms": round(statistics.median(timings) * 1000, 2),
+            "mean_ms": round(statistics.mean(timings) * 1000, 2), "peak_kb": round(peak / 1024, 1)}
+
+
+def scaling_exponents(results: dict) -> dict:
+    """Наклон log(время) от log(точек) по медианам для каждого формата и этапа (1 — линейный рост)."""
+    points = {}
+    for key, result in results.items():
+        fmt, rows, stage = key.split("/")
+        if result["median_ms"] >= 1.0:
+            points.setdefault(f"{fmt}/{stage}", []).append((math.log(int(rows)), math.log(result["median_ms"])))
+    return {key: round(float(np.polyfit(*zip(*values), 1)[0]), 2)
+            for key, values in sorted(points.items()) if len(values) >= 2}
+
+
+def regressions(results: dict, baseline: dict, time_threshold: float, memory_threshold: float) -> list:
+    found = []
+    for key, result in results.items():
+        old = baseline.get("results", {}).get(key)
+        if old is None:
+            continue
+        # Время сравнивается по лучшему раунду: он меньше всего зависит от соседней нагрузки на машине
+        if result["min_ms"] > old["min_ms"] * (1 + time_threshold) and result["min_ms"] - old["min_ms"] > TIME_NOISE_MS:
+            found.append(f"{key}: время {old['min_ms']} -> {result['min_ms']} мс")
+        if result["peak_kb"] > old["peak_kb"] * (1 + memory_threshold) \
+                and result["peak_kb"] - old["peak_kb"] > MEMORY_NOISE_KB:
+            found.append(f"{key}: память {old['peak_kb']} -> {result['peak_kb']} КБ")
+    return found
+
+
+def table(results: dict) -> str:
+    lines = [f"{'формат/точек/этап':<40}{'раундов':>8}{'медиана, мс':>13}{'мин, мс':>11}{'пик, КБ':>12}"]
+    for key, result in results.items():
+        lines.append(f"{key:<40}{result['rounds']:>8}{result['median_ms']:>13.2f}{result['min_ms']:>11.2f}"
+                     f"{result['peak_kb']:>12.1f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Масштабирование локальной обработки данных")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000],
+                        help="число точек ряда")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS)
+    parser.add_argument("--xlsx-max-rows", type=int, default=100_000, help="наибольший размер для XLSX")
+    parser.add_argument("--stages", nargs="+", help="только указанные этапы")
+    parser.add_argument("--rounds", type=int, default=5, help="наибольшее число раундов на этап")
+    parser.add_argument("--max-time", type=float, default=2.0, help="время на раунды одного этапа, с")
+    parser.add_argument("--inputs", type=Path, help="директория для синтетических файлов (переиспользуются)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH, help="файл базовой линии")
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как базовую линию")
+    parser.add_argument("--check", action="store_true", help="сравнить с базовой линией (код 1 при регрессии)")
+    parser.add_argument("--time-threshold", type=float, default=0.5, help="допустимое замедление, доля")
+    parser.add_argument("--memory-threshold", type=float, default=0.2, help="допустимый рост памяти, доля")
+    parser.add_argument("--json", help="путь для сохранения отчета в JSON")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    inputs = args.inputs or Path(tempfile.mkdtemp(prefix="scaling_"))
+    inputs.mkdir(parents=True, exist_ok=True)
+    selected = {name: stage for name, stage in stages().items() if not args.stages or name in args.stages}
+
+    results = {}
+    for fmt in args.formats:
+        for rows in sorted(args.sizes):
+            if fmt == "xlsx" and rows > min(args.xlsx_max_rows, 1_048_575):
+                continue
+            directory = inputs / fmt
+            directory.mkdir(exist_ok=True)
+            path = make_input(directory, fmt, rows)
+            for name, (setup, run) in selected.items():
+                results[f"{fmt}/{rows}/{name}"] = measure(setup, run, path, args.rounds, args.max_time)
+                print(f"{fmt}/{rows}/{name}: {results[f'{fmt}/{rows}/{name}']['median_ms']} мс", file=sys.stderr)
+    if not args.inputs:
+        shutil.rmtree(inputs, ignore_errors=True)
+
+    report = {
+        "meta": {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                 "machine": platform.machine(), "processor": platform.processor() or platform.machine()},
+        "results": results,
+        "scaling_exponents": scaling_exponents(results),
+    }
+    print(table(results))
+    print("\nПоказатель степени роста времени от числа точек:")
+    for key, exponent in report["scaling_exponents"].items():
+        print(f"  {key:<32}{exponent:>6}")
+
+    exit_code = 0
+    if args.check:
+        if not args.baseline.exists():
+            sys.exit(f"Базовая линия {args.baseline} не найдена: сохраните ее с --save-baseline")
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(results, json.load(f), args.time_threshold, args.memory_threshold)
+        report["regressions"] = found
+        print("\nРегрессии относительно базовой линии:" if found else "\nРегрессий относительно базовой линии нет")
+        for line in found:
+            print(f"  {line}")
+        exit_code = 1 if found else 0
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({key: report[key] for key in ("meta", "results", "scaling_exponents")}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"\nБазовая линия сохранена: {args.baseline}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Задержка запросов чата под пакетной нагрузкой: с планировщиком запросов к шлюзу и без него.
+
+Заглушка шлюза (benchmarks/fake_gateway.py) обслуживает не более --capacity запросов одновременно, как
+квота настоящего шлюза. Пакетная нагрузка — --batch потоков, непрерывно отправляющих запросы класса
+batch (как анализ рядов при пакетной аннотации); интерактивная — --sessions сессий, задающих по
+--turns вопросов с паузой между ними. Прогоняются три фазы: без пакетной нагрузки, с ней при
+выключенном планировщике и с ней при включенном; для каждой — перцентили задержки запросов чата.
+
+Запуск из корня проекта:
+    python benchmarks/scheduler_benchmark.py --capacity 4 --batch 16 --sessions 4 --turns 10 --latency 300
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fake_gateway import FakeGateway  # noqa: E402
+from load_test import percentiles  # noqa: E402
+
+PHASES = (("interactive_only", False, True), ("batch_without_scheduler", True, False),
+          ("batch_with_scheduler", True, True))
+
+
+def request(text: str):
+    from config import get_client
+
+    return lambda model: get_client().chat.completions.create(
+        model=model, messages=[{"role": "user", "content": text}], max_tokens=100
+    )
+
+
+def run_phase(sessions: int, turns: int, think: float, batch: int, scheduler_enabled: bool) -> dict:
+    from gateway_scheduler import gateway_scheduler
+    from model_router import model_router
+
+    gateway_scheduler.enabled = scheduler_enabled
+    stop = threading.Event()
+    latencies, batch_done = [], [0]
+    lock = threading.Lock()
+
+    def batch_worker(index):
+        with model_router.background("batch"), gateway_scheduler.context(session="batch"):
+            while not stop.is_set():
+                try:
+                    model_router.call("analyze_time_series", request(f"Пакетная аннотация {index}"))
+                except Exception:
+                    pass
+                with lock:
+                    batch_done[0] += 1
+
+    def session_worker(index):
+        with gateway_scheduler.context(session=f"session-{index}"):
+            for turn in range(turns):
+                started = time.perf_counter()
+                try:
+                    model_router.call("process_user_query", request(f"Вопрос {turn} сессии {index}"))
+                except Exception:
+                    pass
+                with lock:
+                    latencies.append(time.perf_counter() - started)
+                time.sleep(think)
+
+    batch_threads = [threading.Thread(target=batch_worker, args=(i,), daemon=True) for i in range(batch)]
+    for thread in batch_threads:
+        thread.start()
+    # Пакетная нагрузка успевает заполнить очередь до первых вопросов
+    time.sleep(0.5 if batch else 0)
+    started = time.perf_counter()
+    session_threads = [threading.Thread(target=session_worker, args=(i,)) for i in range(sessions)]
+    for thread in session_threads:
+        thread.start()
+    for thread in session_threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    stop.set()
+    for thread in batch_threads:
+        thread.join()
+    return {"chat": percentiles(latencies), "batch_requests_per_second": round(batch_done[0] / wall, 2),
+            "scheduler": gateway_scheduler.report() if scheduler_enabled else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка чата под пакетной нагрузкой с планировщиком и без")
+    parser.add_argument("--capacity", type=int, default=4, help="одновременно обслуживаемых заглушкой запросов")
+    parser.add_argument("--batch", type=int, default=16, help="потоков пакетной нагрузки")
+    parser.add_argument("--sessions", type=int, default=4, help="интерактивных сессий")
+    parser.add_argument("--turns", type=int, default=10, help="вопросов на сессию")
+    parser.add_argument("--think", type=float, default=0.2, help="пауза между вопросами сессии, с")
+    parser.add_argument("--latency", type=float, default=300, help="задержка ответа заглушки, мс")
+    parser.add_argument("--json", help="путь для сохранения отчета в JSON")
+    args = parser.parse_args()
+
+    gateway = FakeGateway(latency=args.latency / 1000, jitter=0.0, capacity=args.capacity).start()
+    # Адрес шлюза и квота читаются config при импорте, поэтому задаются до первого импорта модулей приложения
+    os.environ["API_BASE_URL"] = gateway.base_url
+    os.environ.setdefault("API_KEY", "scheduler-benchmark")
+    os.environ["GATEWAY_MAX_CONCURRENCY"] = str(args.capacity)
+    os.environ["MODEL_AUTO_SELECT"] = "0"
+    logging.disable(logging.WARNING)
+
+    # Прогрев: импорт клиента и первое соединение не относятся к измеряемым фазам
+    from model_router import model_router
+    model_router.call("process_user_query", request("Прогрев"))
+
+    report = {"capacity": args.capacity, "batch_threads": args.batch, "sessions": args.sessions,
+              "gateway_latency_ms": args.latency, "phases": {}}
+    for name, with_batch, scheduler_enabled in PHASES:
+        report["phases"][name] = run_phase(args.sessions, args.turns, args.think, args.batch if with_batch else 0,
+                                           scheduler_enabled)
+    gateway.stop()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
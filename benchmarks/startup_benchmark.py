@@ -0,0 +1,99 @@
+"""Замер времени холодного старта и повторных запусков (rerun) скрипта server.py.
+
+Каждый холодный старт выполняется в отдельном процессе: импорт модулей и первый прогон скрипта
+через headless-клиент Streamlit (AppTest). Повторные запуски измеряются в одном процессе —
+так же, как Streamlit выполняет скрипт заново при каждом взаимодействии пользователя.
+
+Запуск из корня проекта:
+    python benchmarks/startup_benchmark.py --cold 5 --reruns 20
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+COLD_START_SNIPPET = """
+import time
+started = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file("server.py", default_timeout=120)
+app.run()
+print(time.perf_counter() - started)
+"""
+
+GRAPH_BUILD_SNIPPET = """
+import time
+started = time.perf_counter()
+from graph_workflow import create_graph
+create_graph()
+print(time.perf_counter() - started)
+"""
+
+
+def run_snippet(snippet: str) -> float:
+    """Выполняет фрагмент в новом процессе и возвращает измеренное им время в секундах."""
+    result = subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_reruns(count: int):
+    """Первый прогон и count повторных прогонов server.py в одном процессе."""
+    from streamlit.testing.v1 import AppTest
+
+    os.chdir(ROOT)
+    sys.path.insert(0, str(ROOT))
+    app = AppTest.from_file(str(ROOT / "server.py"), default_timeout=120)
+    started = time.perf_counter()
+    app.run()
+    first = time.perf_counter() - started
+    timings = []
+    for _ in range(count):
+        started = time.perf_counter()
+        app.run()
+        timings.append(time.perf_counter() - started)
+    return first, timings
+
+
+def summarize(timings):
+    ordered = sorted(timings)
+    return {
+        "runs": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 1),
+        "median_ms": round(statistics.median(ordered) * 1000, 1),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        "max_ms": round(ordered[-1] * 1000, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк холодного старта и rerun для server.py")
+    parser.add_argument("--cold", type=int, default=3, help="число холодных стартов (отдельные процессы)")
+    parser.add_argument("--reruns", type=int, default=20, help="число повторных прогонов в одном процессе")
+    parser.add_argument("--json", help="путь для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    report = {
+        "cold_start": summarize([run_snippet(COLD_START_SNIPPET) for _ in range(args.cold)]),
+        "graph_build": summarize([run_snippet(GRAPH_BUILD_SNIPPET) for _ in range(args.cold)])
+    }
+    first, reruns = measure_reruns(args.reruns)
+    report["first_run_in_process_ms"] = round(first * 1000, 1)
+    report["rerun"] = summarize(reruns)
+
+    for name, stats in report.items():
+        print(f"{name}: {stats}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,25 @@
 import json
 from typing import Dict, Optional, List
-from config import llm, logger
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from config import logger, ANSWER_CACHE_ENABLED
+from answer_cache import answer_cache, dataset_key, depends_on_context, features_version
+from followup_precompute import followup_precomputer
+from session_usage import SessionQuotaExceeded, session_usage
 from dashboard_analyzer import DashboardAnalyzer
 from domain_specific_analyzer import DomainSpecificAnalyzer
 from timeseries_analyzer import TimeSeriesAnalyzer
+from model_router import model_router
+from prompt_registry import get_chain
+from token_budget import history_context
 
 
 class ChatAgent:
-    def __init__(self):
-        self.dashboard_analyzer = DashboardAnalyzer()
-        self.domain_analyzer = DomainSpecificAnalyzer()
-        self.timeseries_analyzer = TimeSeriesAnalyzer()
+    def __init__(self, dashboard_analyzer: Optional[DashboardAnalyzer] = None,
+                 domain_analyzer: Optional[DomainSpecificAnalyzer] = None,
+                 timeseries_analyzer: Optional[TimeSeriesAnalyzer] = None):
+        # Анализаторы можно передать из графа, чтобы не создавать их повторно
+        self.dashboard_analyzer = dashboard_analyzer or DashboardAnalyzer()
+        self.domain_analyzer = domain_analyzer or DomainSpecificAnalyzer()
+        self.timeseries_analyzer = timeseries_analyzer or TimeSeriesAnalyzer()
 
     def generate_general_annotation(self, ts_features: Dict) -> str:
         """Создает аннотацию на основе характеристик временного ряда через LLM."""
@@ -22,44 +29,70 @@ class ChatAgent:
             logger.error(error_msg)
             return error_msg
 
-        prompt = ChatPromptTemplate.from_template(
-            """Ты аналитик данных. На основе характеристик временного ряда составь аннотацию по следующему плану:
-            1. Опиши область и метрику дашборда одним предложением.
-            2. Опиши тренды и сезонность, указав их характер и особенности.
-            3. Укажи максимальное и минимальное значения с датами.
-            4. Опиши обнаруженные аномалии, если они есть, или укажи их отсутствие.
-            5. Предложи гипотезы, объясняющие тренды, сезонность или аномалии.
-
-            Характеристики временного ряда: {ts_features}
-
-            Верни аннотацию одним абзацем, кратко и естественно, как для человека, используя термины в нужной области.
-            Не используй подзаголовки или списки, только связный текст.
-            Если данные отсутствуют или некорректны, укажи это в аннотации."""
-        )
-
-        chain = prompt | llm | StrOutputParser()
+        values = {"ts_features": json.dumps(ts_features, ensure_ascii=False)}
 
         try:
-            response = chain.invoke({
-                "ts_features": json.dumps(ts_features, ensure_ascii=False)
-            })
+            response = model_router.call("generate_general_annotation",
+                                         lambda model: get_chain("generate_general_annotation", model).invoke(values))
             logger.info(f"Сгенерирована аннотация: {response}")
             return response
         except Exception as e:
             logger.error(f"Ошибка при генерации аннотации: {str(e)}")
             return f"Ошибка генерации аннотации: {str(e)}"
 
+    def revise_annotation(self, previous_annotation: str, ts_features: Dict, changes: List[str]) -> str:
+        """Дополняет существующую аннотацию с учетом существенных изменений после дозаписи данных."""
+        values = {
+            "previous_annotation": previous_annotation,
+            "ts_features": json.dumps(ts_features, ensure_ascii=False),
+            "changes": "; ".join(changes)
+        }
+
+        try:
+            response = model_router.call("revise_annotation",
+                                         lambda model: get_chain("revise_annotation", model).invoke(values))
+            logger.info(f"Аннотация обновлена: {response}")
+            return response
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении аннотации: {str(e)}")
+            return previous_annotation
+
     def process_user_query(self, query: str, image_path: Optional[str], data_path: Optional[str],
                            chat_history: List[Dict], dash_features: Optional[Dict] = None,
-                           domain_features: Optional[Dict] = None, ts_features: Optional[Dict] = None) -> str:
-        """Пересылает запрос пользователя агентам и объединяет их ответы."""
-        context = "\n".join([f"{msg['role']}: {msg['content']}" for msg in chat_history[-5:]])
+                           domain_features: Optional[Dict] = None, ts_features: Optional[Dict] = None,
+                           session_id: Optional[str] = None) -> str:
+        """Пересылает запрос пользователя агентам и объединяет их ответы.
+
+        Ответ на вопрос, похожий на уже заданный по тем же файлам и характеристикам, берется из кэша.
+        Вопросы, которые понятны только из истории чата («а почему?»), при непустой истории кэш не используют.
+        """
+        context = history_context(chat_history)
+        use_cache = ANSWER_CACHE_ENABLED and not (context and depends_on_context(query))
+        if ANSWER_CACHE_ENABLED and not use_cache:
+            logger.info(f"Вопрос '{query}' зависит от истории чата, кэш ответов не используется")
+        if use_cache:
+            dataset = dataset_key(image_path, data_path)
+            version = features_version(dash_features, domain_features, ts_features)
+            cached = answer_cache.lookup(dataset, version, query)
+            if not cached and followup_precomputer.wait_for(dataset, version, query):
+                # Такой же вопрос уже готовился в фоне после аннотации
+                cached = answer_cache.lookup(dataset, version, query)
+            if cached:
+                logger.info(f"Ответ из кэша: сходство {cached['score']:.2f} с вопросом '{cached['question']}'")
+                return cached["answer"]
+
+        try:
+            # Отказ по квоте сообщается пользователю, а не превращается в «неизвестно» от каждого агента
+            session_usage.admit("process_user_query", session_id)
+        except SessionQuotaExceeded as e:
+            return f"Ошибка: {str(e)} Попробуйте позже."
 
         # Пересылаем запрос каждому агенту
-        dashboard_response = self.dashboard_analyzer.query_dashboard(query, image_path, context, dash_features)
+        dashboard_response = self.dashboard_analyzer.query_dashboard(query, image_path, context, dash_features,
+                                                                      session_id)
         domain_response = self.domain_analyzer.query_domain(query, context, domain_features)
         timeseries_response = self.timeseries_analyzer.query_timeseries(query, image_path, data_path, context,
-                                                                        ts_features)
+                                                                        ts_features, session_id)
 
         # Собираем ответы
         responses = {
@@ -77,36 +110,20 @@ class ChatAgent:
             return "Пожалуйста, переформулируйте ваш вопрос, чтобы он был связан с дашбордом, областью или временным рядом."
 
         # Объединяем ответы с помощью LLM
-        prompt = ChatPromptTemplate.from_template(
-            """Ты аналитик данных. Объедини ответы от трех агентов в один связный ответ на запрос пользователя.
-            Запрос пользователя: {query}
-            Контекст: {context}
-            Ответы агентов:
-            - Dashboard Agent: {dashboard_response}
-            - Domain Agent: {domain_response}
-            - Timeseries Agent: {timeseries_response}
-
-            Правила:
-            1. Если агент ответил "неизвестно", игнорируй его ответ.
-            2. Сформируй связный ответ, объединяя информацию из всех содержательных ответов.
-            3. Используй термины, специфичные для финансовой области, если применимо.
-            4. Ответ должен быть кратким, естественным и адресованным человеку.
-            5. Если есть противоречия между ответами, выбери наиболее логичный или укажи неопределенность.
-
-            Верни объединенный ответ одним абзацем."""
-        )
-
-        chain = prompt | llm | StrOutputParser()
+        values = {
+            "query": query,
+            "context": context,
+            "dashboard_response": dashboard_response,
+            "domain_response": domain_response,
+            "timeseries_response": timeseries_response
+        }
 
         try:
-            combined_response = chain.invoke({
-                "query": query,
-                "context": context,
-                "dashboard_response": dashboard_response,
-                "domain_response": domain_response,
-                "timeseries_response": timeseries_response
-            })
+            combined_response = model_router.call("process_user_query",
+                                                  lambda model: get_chain("process_user_query", model).invoke(values))
             logger.info(f"Объединенный ответ: {combined_response}")
+            if use_cache:
+                answer_cache.add(dataset, version, query, combined_response)
             return combined_response
         except Exception as e:
             logger.error(f"Ошибка при объединении ответов: {str(e)}")
@@ -0,0 +1,102 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import logger, COLUMNAR_DIRNAME
+from data_ingestion import SeriesArrays, compact_values, read_excel
+
+
+def columnar_paths(data_path) -> Tuple[Path, Path, Path]:
+    """Пути к файлам дат, значений и метаданных, хранящимся рядом с исходным файлом."""
+    data_path = Path(data_path)
+    base = data_path.parent / COLUMNAR_DIRNAME / data_path.name
+    return Path(f"{base}.dates.npy"), Path(f"{base}.values.npy"), Path(f"{base}.meta.json")
+
+
+def _source_signature(data_path) -> Dict:
+    stat = os.stat(data_path)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def _write_atomic(path: Path, write) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def save_columnar(data_path, df: pd.DataFrame, date_format: Optional[str] = None) -> bool:
+    """Сохраняет проверенные данные (даты в первом столбце, значения рядов в остальных) в виде пары .npy."""
+    date_col, value_cols = df.columns[0], list(df.columns[1:])
+    if not pd.api.types.is_datetime64_any_dtype(df[date_col]):
+        logger.info(f"Колоночная копия {data_path} не создана: столбец '{date_col}' не приведен к datetime")
+        return False
+    try:
+        dates = df[date_col].to_numpy(dtype="datetime64[ns]").view(np.int64)
+        values = compact_values(df[value_cols].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64))
+        dates_path, values_path, meta_path = columnar_paths(data_path)
+        dates_path.parent.mkdir(exist_ok=True)
+        meta = {
+            **_source_signature(data_path),
+            "date_col": str(date_col),
+            "value_cols": [str(col) for col in value_cols],
+            "date_format": date_format,
+            "rows": len(values)
+        }
+        _write_atomic(dates_path, lambda f: np.save(f, dates))
+        _write_atomic(values_path, lambda f: np.save(f, values))
+        # Метаданные пишутся последними: их наличие означает, что пара .npy записана полностью
+        _write_atomic(meta_path, lambda f: f.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+        logger.info(f"Колоночная копия {data_path} сохранена: {len(values)} строк, тип значений {values.dtype}")
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка сохранения колоночной копии {data_path}: {str(e)}")
+        return False
+
+
+def load_columnar(data_path) -> Optional[SeriesArrays]:
+    """Открывает колоночную копию через memory-map; None, если копии нет или она устарела."""
+    dates_path, values_path, meta_path = columnar_paths(data_path)
+    if not meta_path.exists():
+        return None
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if {key: meta.get(key) for key in ("source_size", "source_mtime_ns")} != _source_signature(data_path) \
+                or "value_cols" not in meta:
+            logger.info(f"Колоночная копия {data_path} устарела")
+            return None
+        series = SeriesArrays(
+            np.load(dates_path, mmap_mode="r"),
+            np.load(values_path, mmap_mode="r"),
+            meta["date_col"],
+            meta["value_cols"],
+            meta.get("date_format")
+        )
+        logger.info(f"Колоночная копия {data_path} открыта: {len(series)} строк")
+        return series
+    except Exception as e:
+        logger.error(f"Ошибка чтения колоночной копии {data_path}: {str(e)}")
+        return None
+
+
+def read_data_preview(file_path: str):
+    """Первые строки файла данных для интерфейса: из колоночной копии, если она есть, иначе из файла."""
+    try:
+        series = load_columnar(file_path)
+        if series is not None:
+            return series.head(5).to_frame()
+        if file_path.endswith('.csv'):
+            df = pd.read_csv(file_path, nrows=5)
+            return df
+        elif file_path.endswith('.xlsx'):
+            df, _ = read_excel(file_path)
+            return df.head(5) if df is not None else ""
+        return ""
+    except Exception as e:
+        logger.error(f"Ошибка в read_data_preview для {file_path}: {str(e)}")
+        return ""
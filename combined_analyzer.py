@@ -0,0 +1,85 @@
+import json
+from typing import Dict, Optional
+
+from config import logger, get_client
+from dashboard_analyzer import DashboardAnalyzer
+from data_ingestion import SeriesArrays
+from model_router import model_router
+from prompt_registry import get_prompt
+from timeseries_analyzer import TimeSeriesAnalyzer
+
+TS_FIELDS = ("trend", "seasonality", "min_value", "max_value", "anomalies", "hypotheses")
+
+
+class CombinedAnalyzer:
+    """Анализ дашборда одним мультимодальным запросом.
+
+    Вместо трех запросов (метрика по изображению, область по изображению и данным, характеристики ряда)
+    модель получает изображение и ряд один раз и возвращает метрику, область и описание ряда в общем JSON.
+    Результат раскладывается в dash_features, domain_features и ts_features того же вида, что и в
+    раздельном режиме; при неудаче возвращается None, и анализ выполняется раздельными запросами.
+    """
+
+    def __init__(self, timeseries_analyzer: Optional[TimeSeriesAnalyzer] = None,
+                 dashboard_analyzer: Optional[DashboardAnalyzer] = None):
+        self.timeseries_analyzer = timeseries_analyzer or TimeSeriesAnalyzer()
+        self.dashboard_analyzer = dashboard_analyzer or DashboardAnalyzer()
+
+    def analyze(self, image_path: str, series: SeriesArrays) -> Optional[Dict]:
+        """Возвращает {dash_features, domain_features, ts_features} или None."""
+        if len(series.value_cols) != 1:
+            logger.info("Совмещенный анализ поддерживается только для одного ряда")
+            return None
+
+        min_value, min_date, max_value, max_date = self.timeseries_analyzer.min_max(series)
+        min_max_hint = f"Минимальное значение: {min_value} {min_date}, Максимальное значение: {max_value} {max_date}"
+        prompt, base64_image = self.timeseries_analyzer.series_request(
+            "combined_analysis", series, image_path, 1500,
+            lambda encoded_csv, image_state: get_prompt("combined_analysis").render(
+                min_max_hint=min_max_hint, encoded_csv=encoded_csv, image_state=image_state
+            )
+        )
+
+        try:
+            response = model_router.call("combined_analysis", lambda model: get_client().chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}
+                            } if base64_image and not base64_image.startswith("Ошибка") else {"type": "text",
+                                                                                              "text": "Изображение отсутствует"}
+                        ]
+                    }
+                ],
+                max_tokens=1500,
+                temperature=0.5,
+                stream=False
+            ))
+            content = response.choices[0].message.content
+            logger.info(f"Ответ совмещенного анализа:\n{content}")
+            result = json.loads(self.dashboard_analyzer.extract_json_from_markdown(content))
+        except json.JSONDecodeError:
+            logger.error("Некорректный JSON в ответе совмещенного анализа")
+            return None
+        except Exception as e:
+            logger.error(f"Ошибка совмещенного анализа: {str(e)}")
+            return None
+
+        if not isinstance(result, dict):
+            logger.error(f"Ответ совмещенного анализа не является объектом JSON: {result}")
+            return None
+        main_metric = result.get("main_metric") or "неизвестно"
+        domain = result.get("domain") or "неизвестно"
+        ts_features = {"metric": main_metric, "domain": domain}
+        ts_features.update({field: result.get(field, [] if field == "anomalies" else "неизвестно")
+                            for field in TS_FIELDS})
+        return {
+            "dash_features": {"main_metric": main_metric},
+            "domain_features": {"domain": domain},
+            "ts_features": ts_features
+        }
@@ -1,29 +1,213 @@
 import os
-from openai import OpenAI
 import logging
-from langchain_openai import ChatOpenAI
+from functools import lru_cache
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Инициализация клиента API
-client = OpenAI(
-    api_key=os.getenv("API_KEY", "sk-eae1582d53c2402b9d7be1f1a882c79f"),
-    base_url="https://llm.glowbyteconsulting.com/api"
-)
+API_KEY = os.getenv("API_KEY", "sk-eae1582d53c2402b9d7be1f1a882c79f")
+API_BASE_URL = os.getenv("API_BASE_URL", "https://llm.glowbyteconsulting.com/api")  # Переопределяется, например, для локальной заглушки шлюза
+MODEL_NAME = "aimediator.gpt-4.1-mini"
+# Модель для коротких извлечений; по умолчанию совпадает с основной, отдельная модель задается явно
+FAST_MODEL_NAME = os.getenv("FAST_MODEL_NAME", MODEL_NAME)
+LLM_TIMEOUT = 60  # Секунд на один запрос к API; по истечении используется локальная аннотация
+
+
+# Клиенты создаются один раз на процесс и только при первом обращении:
+# импорт openai и langchain_openai занимает заметную часть холодного старта
+@lru_cache(maxsize=None)
+def get_client():
+    """Возвращает клиент API."""
+    from openai import OpenAI
+    return OpenAI(
+        api_key=API_KEY,
+        base_url=API_BASE_URL,
+        timeout=LLM_TIMEOUT
+    )
+
+
+@lru_cache(maxsize=None)
+def get_llm(model: str = MODEL_NAME):
+    """Возвращает LangChain LLM (один экземпляр на модель)."""
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        openai_api_key=API_KEY,
+        openai_api_base=API_BASE_URL,
+        model_name=model,
+        temperature=0.5,
+        max_tokens=500,
+        request_timeout=LLM_TIMEOUT
+    )
+
+
+def __getattr__(name):
+    # Совместимость с прежним импортом `from config import client, llm`
+    if name == "client":
+        return get_client()
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Инициализация LangChain LLM
-llm = ChatOpenAI(
-    openai_api_key=os.getenv("API_KEY", "sk-eae1582d53c2402b9d7be1f1a882c79f"),
-    openai_api_base="https://llm.glowbyteconsulting.com/api",
-    model_name="aimediator.gpt-4.1-mini",
-    temperature=0.5,
-    max_tokens=500
-)
+
+# Модели по узлам: кандидаты в порядке предпочтения. Короткие извлечения идут в быструю модель,
+# основная остается для описания ряда, аннотации и ответов в чате. Узлы без записи используют MODEL_NAME
+NODE_MODELS = {
+    "analyze_dashboard": (FAST_MODEL_NAME, MODEL_NAME),
+    "suggest_domain": (FAST_MODEL_NAME, MODEL_NAME),
+    "query_domain": (FAST_MODEL_NAME, MODEL_NAME),
+}
+NODE_LATENCY_SLO = {  # Целевая задержка ответа узла, секунд
+    "analyze_dashboard": 5.0,
+    "suggest_domain": 5.0,
+    "query_domain": 5.0,
+    "query_dashboard": 10.0,
+    "query_timeseries": 10.0,
+}
+DEFAULT_LATENCY_SLO = 30.0
+MODEL_ERROR_RATE_SLO = 0.15  # Допустимая доля ошибок модели на узле
+MODEL_AUTO_SELECT = os.getenv("MODEL_AUTO_SELECT", "0") == "1"  # Выбор по наблюдаемой задержке и ошибкам (по желанию)
+MODEL_STATS_ALPHA = 0.1  # Вес нового наблюдения в скользящем среднем задержки и доли ошибок
+MODEL_MIN_SAMPLES = 3  # Наблюдений, после которых модель может быть понижена
+MODEL_PROBE_INTERVAL = 300  # Секунд до пробного запроса к модели, не уложившейся в SLO
+
+# Планировщик запросов к шлюзу: классы приоритета и справедливая очередь по сессиям
+GATEWAY_SCHEDULER_ENABLED = os.getenv("GATEWAY_SCHEDULER", "1") == "1"
+GATEWAY_MAX_CONCURRENCY = int(os.getenv("GATEWAY_MAX_CONCURRENCY", "8"))  # Одновременных запросов процесса к шлюзу
+GATEWAY_INTERACTIVE_RESERVED = 2  # Мест, недоступных фоновой подготовке и пакетной обработке
+GATEWAY_PRIORITIES = ("chat", "annotation", "speculative", "batch")  # По убыванию приоритета
+GATEWAY_BACKGROUND_PRIORITIES = frozenset(("speculative", "batch"))
+NODE_PRIORITIES = {  # Узлы без записи относятся к классу annotation
+    "query_dashboard": "chat",
+    "query_domain": "chat",
+    "query_timeseries": "chat",
+    "process_user_query": "chat",
+}
+
+# Учет токенов и запросов по сессиям и допуск запросов сверх квоты
+SESSION_QUOTA_WINDOW = 3600  # Секунд скользящего окна учета
+SESSION_TOKEN_QUOTA = int(os.getenv("SESSION_TOKEN_QUOTA", "300000"))  # Токенов (запрос и ответ) сессии за окно
+SESSION_REQUEST_QUOTA = int(os.getenv("SESSION_REQUEST_QUOTA", "300"))  # Запросов сессии к шлюзу за окно
+SESSION_SOFT_QUOTA_SHARE = 0.8  # Доля квоты, после которой запросы сессии собираются с уменьшенными данными
+SESSION_OVER_QUOTA_ACTION = os.getenv("SESSION_OVER_QUOTA_ACTION", "degrade")  # queue, degrade или reject
+SESSION_DEGRADE_LIMIT = 1.5  # Доля квоты, после которой и в режиме degrade запросы отклоняются
+SESSION_QUEUE_MAX_WAIT = 60  # Секунд ожидания освобождения квоты в режиме queue
+SESSION_USAGE_SESSIONS = 1000  # Сессий, для которых хранится учет
+
+# Режим графа анализа: "multi" — отдельные запросы для метрики, области и ряда, "combined" — один общий запрос
+GRAPH_MODE = os.getenv("GRAPH_MODE", "multi")
 
 # Конфигурация директорий
 UPLOAD_DIR = "uploads"
 DATA_DIR = "data"
 ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 ALLOWED_DATA_EXTENSIONS = {'csv', 'xlsx'}
+
+# Инкрементальная переаннотация при дозаписи новых точек
+CACHE_DIR = "cache"
+INCREMENTAL_DIR = os.path.join(CACHE_DIR, "incremental")
+INCREMENTAL_MAX_APPEND_RATIO = 0.2  # Доля новых точек, при которой ряд анализируется заново целиком
+
+# Параметры локальных характеристик ряда
+ANOMALY_EWMA_ALPHA = 0.1
+ANOMALY_Z_THRESHOLD = 3.5
+ANOMALY_WARMUP = 10
+CHANGEPOINT_DRIFT = 0.5
+CHANGEPOINT_THRESHOLD = 8.0
+LOCAL_FEATURES_MAX_EVENTS = 100
+
+# Потоковое чтение CSV
+CSV_SNIFF_ROWS = 200  # Строк для определения ролей столбцов и формата дат
+CSV_CHUNK_ROWS = 500_000  # Строк в одной порции потокового чтения
+CSV_BLOCK_SIZE = 16 * 1024 * 1024  # Байт в одном блоке при чтении через pyarrow
+
+# Нормализация столбцов дат (date_parsing)
+DATE_SAMPLE_ROWS = 200  # Значений из начала и из конца столбца для определения формата
+DATE_MIN_PARSED_SHARE = 0.95  # Доля значений выборки, которые должен разобрать формат (остальное — подписи, итоги)
+DATE_FORMAT_CACHE_SIZE = 64  # Запомненных форматов для схем файлов (столбцы файла и столбец дат)
+DATE_ZANLIS_EPOCH = 1945  # Год, от которого отсчитываются значения вида «Занлись N»
+
+# Колоночные копии проверенных данных (пара .npy рядом с исходным файлом)
+COLUMNAR_DIRNAME = ".columnar"
+
+# Кэш разобранных листов Excel (число файлов)
+EXCEL_CACHE_SIZE = 4
+
+# Наборы из нескольких рядов с общим столбцом дат
+MAX_SERIES = 20
+
+# Прочитанные ряды в компактном виде, общие для анализаторов и сессий процесса (число файлов)
+SERIES_CACHE_SIZE = 4
+
+# Миниатюра дашборда в интерфейсе (ширина в пикселях)
+THUMBNAIL_MAX_WIDTH = 900
+
+# Обрезка скриншота дашборда до областей с содержимым перед отправкой модели
+IMAGE_ROI_ENABLED = os.getenv("IMAGE_ROI", "1") == "1"
+IMAGE_ROI_ANALYSIS_SIDE = 800  # Длинная сторона уменьшенной копии, по которой ищутся области
+IMAGE_ROI_INK_THRESHOLD = 24  # Отличие яркости от фона или соседа, при котором пиксель считается содержимым
+IMAGE_ROI_MIN_GAP = 0.01  # Минимальная полоса фона между областями (доля высоты; по ширине — вдвое больше)
+IMAGE_ROI_PADDING = 6  # Отступ вокруг области и между областями, пикселей
+IMAGE_ROI_MIN_SAVING = 0.1  # Минимальное уменьшение площади, при котором изображение заменяется областями
+IMAGE_ROI_CACHE_SIZE = 8  # Обрезанных изображений в кэше процесса
+
+# Индекс перцептивных хешей проанализированных дашбордов
+IMAGE_INDEX_DB = os.path.join(CACHE_DIR, "image_index.sqlite")
+IMAGE_HASH_SIZE = 8  # Сторона сетки хеша: 8 -> 64 бита
+IMAGE_HASH_MAX_DISTANCE = 10  # Максимальное суммарное расстояние Хэмминга aHash и dHash (в битах)
+
+# Локальная шаблонная аннотация (черновик до ответа LLM и запасной вариант при его недоступности)
+OFFLINE_DRAFT_ENABLED = True
+SEASONALITY_MIN_AUTOCORRELATION = 0.3
+
+# Предварительная оценка размера запроса и ступени его уменьшения
+MODEL_TOKEN_BUDGETS = {MODEL_NAME: 128_000, FAST_MODEL_NAME: 128_000}  # Допустимое число входных токенов для модели
+DEFAULT_TOKEN_BUDGET = 32_000
+MAX_REQUEST_BYTES = 8 * 1024 * 1024  # Предел размера тела запроса (ответ 413 при превышении)
+DATA_ROWS_LADDER = (2000, 500, 100)  # Число точек ряда на ступенях прореживания
+IMAGE_SIDE_LADDER = (1024, 768, 512)  # Длинная сторона изображения на ступенях уменьшения
+HISTORY_MESSAGES = 5  # Сообщений истории чата в контексте запроса
+HISTORY_TOKEN_LIMIT = 4000  # Предел токенов истории; старые сообщения отбрасываются первыми
+
+# Хранилище результатов анализа и сессий чата
+RESULT_STORE_DB = os.path.join(CACHE_DIR, "results.sqlite")
+RESULT_PAGE_SIZE = 20
+RESTORE_COOKIE = "chat_restore"  # Cookie с токеном восстановления чата (не попадает в адрес страницы)
+RESTORE_COOKIE_MAX_AGE = 30 * 24 * 3600  # Секунд хранения токена в браузере
+
+# Изображение дашборда в вопросах чата (вложение, а не base64 в тексте промпта)
+CHAT_IMAGE_DETAIL = "low"  # Уровень детализации по умолчанию: low (~85 токенов) или high
+CHAT_IMAGE_SIDES = {"low": 512, "high": 1024}  # Длинная сторона изображения для уровня детализации
+CHAT_IMAGE_HIGH_DETAIL_WORDS = ("подпис", "легенд", "ось", "оси", "осям", "надпис", "текст", "цвет", "шкал",
+                                "деления", "мелк")  # Начала слов вопроса, для которых нужна высокая детализация
+CHAT_IMAGE_SESSIONS = 64  # Сессий, для которых хранятся подготовленные вложения
+
+# Кэш ответов на повторяющиеся вопросы чата по одному набору данных
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_THRESHOLD = 0.85  # Минимальное косинусное сходство вопросов для ответа из кэша
+ANSWER_CACHE_NGRAM = 3  # Длина символьных n-грамм
+ANSWER_CACHE_DIM = 4096  # Размерность хешированного вектора вопроса
+ANSWER_CACHE_ENTRIES = 200  # Вопросов на один набор данных
+ANSWER_CACHE_DATASETS = 32  # Наборов данных в кэше
+
+# Фоновая подготовка ответов на вероятные вопросы после аннотации (ответы попадают в кэш ответов)
+# Выключена по умолчанию: каждый вопрос стоит нескольких запросов к шлюзу, а задают их не всегда (FOLLOWUP_PRECOMPUTE=1)
+FOLLOWUP_PRECOMPUTE_ENABLED = os.getenv("FOLLOWUP_PRECOMPUTE", "0") == "1"
+FOLLOWUP_QUESTIONS = (
+    "Какой тренд у ряда и как он менялся?",
+    "Когда было максимальное значение?",
+    "Когда было минимальное значение?",
+    "Есть ли аномалии в данных?",
+    "Есть ли сезонность?",
+)
+FOLLOWUP_REQUESTS_PER_HOUR = 120  # Запросов к шлюзу в час на фоновую подготовку (на процесс)
+FOLLOWUP_IDLE_SECONDS = 2.0  # Секунд без запросов пользователя перед очередным фоновым вопросом
+FOLLOWUP_IDLE_TIMEOUT = 300  # Секунд ожидания простоя, после которых подготовка прекращается
+FOLLOWUP_WAIT_SECONDS = 30  # Сколько вопрос пользователя ждет готовящийся в фоне ответ на такой же вопрос
+
+# Профилирование этапов: узлы графа, обработчики загрузки и перезапуски скрипта интерфейса
+PROFILING_ENABLED = os.getenv("PROFILE", "0") == "1"
+PROFILING_MEMORY = os.getenv("PROFILE_MEMORY", "1") == "1"  # Снимки tracemalloc до и после этапа
+PROFILING_DIR = os.path.join(CACHE_DIR, "profiles")
+PROFILING_TOP_N = 20  # Строк в сводке: функций по собственному времени и мест выделения памяти
+PROFILING_SAMPLE_INTERVAL = 0.005  # Период снятия стеков для flamegraph, с
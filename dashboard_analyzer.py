@@ -1,24 +1,29 @@
 import json
-import base64
 import re
 from pathlib import Path
 
-from config import client, logger, llm, ALLOWED_IMAGE_EXTENSIONS
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+from config import get_client, logger, ALLOWED_IMAGE_EXTENSIONS
 from typing import Optional, Dict
+from image_attachments import choose_detail, image_attachments
+from model_router import model_router
+from prompt_registry import get_message_chain, get_prompt
+from token_budget import (TokenBudget, degradation_ladder, encode_image_scaled, estimate_image_tokens,
+                          estimate_text_tokens)
 
 
 class DashboardAnalyzer:
-    def encode_image(self, image_path: str) -> str:
+    def encode_image(self, image_path: str, max_side: Optional[int] = None) -> str:
+        """Кодирует изображение в base64 (при заданном max_side — уменьшенное до этой длинной стороны)."""
+        return self.encode_image_with_size(image_path, max_side)[0]
+
+    def encode_image_with_size(self, image_path: str, max_side: Optional[int] = None):
         if not Path(image_path).suffix[1:].lower() in ALLOWED_IMAGE_EXTENSIONS:
             logger.error(f"Неподдерживаемый формат файла: {image_path}")
             raise ValueError(f"Неподдерживаемый формат файла: {Path(image_path).suffix}")
         try:
-            with open(image_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-                logger.info(f"Изображение {image_path} успешно закодировано в base64")
-                return encoded_string
+            encoded_string, size = encode_image_scaled(image_path, max_side)
+            logger.info(f"Изображение {image_path} успешно закодировано в base64")
+            return encoded_string, size
         except Exception as e:
             logger.error(f"Ошибка при кодировании изображения {image_path}: {str(e)}")
             raise
@@ -33,23 +38,21 @@ class DashboardAnalyzer:
 
     def analyze_dashboard(self, image_path: str) -> dict:
         """Анализирует изображение дашборда, извлекая только основную метрику."""
+        prompt = get_prompt("analyze_dashboard").render()
+
+        def build(options):
+            encoded, (width, height) = self.encode_image_with_size(image_path, options["image_side"])
+            return encoded, estimate_text_tokens(prompt) + estimate_image_tokens(width, height), len(prompt) + len(encoded)
+
         try:
-            base64_image = self.encode_image(image_path)
+            base64_image = TokenBudget(max_tokens=100).fit("analyze_dashboard", build, degradation_ladder(image=True))
         except Exception as e:
             logger.error(f"Не удалось закодировать изображение: {str(e)}")
             return {"main_metric": "неизвестно"}
 
-        prompt = """Ты успешный аналитик данных. Проанализируй изображение дашборда, содержащее временной ряд. 
-        Извлеки из графика основную метрику/показатель у временного ряда (например, "Продажи золота", "Выручка", "Объем производства"). 
-        Сформулируй понятно для человека, на русском языке. Будь внимателен, может быть такое, что метрика указана в названии графика или в легенде.
-        Верни результат в формате JSON с полем "main_metric". Если метрику определить невозможно, укажи "неизвестно".
-        Пример: {"main_metric": "Детская смертность в Бразилии с 1934 по 2023 год"}
-        Ответ должен быть заключен в ```json ```.
-        """
-
         try:
-            response = client.chat.completions.create(
-                model="aimediator.gpt-4.1-mini",
+            response = model_router.call("analyze_dashboard", lambda model: get_client().chat.completions.create(
+                model=model,
                 messages=[
                     {
                         "role": "user",
@@ -67,7 +70,7 @@ class DashboardAnalyzer:
                 max_tokens=100,
                 temperature=0.5,
                 stream=False
-            )
+            ))
             content = response.choices[0].message.content
             json_content = self.extract_json_from_markdown(content)
 
@@ -86,43 +89,39 @@ class DashboardAnalyzer:
             return {"main_metric": "неизвестно"}
 
     def query_dashboard(self, query: str, image_path: Optional[str], context: str,
-                        dash_features: Optional[Dict] = None) -> str:
-        """Обрабатывает запрос пользователя, связанный с визуальными элементами дашборда."""
+                        dash_features: Optional[Dict] = None, session_id: Optional[str] = None) -> str:
+        """Обрабатывает запрос пользователя, связанный с визуальными элементами дашборда.
+
+        Изображение передается вложением с уровнем детализации по вопросу и готовится один раз на сессию.
+        """
         if not image_path:
             return "неизвестно"
 
+        main_metric = dash_features.get("main_metric", "неизвестно") if dash_features else "неизвестно"
+        prompt = get_prompt("query_dashboard")
+
         try:
-            base64_image = self.encode_image(image_path)
+            attachment = image_attachments.get(image_path, choose_detail(query), session_id)
         except Exception as e:
-            logger.error(f"Ошибка при кодировании изображения: {str(e)}")
+            logger.error(f"Ошибка при подготовке изображения: {str(e)}")
             return "неизвестно"
 
-        main_metric = dash_features.get("main_metric", "неизвестно") if dash_features else "неизвестно"
-        prompt = ChatPromptTemplate.from_template(
-            """Ты аналитик дашбордов. Твоя роль — анализировать визуальные элементы дашборда (графики, метрики, подписи).
-            Запрос пользователя: {query}
-            Контекст: {context}
-            Основная метрика дашборда: {main_metric}
-            Изображение дашборда в base64: {base64_image}
-
-            Ответь на вопрос, если он связан с визуальными элементами дашборда (например, метрика, название графика, легенда).
-            Используй переданную метрику и изображение для ответа.
-            Используй термины, специфичные для финансовой области, если применимо.
-            Если вопрос не относится к твоей роли, верни "неизвестно".
-            Верни ответ кратко, одним-двумя предложениями."""
-        )
-
-        chain = prompt | llm | StrOutputParser()
+        def build(options):
+            values = {
+                "query": query,
+                "context": context if options["history"] else "",
+                "main_metric": main_metric
+            }
+            text = prompt.render(**values)
+            return values, estimate_text_tokens(text) + attachment["tokens"], len(text) + attachment["size"]
+
+        values = TokenBudget().fit("query_dashboard", build, degradation_ladder(history=True))
 
         try:
-            response = chain.invoke({
-                "query": query,
-                "context": context,
-                "main_metric": main_metric,
-                "base64_image": base64_image
-            })
+            messages = prompt.messages([attachment["part"]], **values)
+            response = model_router.call("query_dashboard", lambda model: get_message_chain(model).invoke(messages))
             logger.info(f"Ответ Dashboard Agent: {response}")
             return response
         except Exception as e:
             logger.error(f"Ошибка Dashboard Agent: {str(e)}")
-            return "неизвестно"
\ No newline at end of file
+            return "неизвестно"
@@ -0,0 +1,242 @@
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from config import logger, CSV_CHUNK_ROWS, CSV_SNIFF_ROWS, CSV_BLOCK_SIZE, EXCEL_CACHE_SIZE, MAX_SERIES
+from date_parsing import date_normalizer, is_strptime_format, parse_with_format
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow необязателен: без него используется потоковое чтение средствами pandas
+    pa = None
+
+Source = Union[str, Path, BinaryIO]
+
+NAT_EPOCH = np.iinfo(np.int64).min  # Значение int64, соответствующее NaT
+
+
+class SeriesArrays:
+    """Компактное представление набора рядов с общей осью дат.
+
+    dates — int64 (нс от эпохи), values — матрица n x k (float32 или float64), по столбцу на ряд.
+    """
+
+    def __init__(self, dates: np.ndarray, values: np.ndarray, date_col: str, value_cols: List[str],
+                 date_format: Optional[str] = None):
+        self.dates = dates
+        self.values = values
+        self.date_col = date_col
+        self.value_cols = list(value_cols)
+        self.date_format = date_format
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def head(self, rows: int) -> "SeriesArrays":
+        return SeriesArrays(self.dates[:rows], self.values[:rows], self.date_col, self.value_cols, self.date_format)
+
+    def take(self, rows: Optional[np.ndarray]) -> "SeriesArrays":
+        """Подмножество строк по индексам; None — весь набор без копирования."""
+        if rows is None:
+            return self
+        return SeriesArrays(self.dates[rows], self.values[rows], self.date_col, self.value_cols, self.date_format)
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame в формате read_data: первый столбец — даты, далее значения (без копирования массивов)."""
+        df = pd.DataFrame(self.values, columns=self.value_cols, copy=False)
+        df.insert(0, self.date_col, self.dates.view("datetime64[ns]"))
+        return df
+
+
+def compact_values(values: np.ndarray) -> np.ndarray:
+    """Переводит значения в float32, если это не теряет точности."""
+    compact = values.astype(np.float32)
+    if np.array_equal(compact.astype(np.float64), values, equal_nan=True):
+        return compact
+    return values
+
+
+def is_numeric_text(column: pd.Series) -> bool:
+    sample = column.dropna()
+    return not sample.empty and pd.to_numeric(sample, errors="coerce").notna().all()
+
+
+def parse_dates_to_epoch(column: pd.Series, date_format: str) -> np.ndarray:
+    """Разбирает даты по определенному формату в int64 (нс); нераспознанные значения — NaT."""
+    return parse_with_format(column, date_format).to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+
+def _rewind(source: Source) -> None:
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def sniff_csv_columns(source: Source) -> Optional[Tuple[str, List[str], str]]:
+    """Определяет по первым строкам столбец дат, столбцы значений и формат дат."""
+    _rewind(source)
+    head = pd.read_csv(source, nrows=CSV_SNIFF_ROWS, dtype=str)
+    if not 2 <= len(head.columns) <= MAX_SERIES + 1 or head.empty:
+        return None
+    columns = list(head.columns)
+    for date_col in columns:
+        value_cols = [col for col in columns if col != date_col]
+        if not all(is_numeric_text(head[col]) for col in value_cols):
+            continue
+        date_format = date_normalizer.infer(head[date_col], tuple(columns))
+        if date_format:
+            return date_col, value_cols, date_format
+    return None
+
+
+def _read_chunks_arrow(source: Source, date_col: str, value_cols: List[str],
+                       date_format: str) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """Потоковое чтение блоками средствами pyarrow (разбор дат и чисел в C++ в несколько потоков)."""
+    _rewind(source)
+    reader = pa_csv.open_csv(
+        str(source) if isinstance(source, Path) else source,
+        read_options=pa_csv.ReadOptions(block_size=CSV_BLOCK_SIZE),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={date_col: pa.timestamp("ns"), **{col: pa.float64() for col in value_cols}},
+            timestamp_parsers=[date_format],
+            include_columns=[date_col] + value_cols
+        )
+    )
+    dates_chunks, values_chunks = [], []
+    for batch in reader:
+        dates = pc.fill_null(batch.column(date_col).cast(pa.int64()), NAT_EPOCH)
+        dates_chunks.append(dates.to_numpy())
+        values_chunks.append(np.column_stack([
+            batch.column(col).to_numpy(zero_copy_only=False) for col in value_cols
+        ]))
+    return dates_chunks, values_chunks
+
+
+def _read_chunks_pandas(source: Source, date_col: str, value_cols: List[str],
+                        date_format: str) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """Потоковое чтение порциями по CSV_CHUNK_ROWS строк средствами pandas."""
+    _rewind(source)
+    dates_chunks, values_chunks = [], []
+    reader = pd.read_csv(source, usecols=[date_col] + value_cols,
+                         dtype={date_col: str, **{col: np.float64 for col in value_cols}}, chunksize=CSV_CHUNK_ROWS)
+    for chunk in reader:
+        dates_chunks.append(parse_dates_to_epoch(chunk[date_col], date_format))
+        values_chunks.append(chunk[value_cols].to_numpy(dtype=np.float64))
+    return dates_chunks, values_chunks
+
+
+def ingest_csv(source: Source) -> Optional[SeriesArrays]:
+    """Потоково читает CSV с рядом по частям в компактные массивы (память ограничена размером порции).
+
+    Возвращает None, если столбцы или формат дат не удалось определить по первым строкам —
+    тогда вызывающий код использует обычное чтение файла целиком.
+    """
+    try:
+        roles = sniff_csv_columns(source)
+        if roles is None:
+            logger.info("Роли столбцов CSV не определены по первым строкам, используется полное чтение")
+            return None
+        date_col, value_cols, date_format = roles
+        logger.info(f"CSV: столбец дат '{date_col}' (формат {date_format}), столбцы значений {value_cols}")
+
+        dates_chunks, values_chunks = None, None
+        # pyarrow разбирает только форматы strptime; кварталы, названия месяцев и т. п. читаются через pandas
+        if pa is not None and is_strptime_format(date_format):
+            try:
+                dates_chunks, values_chunks = _read_chunks_arrow(source, date_col, value_cols, date_format)
+            except Exception as e:
+                logger.info(f"Чтение CSV через pyarrow не удалось, используется pandas: {str(e)}")
+        if values_chunks is None:
+            dates_chunks, values_chunks = _read_chunks_pandas(source, date_col, value_cols, date_format)
+        if not values_chunks:
+            return None
+
+        series = SeriesArrays(
+            np.concatenate(dates_chunks),
+            compact_values(np.concatenate(values_chunks)),
+            date_col,
+            value_cols,
+            date_format
+        )
+        logger.info(f"CSV прочитан потоково: {len(series)} строк, {len(values_chunks)} частей, "
+                    f"тип значений {series.values.dtype}")
+        return series
+    except Exception as e:
+        logger.warning(f"Потоковое чтение CSV не удалось, используется полное чтение: {str(e)}")
+        return None
+    finally:
+        _rewind(source)
+
+
+# Кэш разобранных листов Excel: (путь, размер, mtime) -> (DataFrame, имя листа)
+_excel_cache: "OrderedDict[Tuple[str, int, int], Tuple[pd.DataFrame, str]]" = OrderedDict()
+_excel_lock = threading.Lock()
+
+
+def _is_empty_row(row) -> bool:
+    return all(value is None for value in row)
+
+
+def _sheet_to_frame(rows) -> Optional[pd.DataFrame]:
+    """Собирает DataFrame из потока строк листа; None, если в заголовке меньше двух столбцов или нет данных."""
+    header = next(rows, None)
+    if header is None or sum(value is not None for value in header) < 2:
+        return None
+    data = [row for row in rows]
+    while data and _is_empty_row(data[-1]):
+        data.pop()
+    if not data:
+        return None
+    width = max(i + 1 for i, value in enumerate(header) if value is not None)
+    columns = [str(value) if value is not None else f"Unnamed: {i}" for i, value in enumerate(header[:width])]
+    return pd.DataFrame([row[:width] for row in data], columns=columns).infer_objects()
+
+
+def read_excel(source: Source) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """Читает первый лист с данными за один проход по книге.
+
+    Книга открывается в режиме read-only: у каждого листа сначала просматривается только строка
+    заголовка, и лишь подходящий лист (не менее двух столбцов и хотя бы одна строка данных) разбирается
+    целиком. Результат для файла на диске кэшируется до изменения файла.
+    """
+    from openpyxl import load_workbook
+
+    key = None
+    if isinstance(source, (str, Path)):
+        stat = os.stat(source)
+        key = (os.path.abspath(source), stat.st_size, stat.st_mtime_ns)
+        with _excel_lock:
+            cached = _excel_cache.get(key)
+            if cached is not None:
+                _excel_cache.move_to_end(key)
+        if cached is not None:
+            logger.info(f"Лист Excel {source} взят из кэша")
+            return cached[0].copy(), cached[1]
+
+    _rewind(source)
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            df = _sheet_to_frame(sheet.iter_rows(values_only=True))
+            if df is not None:
+                result = (df, sheet.title)
+                break
+        else:
+            return None, None
+    finally:
+        workbook.close()
+        _rewind(source)
+
+    if key is not None:
+        entry = (result[0].copy(), result[1])
+        with _excel_lock:
+            _excel_cache[key] = entry
+            while len(_excel_cache) > EXCEL_CACHE_SIZE:
+                _excel_cache.popitem(last=False)
+    return result
@@ -0,0 +1,259 @@
+import re
+import threading
+import warnings
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import logger, DATE_SAMPLE_ROWS, DATE_MIN_PARSED_SHARE, DATE_FORMAT_CACHE_SIZE, DATE_ZANLIS_EPOCH
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pyarrow необязателен: без него форматы strptime разбирает pandas
+    pa = None
+
+# Фиксированные форматы strptime, которые пробуются по порядку при определении формата столбца
+DATE_FORMATS = (
+    "%Y-%m-%d", "%d.%m.%Y", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M",
+    "%Y-%m-%d %H:%M", "%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d", "%d.%m.%y", "%Y-%m", "%m.%Y", "%m/%Y", "%Y"
+)
+
+_YEAR_SUFFIX = r"(?:\s*г(?:ода?|\.)?)?"
+
+# Форматы, которые strptime не разбирает: регулярное выражение значения целиком с группами
+# year, quarter, month (номер или название месяца), day, number
+PATTERN_FORMATS = {
+    "year-ru": r"(?P<year>\d{4})\s*г(?:ода?|\.)?",
+    "quarter": r"(?P<year>\d{4})\s*[-/ ]?\s*[QК](?P<quarter>[1-4])",
+    "quarter-first": r"[QК](?P<quarter>[1-4])\s*[-/ ]?\s*(?P<year>\d{4})",
+    "quarter-ru": r"(?P<quarter>[1-4]|I{1,3}|IV)\s*(?:-?й\s*)?(?:кв\.?|квартал)\s*(?P<year>\d{4})" + _YEAR_SUFFIX,
+    "month-ru": r"(?P<month>[а-яё]{3,})\.?\s*[-/ ]?\s*(?P<year>\d{4})" + _YEAR_SUFFIX,
+    "day-month-ru": r"(?P<day>\d{1,2})\s+(?P<month>[а-яё]{3,})\.?\s+(?P<year>\d{4})" + _YEAR_SUFFIX,
+    "zanlis": r"Занлись\s+(?P<number>\d+)",
+}
+
+# Форматы числовых столбцов: номер года и порядковый номер дня Excel (дата, сохраненная как число)
+NUMERIC_FORMATS = ("year-number", "excel-serial")
+
+# Первые буквы названий месяцев в любом падеже («январь», «января», «янв.»)
+MONTH_STEMS = {"янв": 1, "фев": 2, "мар": 3, "апр": 4, "май": 5, "мая": 5, "июн": 6, "июл": 7, "авг": 8,
+               "сен": 9, "окт": 10, "ноя": 11, "дек": 12}
+ROMAN_QUARTERS = {"I": 1, "II": 2, "III": 3, "IV": 4}
+
+EXCEL_EPOCH = np.datetime64("1899-12-30", "D")
+
+
+def is_strptime_format(date_format: Optional[str]) -> bool:
+    """Формат strptime (его понимают pyarrow и pd.to_datetime), а не имя формата из PATTERN_FORMATS."""
+    return bool(date_format) and "%" in date_format
+
+
+def _assemble(year: np.ndarray, month: np.ndarray, day: np.ndarray) -> np.ndarray:
+    """Собирает datetime64[ns] из массивов года, месяца и дня (float, NaN — нет значения) без цикла по строкам."""
+    valid = ~(np.isnan(year) | np.isnan(month) | np.isnan(day))
+    valid &= (year > 1677) & (year < 2262) & (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    months = np.where(valid, (year - 1970) * 12 + month - 1, 0).astype(np.int64)
+    days = np.where(valid, day - 1, 0).astype(np.int64)
+    result = months.astype("datetime64[M]").astype("datetime64[D]") + days.astype("timedelta64[D]")
+    # 31 февраля и подобные даты переходят в следующий месяц — такие значения не распознаны
+    valid &= result.astype("datetime64[M]").astype(np.int64) == months
+    result = result.astype("datetime64[ns]")
+    result[~valid] = np.datetime64("NaT")
+    return result
+
+
+def _parse_groups(groups: pd.DataFrame) -> np.ndarray:
+    """Даты из групп регулярного выражения (по строке на значение)."""
+    count = len(groups)
+    ones = np.ones(count)
+
+    def numbers(name):
+        return pd.to_numeric(groups[name], errors="coerce").to_numpy(dtype=np.float64)
+
+    if "number" in groups:
+        return _assemble(numbers("number") + DATE_ZANLIS_EPOCH, ones, ones)
+    year = numbers("year")
+    month, day = ones, ones
+    if "quarter" in groups:
+        quarter = groups["quarter"].astype(object).str.upper()
+        month = (pd.to_numeric(quarter.map(lambda value: ROMAN_QUARTERS.get(value, value)), errors="coerce")
+                 .to_numpy(dtype=np.float64) - 1) * 3 + 1
+    if "month" in groups:
+        stems = groups["month"].astype(object).str.lower().str[:3].str.replace("ё", "е")
+        month = stems.map(MONTH_STEMS).to_numpy(dtype=np.float64)
+    if "day" in groups:
+        day = numbers("day")
+    return _assemble(year, month, day)
+
+
+def _parse_numeric(values: np.ndarray, date_format: str) -> np.ndarray:
+    values = values.astype(np.float64)
+    if date_format == "year-number":
+        integer = np.where(values == np.round(values), values, np.nan)
+        ones = np.ones(len(values))
+        return _assemble(integer, ones, ones)
+    valid = ~np.isnan(values) & (values >= 1) & (values < 2958466)
+    days = np.where(valid, values, 0.0)
+    nanoseconds = np.round((days - np.floor(days)) * 86_400e9).astype(np.int64)
+    result = (EXCEL_EPOCH + np.floor(days).astype(np.int64).astype("timedelta64[D]")).astype("datetime64[ns]")
+    result = result + nanoseconds.astype("timedelta64[ns]")
+    result[~valid] = np.datetime64("NaT")
+    return result
+
+
+def _text(column: pd.Series) -> pd.Series:
+    """Строковые значения столбца без пробелов по краям (пропуски остаются пропусками)."""
+    return column.astype("str").str.strip()
+
+
+def _strptime(column: pd.Series, date_format: str) -> np.ndarray:
+    if pa is not None:
+        try:
+            text = pc.utf8_trim_whitespace(pa.array(column, type=pa.string(), from_pandas=True))
+            parsed = pc.strptime(text, format=date_format, unit="ns", error_is_null=True)
+            return parsed.to_numpy(zero_copy_only=False).astype("datetime64[ns]")
+        except pa.ArrowException:
+            # Не строки (числа, даты Excel вперемешку с текстом) — разбор средствами pandas
+            pass
+    return pd.to_datetime(_text(column), format=date_format, errors="coerce").to_numpy(dtype="datetime64[ns]")
+
+
+def parse_with_format(column: pd.Series, date_format: str) -> pd.Series:
+    """Разбирает весь столбец по заданному формату векторно; нераспознанные значения — NaT.
+
+    Форматы strptime разбираются в C (pyarrow, если установлен, иначе pandas); для форматов из PATTERN_FORMATS регулярное выражение
+    применяется только к различающимся значениям (год, квартал или месяц повторяются во многих строках).
+    """
+    if date_format == "datetime":
+        parsed = pd.to_datetime(column, errors="coerce").to_numpy(dtype="datetime64[ns]")
+    elif date_format in NUMERIC_FORMATS:
+        parsed = _parse_numeric(pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64), date_format)
+    elif is_strptime_format(date_format):
+        parsed = _strptime(column, date_format)
+    else:
+        codes, uniques = pd.factorize(_text(column))
+        groups = pd.Series(uniques, dtype=object).str.extract(f"^(?:{PATTERN_FORMATS[date_format]})$",
+                                                              flags=re.IGNORECASE)
+        parsed = np.append(_parse_groups(groups), np.datetime64("NaT", "ns"))[codes]
+    return pd.Series(parsed, index=column.index, name=column.name)
+
+
+def _sample(column: pd.Series) -> pd.Series:
+    """Непустые значения из начала и конца столбца: подписи и итоги обычно стоят в конце таблицы."""
+    if len(column) > 8 * DATE_SAMPLE_ROWS:
+        # Пустые значения отбрасываются только в краях столбца, а не во всем столбце
+        column = pd.concat([column.iloc[:4 * DATE_SAMPLE_ROWS], column.iloc[-4 * DATE_SAMPLE_ROWS:]])
+    values = column.dropna()
+    if values.dtype == object or pd.api.types.is_string_dtype(values):
+        values = values[values.astype("str").str.strip() != ""]
+    half = DATE_SAMPLE_ROWS // 2
+    if len(values) <= DATE_SAMPLE_ROWS:
+        return values
+    return pd.concat([values.iloc[:half], values.iloc[-half:]])
+
+
+def _candidates(sample: pd.Series):
+    if pd.api.types.is_datetime64_any_dtype(sample):
+        return ("datetime",)
+    if pd.api.types.is_numeric_dtype(sample):
+        return NUMERIC_FORMATS
+    if sample.map(lambda value: isinstance(value, (pd.Timestamp, np.datetime64)) or hasattr(value, "year")).all():
+        return ("datetime",)
+    return DATE_FORMATS + tuple(PATTERN_FORMATS)
+
+
+def _parsed_share(sample: pd.Series, date_format: str) -> float:
+    if date_format == "excel-serial":
+        # Порядковые номера дней правдоподобны только в пределах 1927–2119 годов, иначе это не даты
+        values = pd.to_numeric(sample, errors="coerce")
+        return float(values.between(10_000, 80_000).mean())
+    return float(parse_with_format(sample, date_format).notna().mean())
+
+
+def infer_format(column: pd.Series) -> Optional[str]:
+    """Формат, которому соответствуют все значения выборки, или лучший из разбирающих не меньше
+    DATE_MIN_PARSED_SHARE выборки; None, если столбец не похож на даты."""
+    sample = _sample(column)
+    if sample.empty:
+        return None
+    best, best_share = None, 0.0
+    for date_format in _candidates(sample):
+        share = _parsed_share(sample, date_format)
+        if share == 1.0:
+            return date_format
+        if share > best_share:
+            best, best_share = date_format, share
+    return best if best_share >= DATE_MIN_PARSED_SHARE else None
+
+
+class DateNormalizer:
+    """Приведение столбцов дат к datetime64[ns] с определением формата по выборке.
+
+    Формат определяется по DATE_SAMPLE_ROWS значениям из начала и конца столбца (фиксированные форматы
+    strptime, годы, кварталы, названия месяцев на русском, «Занлись N», номера дней Excel), после чего
+    весь столбец разбирается векторно по этому формату. Формат запоминается для схемы файла (набора
+    столбцов) и при следующем файле той же схемы только проверяется на выборке.
+    """
+
+    def __init__(self, cache_size: int = DATE_FORMAT_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._formats: "OrderedDict[Tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"inferred": 0, "cached": 0}
+
+    @staticmethod
+    def _key(column: pd.Series, schema: Optional[Tuple[Hashable, ...]]) -> Tuple:
+        kind = "numeric" if pd.api.types.is_numeric_dtype(column) else "text"
+        return tuple(map(str, schema or ())), str(column.name), kind
+
+    def infer(self, column: pd.Series, schema: Optional[Tuple[Hashable, ...]] = None) -> Optional[str]:
+        """Формат столбца дат (имя формата strptime или из PATTERN_FORMATS/NUMERIC_FORMATS) либо None."""
+        if pd.api.types.is_datetime64_any_dtype(column):
+            return "datetime"
+        key = self._key(column, schema)
+        with self._lock:
+            cached = self._formats.get(key)
+        if cached is not None:
+            sample = _sample(column)
+            if sample.empty or _parsed_share(sample, cached) >= DATE_MIN_PARSED_SHARE:
+                with self._lock:
+                    self._formats.move_to_end(key)
+                    self.stats["cached"] += 1
+                return cached
+        date_format = infer_format(column)
+        logger.info(f"Формат дат столбца '{column.name}': {date_format or 'не определен'}")
+        with self._lock:
+            self.stats["inferred"] += 1
+            if date_format is not None:
+                self._formats[key] = date_format
+                while len(self._formats) > self.cache_size:
+                    self._formats.popitem(last=False)
+        return date_format
+
+    def normalize(self, column: pd.Series,
+                  schema: Optional[Tuple[Hashable, ...]] = None) -> Tuple[pd.Series, Optional[str]]:
+        """Столбец в виде datetime64[ns] (нераспознанные значения — NaT) и определенный формат.
+
+        Если формат не определен, используется поэлементное автоопределение pandas.
+        """
+        date_format = self.infer(column, schema)
+        if date_format is not None:
+            return parse_with_format(column, date_format), date_format
+        if pd.api.types.is_numeric_dtype(column):
+            return pd.Series(np.full(len(column), np.datetime64("NaT", "ns")), index=column.index,
+                             name=column.name), None
+        with warnings.catch_warnings():
+            # Предупреждение pandas о поэлементном разборе ожидаемо: формат по выборке не определен
+            warnings.simplefilter("ignore", UserWarning)
+            parsed = pd.to_datetime(column, errors="coerce")
+        return pd.Series(parsed.to_numpy(dtype="datetime64[ns]"), index=column.index, name=column.name), None
+
+    def report(self) -> Dict:
+        with self._lock:
+            return dict(self.stats, schemas=len(self._formats))
+
+
+date_normalizer = DateNormalizer()
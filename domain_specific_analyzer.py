@@ -3,25 +3,28 @@ import json
 import re
 import pandas as pd
 from pathlib import Path
-from config import client, logger, llm
+from config import get_client, logger
+from columnar_store import load_columnar
+from data_ingestion import read_excel
+from image_roi import open_dashboard_image
 from typing import Optional, Dict
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from PIL import Image
 import io
+from model_router import model_router
+from prompt_registry import get_chain, get_prompt
+from token_budget import TokenBudget, degradation_ladder, estimate_image_tokens, estimate_text_tokens
 
 
 class DomainSpecificAnalyzer:
     def __init__(self, default_domain: str = ""):
         self.default_domain = default_domain
 
-    def encode_image(self, image_path: str) -> str:
+    def encode_image(self, image_path: str, max_side: int = 800) -> str:
         """Кодирует изображение в формат base64 с предварительным сжатием."""
         try:
-            # Открываем изображение
-            img = Image.open(image_path)
-            # Уменьшаем размер до 800x600
-            img.thumbnail((800, 600))
+            # Открываем изображение, обрезанное до областей с содержимым
+            img, _ = open_dashboard_image(image_path)
+            # Уменьшаем размер до 800x600 (или до max_side по длинной стороне)
+            img.thumbnail((max_side, max_side * 3 // 4))
             # Сохраняем в буфер с сжатием JPEG
             buffer = io.BytesIO()
             img.save(buffer, format="JPEG", quality=50)  # Сжатие с качеством 50
@@ -35,19 +38,27 @@ class DomainSpecificAnalyzer:
     def encode_data(self, data_path: str) -> str:
         """Кодирует данные в CSV в формате base64, ограничивая до 50 строк."""
         try:
-            if data_path.endswith('.csv'):
+            series = load_columnar(data_path)
+            if series is not None:
+                df = series.head(50).to_frame()
+                logger.info(f"Прочитано {len(df)} строк из колоночной копии {data_path}")
+            elif data_path.endswith('.csv'):
                 df = pd.read_csv(data_path, nrows=50)  # Ограничиваем до 50 строк
                 logger.info(f"Прочитано {len(df)} строк из CSV файла {data_path}")
             elif data_path.endswith('.xlsx'):
-                df = pd.read_excel(data_path, nrows=50)  # Ограничиваем до 50 строк
+                df, _ = read_excel(data_path)
+                if df is None:
+                    logger.error(f"Подходящие данные в файле Excel не найдены: {data_path}")
+                    return ""
+                df = df.head(50)  # Ограничиваем до 50 строк
                 logger.info(f"Прочитано {len(df)} строк из Excel файла {data_path}")
             else:
                 logger.error(f"Неподдерживаемый формат файла: {data_path}")
                 return ""
-            # Ограничиваем до двух столбцов (дата и первое числовое значение)
-            numeric_cols = df.select_dtypes(include=['number']).columns
+            # Оставляем дату и все числовые столбцы (наборы могут содержать несколько рядов)
+            numeric_cols = [col for col in df.select_dtypes(include=['number']).columns if col != df.columns[0]]
             if len(numeric_cols) > 0:
-                df = df[[df.columns[0], numeric_cols[0]]]  # Дата и первый числовой столбец
+                df = df[[df.columns[0]] + numeric_cols]  # Дата и числовые столбцы
             else:
                 df = df.iloc[:, :2]  # Первые два столбца, если числовых нет
             csv_buffer = df.to_csv(index=False)
@@ -78,24 +89,26 @@ class DomainSpecificAnalyzer:
 
     def suggest_domain(self, image_path: Optional[str], data_path: Optional[str]) -> Dict:
         """Определяет область дашборда на основе изображения и данных, возвращая JSON."""
-        base64_image = self.encode_image(image_path) if image_path else ""
         base64_data = self.encode_data(data_path) if data_path else ""
-        if not base64_image and not base64_data:
+        if not image_path and not base64_data:
             logger.warning("Отсутствуют данные и изображение, возвращается default_domain")
             return {"domain": self.default_domain}
 
+        def build(options):
+            base64_image = self.encode_image(image_path, options["image_side"]) if image_path else ""
+            prompt = get_prompt("suggest_domain").render(base64_image=base64_image or "отсутствует",
+                                                         base64_data=base64_data or "отсутствуют")
+            tokens = estimate_text_tokens(prompt)
+            if base64_image and not base64_image.startswith("Ошибка"):
+                # Изображение передается и в тексте, и вложением: вложение оценивается по размеру после сжатия
+                tokens += estimate_image_tokens(options["image_side"], options["image_side"] * 3 // 4)
+            return (base64_image, prompt), tokens, len(prompt) + len(base64_image)
+
+        base64_image, prompt = TokenBudget().fit("suggest_domain", build, degradation_ladder(image_side=800, image=True))
         logger.info(f"Размер base64_image: {len(base64_image)} байт, base64_data: {len(base64_data)} байт")
-        prompt = f"""Ты аналитик данных. На основе изображения дашборда и данных временного ряда определи область применения дашборда.
-        Извлеки контекст из полученных данных, а именно область применения дашборда (например, финансы, экономика, криптовалюта, медицина, политика, компьютерные вычисления и прочее, что можешь распознать).
-        Изображение в base64: {base64_image if base64_image else 'отсутствует'}
-        Данные в CSV (base64): {base64_data if base64_data else 'отсутствуют'}
-        Верни результат в формате JSON с полем "domain" (например, {{"domain": "Заболевания"}}).
-        Ответ должен быть заключен в ```json ```.
-        Инструкция: Декодируй base64, проанализируй данные и изображение, выбери наиболее подходящую область.
-        """
         try:
-            response = client.chat.completions.create(
-                model="aimediator.gpt-4.1-mini",
+            response = model_router.call("suggest_domain", lambda model: get_client().chat.completions.create(
+                model=model,
                 messages=[
                     {
                         "role": "user",
@@ -112,7 +125,7 @@ class DomainSpecificAnalyzer:
                 max_tokens=500,  # Уменьшено для оптимизации
                 temperature=0.5,
                 stream=False
-            )
+            ))
             if not response or not hasattr(response, 'choices') or not response.choices:
                 logger.error("Ответ от LLM пустой или не содержит choices")
                 return {"domain": self.default_domain}
@@ -133,27 +146,13 @@ class DomainSpecificAnalyzer:
     def query_domain(self, query: str, context: str, domain_features: Optional[Dict] = None) -> str:
         """Обрабатывает запрос пользователя, связанный с областью применения дашборда."""
         domain = domain_features.get("domain", self.default_domain) if domain_features else self.default_domain
-        prompt = ChatPromptTemplate.from_template(
-            """Ты аналитик данных, специализирующийся на определении области применения дашборда.
-            Запрос пользователя: {query}
-            Контекст: {context}
-            Область дашборда: {domain}
-
-            Ответь на вопрос, если он связан с областью применения дашборда (например, финансы, медицина, экономика).
-            Используй указанную область для ответа.
-            Используй термины, специфичные для финансовой области, если применимо.
-            Если вопрос не относится к твоей роли, верни "неизвестно".
-            Верни ответ кратко, одним-двумя предложениями."""
-        )
-
-        chain = prompt | llm | StrOutputParser()
 
         try:
-            response = chain.invoke({
+            response = model_router.call("query_domain", lambda model: get_chain("query_domain", model).invoke({
                 "query": query,
                 "context": context,
                 "domain": domain
-            })
+            }))
             logger.info(f"Ответ Domain Agent: {response}")
             return response
         except Exception as e:
@@ -0,0 +1,87 @@
+import io
+import os
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+from config import logger, THUMBNAIL_MAX_WIDTH
+
+
+class FileStateCache:
+    """Кэш состояния директорий загрузки для повторных запусков скрипта Streamlit.
+
+    Хранит имя текущего файла в директории, превью данных и подготовленную миниатюру изображения.
+    Записи живут до явной инвалидации директории (загрузка или удаление файла), поэтому обычный
+    rerun — например, ввод вопроса в чат — не обращается к диску и не разбирает файлы заново.
+    Директории общие для всех сессий, поэтому кэш один на процесс.
+    """
+
+    def __init__(self, thumbnail_max_width: int = THUMBNAIL_MAX_WIDTH):
+        self.thumbnail_max_width = thumbnail_max_width
+        self._lock = threading.Lock()
+        self._listings: Dict[str, Optional[str]] = {}
+        self._previews: Dict[str, object] = {}
+        self._thumbnails: Dict[str, Tuple[bytes, int]] = {}
+
+    def current_file(self, directory: str) -> Optional[str]:
+        """Первый видимый файл директории (скрытые записи, например колоночные копии, пропускаются)."""
+        with self._lock:
+            if directory in self._listings:
+                return self._listings[directory]
+        try:
+            files = [f for f in os.listdir(directory) if not f.startswith('.')]
+            logger.info(f"Получены файлы в {directory}: {files}")
+        except Exception as e:
+            logger.error(f"Ошибка чтения директории {directory}: {str(e)}")
+            return None
+        current = files[0] if files else None
+        with self._lock:
+            self._listings[directory] = current
+        return current
+
+    def data_preview(self, file_path: str, loader: Callable[[str], object]):
+        """Превью файла данных; loader вызывается только при первом обращении после инвалидации."""
+        with self._lock:
+            if file_path in self._previews:
+                return self._previews[file_path]
+        preview = loader(file_path)
+        if isinstance(preview, str) and not preview:
+            return preview  # Пустой результат означает ошибку чтения и не кэшируется
+        with self._lock:
+            self._previews[file_path] = preview
+        logger.info(f"Превью {file_path} подготовлено и сохранено в кэше")
+        return preview
+
+    def thumbnail(self, file_path: str) -> Tuple[bytes, int]:
+        """Изображение, уменьшенное до thumbnail_max_width, в виде PNG-байтов и его ширина."""
+        with self._lock:
+            if file_path in self._thumbnails:
+                return self._thumbnails[file_path]
+        from PIL import Image
+
+        with Image.open(file_path) as img:
+            img.load()
+            if img.width > self.thumbnail_max_width:
+                height = max(1, round(img.height * self.thumbnail_max_width / img.width))
+                img = img.resize((self.thumbnail_max_width, height), Image.LANCZOS)
+            if img.mode not in ("RGB", "RGBA", "L"):
+                img = img.convert("RGBA")
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG", optimize=False)
+            entry = (buffer.getvalue(), img.width)
+        with self._lock:
+            self._thumbnails[file_path] = entry
+        logger.info(f"Миниатюра {file_path} подготовлена: ширина {entry[1]} px, {len(entry[0])} байт")
+        return entry
+
+    def invalidate(self, directory: str) -> None:
+        """Сбрасывает все записи директории; вызывается после любой записи или удаления в ней."""
+        prefix = os.path.join(directory, "")
+        with self._lock:
+            self._listings.pop(directory, None)
+            for cache in (self._previews, self._thumbnails):
+                for path in [path for path in cache if path.startswith(prefix)]:
+                    del cache[path]
+        logger.info(f"Кэш состояния директории {directory} сброшен")
+
+
+file_cache = FileStateCache()
@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+
+from answer_cache import answer_cache, dataset_key, features_version, normalize_question, question_numbers, \
+    question_vector
+from config import (logger, FOLLOWUP_QUESTIONS, FOLLOWUP_REQUESTS_PER_HOUR, FOLLOWUP_IDLE_SECONDS,
+                    FOLLOWUP_IDLE_TIMEOUT, FOLLOWUP_WAIT_SECONDS)
+from gateway_scheduler import gateway_scheduler
+from model_router import model_router
+
+DEFAULT_QUESTION_COST = 4  # Запросов на вопрос: три агента и объединение ответов
+MAX_PREEMPTIONS = 3  # Попыток подготовить вопрос, прерванный запросами пользователя
+
+
+class FollowupPrecomputer:
+    """Подготовка ответов на вероятные вопросы после аннотации.
+
+    Вопросы из FOLLOWUP_QUESTIONS обрабатываются по одному в фоновом потоке тем же ChatAgent и с теми же
+    характеристиками, что и аннотация, поэтому ответы попадают в кэш ответов под ключом набора и при
+    похожем вопросе пользователя отдаются из него. Очередной вопрос отправляется только после
+    FOLLOWUP_IDLE_SECONDS без запросов пользователя к модели и пока не исчерпан часовой бюджет запросов.
+    Новая аннотация в той же сессии отменяет неначатые вопросы прежней.
+    """
+
+    def __init__(self, questions=FOLLOWUP_QUESTIONS, requests_per_hour: int = FOLLOWUP_REQUESTS_PER_HOUR):
+        self.questions = tuple(questions)
+        self.requests_per_hour = requests_per_hour
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._generations: Dict[str, int] = {}
+        self._scheduled = set()
+        self._spent = deque()
+        self._question_cost = DEFAULT_QUESTION_COST
+        self._current: Optional[Dict] = None
+        self._worker = threading.local()
+
+    def budget_left(self) -> int:
+        """Запросов к шлюзу, доступных фоновой подготовке в текущем часовом окне."""
+        now = time.monotonic()
+        with self._lock:
+            while self._spent and now - self._spent[0][0] >= 3600:
+                self._spent.popleft()
+            return self.requests_per_hour - sum(count for _, count in self._spent)
+
+    def schedule(self, chat_agent, image_path: Optional[str], data_path: Optional[str], dash_features: Optional[Dict],
+                 domain_features: Optional[Dict], ts_features: Optional[Dict], session_id: Optional[str] = None) -> bool:
+        """Ставит подготовку ответов для набора в очередь; False, если она не нужна или уже запланирована."""
+        if not self.questions or not ts_features:
+            return False
+        dataset = dataset_key(image_path, data_path)
+        version = features_version(dash_features, domain_features, ts_features)
+        session = session_id or dataset
+        with self._lock:
+            if (dataset, version) in self._scheduled:
+                return False
+            self._scheduled.add((dataset, version))
+            generation = self._generations.get(session, 0) + 1
+            self._generations[session] = generation
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="followup")
+        self._executor.submit(self._run, chat_agent, session, generation, dataset, version,
+                              (image_path, data_path, dash_features, domain_features, ts_features, session_id))
+        logger.info(f"Запланирована подготовка ответов на {len(self.questions)} вопросов для набора {dataset}")
+        return True
+
+    def _cancelled(self, session: str, generation: int) -> bool:
+        with self._lock:
+            return self._generations.get(session) != generation
+
+    def _wait_idle(self, session: str, generation: int) -> bool:
+        started = time.monotonic()
+        while model_router.idle_seconds() < FOLLOWUP_IDLE_SECONDS:
+            if self._cancelled(session, generation) or time.monotonic() - started > FOLLOWUP_IDLE_TIMEOUT:
+                return False
+            time.sleep(0.2)
+        return not self._cancelled(session, generation)
+
+    def _run(self, chat_agent, session: str, generation: int, dataset: str, version: str, request: tuple):
+        image_path, data_path, dash_features, domain_features, ts_features, session_id = request
+        self._worker.active = True
+        prepared = 0
+        questions = [(question, 0) for question in self.questions]
+        try:
+            while questions:
+                question, preemptions = questions.pop(0)
+                if answer_cache.lookup(dataset, version, question):
+                    continue
+                if self.budget_left() < self._question_cost:
+                    logger.info(f"Подготовка ответов для набора {dataset} остановлена: исчерпан бюджет запросов")
+                    break
+                if not self._wait_idle(session, generation):
+                    logger.info(f"Подготовка ответов для набора {dataset} прекращена")
+                    break
+                normalized = normalize_question(question)
+                current = {"dataset": dataset, "version": version, "vector": question_vector(normalized),
+                           "numbers": question_numbers(normalized), "done": threading.Event()}
+                with self._lock:
+                    self._current = current
+                try:
+                    with model_router.background(), gateway_scheduler.context(session=session):
+                        chat_agent.process_user_query(question, image_path, data_path, [], dash_features,
+                                                      domain_features, ts_features, session_id)
+                        spent = model_router.background_requests
+                        preempted = gateway_scheduler.preempted()
+                finally:
+                    with self._lock:
+                        self._current = None
+                    current["done"].set()
+                with self._lock:
+                    self._spent.append((time.monotonic(), spent))
+                    # Стоимость следующего вопроса оценивается по последнему: часть агентов может не отвечать
+                    self._question_cost = max(1, spent)
+                if preempted:
+                    # Неполный ответ в кэш не попал (объединение ответов тоже снято); вопрос готовится заново
+                    logger.info(f"Подготовка ответа на '{question}' прервана запросами пользователя")
+                    if preemptions + 1 < MAX_PREEMPTIONS:
+                        questions.insert(0, (question, preemptions + 1))
+                    continue
+                prepared += 1
+        except Exception as e:
+            logger.error(f"Ошибка подготовки ответов для набора {dataset}: {str(e)}")
+        finally:
+            self._worker.active = False
+            with self._lock:
+                self._scheduled.discard((dataset, version))
+        if prepared:
+            logger.info(f"Подготовлено ответов для набора {dataset}: {prepared}")
+
+    def wait_for(self, dataset: str, version: str, query: str, timeout: float = FOLLOWUP_WAIT_SECONDS) -> bool:
+        """Ждет фоновый ответ на вопрос, похожий на query, если он готовится прямо сейчас."""
+        if getattr(self._worker, "active", False):
+            return False
+        with self._lock:
+            current = self._current
+        if current is None or current["dataset"] != dataset or current["version"] != version:
+            return False
+        normalized = normalize_question(query)
+        if not normalized or question_numbers(normalized) != current["numbers"]:
+            return False
+        if float(np.dot(question_vector(normalized), current["vector"])) < answer_cache.threshold:
+            return False
+        logger.info(f"Вопрос '{query}' ожидает готовящийся в фоне ответ")
+        return current["done"].wait(timeout)
+
+
+followup_precomputer = FollowupPrecomputer()
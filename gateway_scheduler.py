@@ -0,0 +1,157 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from config import (logger, GATEWAY_SCHEDULER_ENABLED, GATEWAY_MAX_CONCURRENCY, GATEWAY_INTERACTIVE_RESERVED,
+                    GATEWAY_PRIORITIES, GATEWAY_BACKGROUND_PRIORITIES, NODE_PRIORITIES)
+
+_priority: ContextVar[Optional[str]] = ContextVar("gateway_priority", default=None)
+_session: ContextVar[Optional[str]] = ContextVar("gateway_session", default=None)
+_preempted: ContextVar[Optional[list]] = ContextVar("gateway_preempted", default=None)
+
+
+def current_session() -> Optional[str]:
+    """Сессия, от имени которой выполняются запросы текущего контекста."""
+    return _session.get()
+
+
+class GatewayPreempted(Exception):
+    """Фоновый запрос снят из очереди ради запроса пользователя."""
+
+
+class GatewayScheduler:
+    """Очередь запросов процесса к шлюзу LLM.
+
+    Одновременно выполняется не более max_concurrency запросов; остальные ждут в очереди. Очередь
+    упорядочена по классу приоритета (GATEWAY_PRIORITIES: чат, аннотация, фоновая подготовка, пакетная
+    обработка), внутри класса — по виртуальному времени окончания взвешенной справедливой очереди по
+    сессиям, поэтому сессия с десятками запросов не задерживает остальные дольше чем на свою долю.
+    Фоновым классам недоступны reserved мест, чтобы запросу пользователя не приходилось ждать окончания
+    длинных фоновых запросов, а ждущие в очереди запросы фоновой подготовки снимаются (GatewayPreempted),
+    когда запросу пользователя не хватает места.
+    """
+
+    def __init__(self, max_concurrency: int = GATEWAY_MAX_CONCURRENCY, reserved: int = GATEWAY_INTERACTIVE_RESERVED,
+                 enabled: bool = GATEWAY_SCHEDULER_ENABLED):
+        self.max_concurrency = max(1, max_concurrency)
+        self.reserved = min(max(0, reserved), self.max_concurrency - 1)
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._active = 0
+        self._active_background = 0
+        self._virtual = {priority: 0.0 for priority in GATEWAY_PRIORITIES}
+        self._finish: Dict[tuple, float] = {}
+        self.stats = {priority: {"requests": 0, "queued": 0, "preempted": 0, "wait_seconds": 0.0}
+                      for priority in GATEWAY_PRIORITIES}
+
+    @staticmethod
+    @contextmanager
+    def context(priority: Optional[str] = None, session: Optional[str] = None):
+        """Класс приоритета и сессия для запросов внутри блока (переходят и в потоки LangGraph)."""
+        tokens = []
+        if priority is not None:
+            tokens.append((_priority, _priority.set(priority)))
+            tokens.append((_preempted, _preempted.set([False])))
+        if session is not None:
+            tokens.append((_session, _session.set(session)))
+        try:
+            yield
+        finally:
+            for var, token in reversed(tokens):
+                var.reset(token)
+
+    @staticmethod
+    def preempted() -> bool:
+        """Был ли снят хотя бы один запрос текущего блока context()."""
+        flag = _preempted.get()
+        return bool(flag and flag[0])
+
+    def priority_for(self, node: str) -> str:
+        return _priority.get() or NODE_PRIORITIES.get(node, "annotation")
+
+    def _can_start(self, priority: str) -> bool:
+        if self._active >= self.max_concurrency:
+            return False
+        if priority in GATEWAY_BACKGROUND_PRIORITIES:
+            return self._active_background < self.max_concurrency - self.reserved
+        return True
+
+    def _preempt_speculative(self):
+        for item in self._queue:
+            ticket = item[-1]
+            if ticket["priority"] == "speculative" and not ticket["preempted"]:
+                ticket["preempted"] = True
+                self.stats["speculative"]["preempted"] += 1
+
+    @contextmanager
+    def slot(self, node: str, weight: float = 1.0):
+        """Место для одного запроса узла node к шлюзу; ожидание в очереди — до входа в блок."""
+        if not self.enabled:
+            yield
+            return
+        priority = self.priority_for(node)
+        flag = _preempted.get()
+        if priority == "speculative" and flag and flag[0]:
+            # Снятый фоновый вопрос не досылает оставшиеся запросы: без части агентов ответ был бы неполным
+            raise GatewayPreempted(f"{node}: фоновая подготовка прервана запросом пользователя")
+        session = _session.get() or ""
+        background = priority in GATEWAY_BACKGROUND_PRIORITIES
+        with self._cond:
+            start = max(self._virtual[priority], self._finish.get((priority, session), 0.0))
+            finish = start + 1.0 / max(weight, 1e-6)
+            self._finish[(priority, session)] = finish
+            if len(self._finish) > 1024:
+                # Сессии, отставшие от виртуального времени класса, больше не влияют на порядок
+                self._finish = {key: value for key, value in self._finish.items() if value > self._virtual[key[0]]}
+            ticket = {"priority": priority, "start": start, "preempted": False}
+            heapq.heappush(self._queue, (GATEWAY_PRIORITIES.index(priority), finish, next(self._sequence), ticket))
+            stats = self.stats[priority]
+            stats["requests"] += 1
+            waited = 0.0
+            if not (self._queue[0][-1] is ticket and self._can_start(priority)):
+                stats["queued"] += 1
+                if not background and self._active >= self.max_concurrency:
+                    self._preempt_speculative()
+                    self._cond.notify_all()
+                started = time.monotonic()
+                while not ticket["preempted"] and not (self._queue[0][-1] is ticket and self._can_start(priority)):
+                    self._cond.wait()
+                waited = time.monotonic() - started
+                stats["wait_seconds"] += waited
+            self._queue.remove(next(item for item in self._queue if item[-1] is ticket))
+            heapq.heapify(self._queue)
+            if ticket["preempted"]:
+                if flag is not None:
+                    flag[0] = True
+                self._cond.notify_all()
+                raise GatewayPreempted(f"{node}: фоновый запрос снят из очереди ради запроса пользователя")
+            self._virtual[priority] = max(self._virtual[priority], start)
+            self._active += 1
+            if background:
+                self._active_background += 1
+            # Освободившаяся голова очереди может стартовать сразу, если мест хватает
+            self._cond.notify_all()
+        if waited > 1.0:
+            logger.info(f"{node}: запрос ждал в очереди к шлюзу {waited:.1f} с (класс {priority})")
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if background:
+                    self._active_background -= 1
+                self._cond.notify_all()
+
+    def report(self) -> Dict:
+        with self._cond:
+            return {"active": self._active, "queued": len(self._queue),
+                    "classes": {priority: dict(stats) for priority, stats in self.stats.items()}}
+
+
+gateway_scheduler = GatewayScheduler()
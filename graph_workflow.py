@@ -1,10 +1,16 @@
 from typing import TypedDict, Dict, Optional
-from langgraph.graph import StateGraph, END
 from dashboard_analyzer import DashboardAnalyzer
 from timeseries_analyzer import TimeSeriesAnalyzer
 from domain_specific_analyzer import DomainSpecificAnalyzer
 from chat_agent import ChatAgent
-from pathlib import Path
+from incremental_annotation import IncrementalAnnotator
+from image_index import ImageFeatureIndex
+from offline_annotation import OfflineAnnotator
+from combined_analyzer import CombinedAnalyzer
+from followup_precompute import followup_precomputer
+from gateway_scheduler import gateway_scheduler
+from profiling import stage_profiler
+from config import logger, GRAPH_MODE, FOLLOWUP_PRECOMPUTE_ENABLED
 
 # определение структуры состояния агента
 class AgentState(TypedDict):
@@ -17,34 +23,91 @@ class AgentState(TypedDict):
     user_query: Optional[str]
     chat_history: list
     response: Optional[str]
+    incremental: Optional[Dict]
+    image_match: Optional[Dict]
+    session_id: Optional[str]
 
 
-def create_graph():
-    """Создает и настраивает граф задач для анализа дашборда и временного ряда."""
+def create_graph(mode: str = GRAPH_MODE):
+    """Создает и настраивает граф задач для анализа дашборда и временного ряда.
+
+    mode: "multi" — метрика, область и характеристики ряда определяются отдельными запросами;
+    "combined" — одним мультимодальным запросом (узел analyze_combined), а раздельные узлы
+    выполняются только для того, что получить не удалось.
+    """
+    from langgraph.graph import StateGraph, END
+
     dashboard_analyzer = DashboardAnalyzer()
     timeseries_analyzer = TimeSeriesAnalyzer()
     domain_specific_analyzer = DomainSpecificAnalyzer()
-    chat_agent = ChatAgent()
+    chat_agent = ChatAgent(dashboard_analyzer, domain_specific_analyzer, timeseries_analyzer)
+    incremental_annotator = IncrementalAnnotator(timeseries_analyzer)
+    image_index = ImageFeatureIndex()
+    offline_annotator = OfflineAnnotator(timeseries_analyzer)
+    combined_analyzer = CombinedAnalyzer(timeseries_analyzer, dashboard_analyzer)
 
     # создание графа состояний
     graph = StateGraph(AgentState)
 
+    def analyze_combined(state: AgentState) -> AgentState:
+        if not state["image_path"] or not state["data_path"] or state["dash_features"] or state["ts_features"]:
+            return state
+        match = image_index.lookup(state["image_path"])
+        if match:
+            state["image_match"] = match
+            state["dash_features"] = match["dash_features"]
+            state["domain_features"] = match["domain_features"]
+            return state
+        # Для дозаписанного ряда сохраняется инкрементальный путь раздельного режима
+        if incremental_annotator.load_snapshot(state["data_path"]) is not None:
+            return state
+        series, _ = timeseries_analyzer.load_series(state["data_path"])
+        if series is None:
+            return state
+        result = combined_analyzer.analyze(state["image_path"], series)
+        if not result:
+            return state
+        state["dash_features"] = result["dash_features"]
+        state["domain_features"] = result["domain_features"]
+        image_index.add(state["image_path"], state["dash_features"], state["domain_features"])
+        if result["ts_features"].get("trend", "неизвестно") != "неизвестно":
+            state["ts_features"] = result["ts_features"]
+            # План нужен, чтобы после аннотации сохранить снимок ряда для инкрементального обновления
+            state["incremental"] = incremental_annotator.plan(
+                state["data_path"], series.to_frame(), state["dash_features"]["main_metric"],
+                state["domain_features"]["domain"]
+            )
+        return state
+
+    # Узлы анализа пропускаются, если характеристики уже переданы в состоянии (например, из хранилища результатов)
     def analyze_dashboard(state: AgentState) -> AgentState:
-        if state["image_path"]:
-            state["dash_features"] = dashboard_analyzer.analyze_dashboard(state["image_path"])
+        if state["image_path"] and not state["dash_features"]:
+            # Повторно загруженный дашборд берется из индекса перцептивных хешей без обращения к LLM
+            match = image_index.lookup(state["image_path"])
+            state["image_match"] = match
+            if match:
+                state["dash_features"] = match["dash_features"]
+                state["domain_features"] = match["domain_features"]
+            else:
+                state["dash_features"] = dashboard_analyzer.analyze_dashboard(state["image_path"])
         return state
 
     def analyze_domain(state: AgentState) -> AgentState:
+        if state.get("image_match") or state["domain_features"]:
+            return state
         if state["image_path"] or state["data_path"]:
             state["domain_features"] = domain_specific_analyzer.suggest_domain(
                 state["image_path"], state["data_path"]
             )
+            if state["image_path"]:
+                image_index.add(state["image_path"], state["dash_features"], state["domain_features"])
         return state
 
     def analyze_timeseries(state: AgentState) -> AgentState:
-        if state["data_path"]:
-            df, message = timeseries_analyzer.read_data(Path(state["data_path"]))
-            if df is None:
+        if state["data_path"] and not state["ts_features"]:
+            # Ряд читается один раз и передается анализаторам по ссылке; DataFrame — представление тех же массивов
+            series, message = timeseries_analyzer.load_series(state["data_path"])
+            if series is None:
                 state["ts_features"] = {
                     "metric": state["dash_features"].get("main_metric", "неизвестно") if state["dash_features"] else "неизвестно",
                     "domain": state["domain_features"].get("domain", "finance") if state["domain_features"] else "finance",
@@ -56,17 +119,59 @@ def create_graph():
                     "hypotheses": message
                 }
             else:
-                state["ts_features"] = timeseries_analyzer.analyze_time_series(
-                    df,
-                    state["image_path"],
-                    state["dash_features"].get("main_metric", "неизвестно") if state["dash_features"] else "неизвестно",
-                    state["domain_features"].get("domain", "finance") if state["domain_features"] else "finance"
-                )
+                df = series.to_frame()
+                main_metric = state["dash_features"].get("main_metric", "неизвестно") if state["dash_features"] else "неизвестно"
+                domain = state["domain_features"].get("domain", "finance") if state["domain_features"] else "finance"
+                plan = incremental_annotator.plan(state["data_path"], df, main_metric, domain)
+                state["incremental"] = plan
+                if plan["kind"] == "full" and len(df.columns) > 2:
+                    state["ts_features"] = timeseries_analyzer.analyze_multi_series(
+                        df,
+                        state["image_path"],
+                        main_metric,
+                        domain
+                    )
+                elif plan["kind"] == "full":
+                    state["ts_features"] = timeseries_analyzer.analyze_time_series(
+                        series,
+                        state["image_path"],
+                        main_metric,
+                        domain
+                    )
+                else:
+                    state["ts_features"] = plan["ts_features"]
+                if state["ts_features"].get("trend", "неизвестно") == "неизвестно":
+                    # LLM недоступен или ответил ошибкой: характеристики рассчитываются локально
+                    logger.warning(f"Анализ ряда через LLM не удался, используются локальные характеристики: "
+                                   f"{state['ts_features'].get('hypotheses')}")
+                    state["ts_features"] = offline_annotator.features(df, main_metric, domain)
         return state
 
     def generate_annotation(state: AgentState) -> AgentState:
         if state["ts_features"] and not state["user_query"]:
-            state["final_annotation"] = chat_agent.generate_general_annotation(state["ts_features"])
+            plan = state.get("incremental")
+            offline = state["ts_features"].get("source") == "local"
+            if plan and plan["kind"] == "reuse":
+                state["final_annotation"] = plan["snapshot"]["final_annotation"]
+            elif plan and plan["kind"] == "revise":
+                state["final_annotation"] = chat_agent.revise_annotation(
+                    plan["snapshot"]["final_annotation"], state["ts_features"], plan["changes"]
+                )
+            elif offline:
+                state["final_annotation"] = offline_annotator.annotate(state["ts_features"])
+            else:
+                state["final_annotation"] = chat_agent.generate_general_annotation(state["ts_features"])
+                if state["final_annotation"].startswith("Ошибка"):
+                    state["final_annotation"] = offline_annotator.annotate(state["ts_features"])
+                    offline = True
+            # Локальная аннотация не сохраняется в снимок, чтобы при следующем запуске ее заменил ответ LLM
+            if plan and not offline:
+                incremental_annotator.save(state["data_path"], plan, state["ts_features"], state["final_annotation"])
+            if FOLLOWUP_PRECOMPUTE_ENABLED and not offline:
+                # Ответы на вероятные следующие вопросы готовятся в фоне, пока пользователь читает аннотацию
+                followup_precomputer.schedule(chat_agent, state["image_path"], state["data_path"],
+                                              state["dash_features"], state["domain_features"], state["ts_features"],
+                                              state.get("session_id"))
         return state
 
     def process_query(state: AgentState) -> AgentState:
@@ -78,17 +183,31 @@ def create_graph():
                 state["chat_history"],
                 state["dash_features"],
                 state["domain_features"],
-                state["ts_features"]
+                state["ts_features"],
+                state.get("session_id")
             )
         return state
 
-    graph.add_node("analyze_dashboard", analyze_dashboard)
-    graph.add_node("analyze_domain", analyze_domain)
-    graph.add_node("analyze_timeseries", analyze_timeseries)
-    graph.add_node("generate_annotation", generate_annotation)
-    graph.add_node("process_query", process_query)
+    def in_session(node):
+        # Запросы узла к шлюзу встают в справедливую очередь планировщика от имени сессии пользователя;
+        # при PROFILE=1 каждый вызов узла профилируется как этап с именем узла
+        def run(state: AgentState) -> AgentState:
+            with gateway_scheduler.context(session=state.get("session_id")), stage_profiler.profile(node.__name__):
+                return node(state)
+        return run
+
+    graph.add_node("analyze_dashboard", in_session(analyze_dashboard))
+    graph.add_node("analyze_domain", in_session(analyze_domain))
+    graph.add_node("analyze_timeseries", in_session(analyze_timeseries))
+    graph.add_node("generate_annotation", in_session(generate_annotation))
+    graph.add_node("process_query", in_session(process_query))
 
-    graph.set_entry_point("analyze_dashboard")
+    if mode == "combined":
+        graph.add_node("analyze_combined", in_session(analyze_combined))
+        graph.set_entry_point("analyze_combined")
+        graph.add_edge("analyze_combined", "analyze_dashboard")
+    else:
+        graph.set_entry_point("analyze_dashboard")
     graph.add_edge("analyze_dashboard", "analyze_domain")
     graph.add_edge("analyze_domain", "analyze_timeseries")
     graph.add_edge("analyze_timeseries", "generate_annotation")
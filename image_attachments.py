@@ -0,0 +1,89 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import (logger, ALLOWED_IMAGE_EXTENSIONS, CHAT_IMAGE_DETAIL, CHAT_IMAGE_SIDES,
+                    CHAT_IMAGE_HIGH_DETAIL_WORDS, CHAT_IMAGE_SESSIONS)
+from session_usage import session_usage
+from token_budget import encode_image_scaled, estimate_image_tokens
+
+
+def choose_detail(query: str) -> str:
+    """Уровень детализации изображения для вопроса: высокий — если вопрос о подписях, легенде, осях и т.п.
+
+    Сессия у предела квоты всегда получает низкую детализацию.
+    """
+    if session_usage.payload_tier():
+        return "low"
+    words = re.findall(r"\w+", query.lower())
+    if any(word.startswith(CHAT_IMAGE_HIGH_DETAIL_WORDS) for word in words):
+        return "high"
+    return CHAT_IMAGE_DETAIL
+
+
+class ImageAttachments:
+    """Изображения дашборда, подготовленные как вложения для вопросов в чате.
+
+    Изображение уменьшается до стороны уровня детализации и кодируется один раз; дальше вопросы
+    той же сессии получают готовое вложение по его дескриптору (сессия, содержимое файла, уровень).
+    Замена изображения меняет дескриптор, и прежние вложения сессии удаляются.
+    """
+
+    def __init__(self, max_sessions: int = CHAT_IMAGE_SESSIONS):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Dict[str, Dict]]" = OrderedDict()
+
+    @staticmethod
+    def file_key(image_path: str) -> str:
+        stat = os.stat(image_path)
+        return hashlib.sha1(f"{os.path.abspath(image_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:16]
+
+    def get(self, image_path: str, detail: str = CHAT_IMAGE_DETAIL, session_id: Optional[str] = None) -> Dict:
+        """Вложение {handle, part, tokens, size}: part — часть сообщения типа image_url для модели."""
+        if Path(image_path).suffix[1:].lower() not in ALLOWED_IMAGE_EXTENSIONS:
+            raise ValueError(f"Неподдерживаемый формат файла: {Path(image_path).suffix}")
+        session = session_id or "-"
+        file_key = self.file_key(image_path)
+        handle = f"{session}:{file_key}:{detail}"
+        with self._lock:
+            attachments = self._sessions.get(session)
+            if attachments is not None:
+                self._sessions.move_to_end(session)
+                if handle in attachments:
+                    return attachments[handle]
+
+        encoded, (width, height) = encode_image_scaled(image_path, CHAT_IMAGE_SIDES.get(detail))
+        url = f"data:image/jpeg;base64,{encoded}"
+        attachment = {
+            "handle": handle,
+            "part": {"type": "image_url", "image_url": {"url": url, "detail": detail}},
+            "tokens": estimate_image_tokens(width, height, detail),
+            "size": len(url)
+        }
+        logger.info(f"Вложение {handle} подготовлено: {width}x{height}, ~{attachment['tokens']} токенов")
+
+        with self._lock:
+            attachments = self._sessions.setdefault(session, {})
+            # Вложения прежнего изображения сессии больше не понадобятся
+            for stale in [key for key in attachments if key.split(":")[1] != file_key]:
+                del attachments[stale]
+            attachments[handle] = attachment
+            self._sessions.move_to_end(session)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return attachment
+
+    def invalidate(self, session_id: Optional[str] = None) -> None:
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+            else:
+                self._sessions.pop(session_id, None)
+
+
+image_attachments = ImageAttachments()
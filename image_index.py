@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import logger, IMAGE_INDEX_DB, IMAGE_HASH_SIZE, IMAGE_HASH_MAX_DISTANCE
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _to_signed(value: int) -> int:
+    """SQLite хранит INTEGER как знаковое 64-битное число."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def image_hashes(image_path: str, size: int = IMAGE_HASH_SIZE) -> Tuple[int, int]:
+    """Перцептивные хеши изображения: aHash (яркость относительно средней) и dHash (градиент по строкам)."""
+    with Image.open(image_path) as img:
+        gray = img.convert("L")
+        small = np.asarray(gray.resize((size, size), Image.LANCZOS), dtype=np.float64)
+        wide = np.asarray(gray.resize((size + 1, size), Image.LANCZOS), dtype=np.float64)
+    average_hash = _bits_to_int(small > small.mean())
+    difference_hash = _bits_to_int(wide[:, 1:] > wide[:, :-1])
+    return _to_signed(average_hash), _to_signed(difference_hash)
+
+
+def hamming_distances(hashes: np.ndarray, value: int) -> np.ndarray:
+    """Расстояния Хэмминга между массивом 64-битных хешей и одним хешем."""
+    xor = (hashes ^ np.int64(value)).view(np.uint64)
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class ImageFeatureIndex:
+    """Индекс проанализированных дашбордов по перцептивным хешам в локальной базе SQLite.
+
+    Повторно загруженный дашборд (в том числе новый скриншот другого размера) находится по расстоянию
+    Хэмминга между хешами, и его dash_features и domain_features берутся из индекса без обращения к LLM.
+    Расстояние — суммарное число различающихся бит aHash и dHash; совпадением считается запись,
+    для которой оно не превышает max_distance.
+    """
+
+    def __init__(self, db_path: str = IMAGE_INDEX_DB, max_distance: int = IMAGE_HASH_MAX_DISTANCE):
+        self.db_path = Path(db_path)
+        self.max_distance = max_distance
+
+    def _connect(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.db_path)
+        connection.execute(
+            """CREATE TABLE IF NOT EXISTS images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ahash INTEGER NOT NULL,
+                dhash INTEGER NOT NULL,
+                dash_features TEXT NOT NULL,
+                domain_features TEXT NOT NULL,
+                source_name TEXT,
+                created_at REAL NOT NULL
+            )"""
+        )
+        return connection
+
+    def lookup(self, image_path: str) -> Optional[Dict]:
+        """Ищет ближайший ранее проанализированный дашборд; None, если подходящего нет."""
+        try:
+            average_hash, difference_hash = image_hashes(image_path)
+            with closing(self._connect()) as connection, connection:
+                rows = np.array(connection.execute("SELECT id, ahash, dhash FROM images").fetchall(),
+                                dtype=np.int64).reshape(-1, 3)
+                if len(rows) == 0:
+                    return None
+                distances = hamming_distances(rows[:, 1], average_hash) + hamming_distances(rows[:, 2], difference_hash)
+                # При равном расстоянии предпочтение отдается более поздней записи
+                best = int(np.lexsort((-rows[:, 0], distances))[0])
+                if distances[best] > self.max_distance:
+                    logger.info(f"Изображение {image_path} не найдено в индексе (ближайшее расстояние {distances[best]})")
+                    return None
+                dash_features, domain_features = connection.execute(
+                    "SELECT dash_features, domain_features FROM images WHERE id = ?", (int(rows[best, 0]),)
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка поиска изображения {image_path} в индексе: {str(e)}")
+            return None
+        match = {
+            "id": int(rows[best, 0]),
+            "distance": int(distances[best]),
+            "dash_features": json.loads(dash_features),
+            "domain_features": json.loads(domain_features)
+        }
+        logger.info(f"Изображение {image_path} совпало с записью {match['id']} индекса "
+                    f"(расстояние {match['distance']} бит)")
+        return match
+
+    def add(self, image_path: str, dash_features: Optional[Dict], domain_features: Optional[Dict]) -> bool:
+        """Сохраняет результаты анализа дашборда; неудачные анализы не индексируются."""
+        if not dash_features or dash_features.get("main_metric", "неизвестно") == "неизвестно":
+            return False
+        if not domain_features or not domain_features.get("domain") or "error" in domain_features:
+            return False
+        try:
+            average_hash, difference_hash = image_hashes(image_path)
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "INSERT INTO images (ahash, dhash, dash_features, domain_features, source_name, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (average_hash, difference_hash, json.dumps(dash_features, ensure_ascii=False),
+                     json.dumps(domain_features, ensure_ascii=False), Path(image_path).name, time.time())
+                )
+            logger.info(f"Изображение {image_path} добавлено в индекс дашбордов")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка добавления изображения {image_path} в индекс: {str(e)}")
+            return False
@@ -0,0 +1,96 @@
+import os
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import (logger, IMAGE_ROI_ENABLED, IMAGE_ROI_ANALYSIS_SIDE, IMAGE_ROI_INK_THRESHOLD, IMAGE_ROI_MIN_GAP,
+                    IMAGE_ROI_PADDING, IMAGE_ROI_MIN_SAVING, IMAGE_ROI_CACHE_SIZE)
+
+
+def _runs(mask: np.ndarray, min_gap: int) -> List[Tuple[int, int]]:
+    """Отрезки True в mask; промежутки короче min_gap не разделяют отрезки."""
+    index = np.flatnonzero(mask)
+    if not len(index):
+        return []
+    breaks = np.flatnonzero(np.diff(index) > min_gap)
+    starts = np.concatenate(([index[0]], index[breaks + 1]))
+    ends = np.concatenate((index[breaks], [index[-1]])) + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def ink_mask(gray: np.ndarray, threshold: int = IMAGE_ROI_INK_THRESHOLD) -> np.ndarray:
+    """Пиксели содержимого: отличие от цвета фона (медиана рамки) или резкий перепад яркости с соседом."""
+    border = np.concatenate((gray[0], gray[-1], gray[:, 0], gray[:, -1]))
+    background = np.median(border)
+    ink = np.abs(gray - background) > threshold
+    # Светлые линии сетки и рамки почти не отличаются от фона, но дают перепад на границе
+    ink[:, 1:] |= np.abs(np.diff(gray, axis=1)) > threshold
+    ink[1:, :] |= np.abs(np.diff(gray, axis=0)) > threshold
+    return ink
+
+
+def content_regions(ink: np.ndarray, min_gap: float = IMAGE_ROI_MIN_GAP) -> Tuple[List[Tuple[int, int]], Tuple[int, int]]:
+    """Горизонтальные полосы содержимого (заголовок, график, легенда, таблица) и общие левая и правая границы.
+
+    Полосы разделяются строками фона высотой не меньше min_gap высоты изображения. По горизонтали
+    обрезаются только общие поля: иначе сместились бы друг относительно друга столбцы таблиц и подписи осей.
+    """
+    height = ink.shape[0]
+    bands = [(top, bottom) for top, bottom in _runs(ink.any(axis=1), max(3, int(height * min_gap)))
+             # Полосы из одной-двух строк пикселей — шум сжатия, а не содержимое
+             if bottom - top > 2]
+    columns = np.flatnonzero(ink.any(axis=0))
+    if not bands or not len(columns):
+        return [], (0, ink.shape[1])
+    return bands, (int(columns[0]), int(columns[-1]) + 1)
+
+
+def crop_to_regions(img: Image.Image) -> Image.Image:
+    """Изображение из полос содержимого без полей и промежутков фона между ними.
+
+    Полосы ставятся друг под другом с отступом IMAGE_ROI_PADDING в исходном порядке, горизонтальное
+    положение внутри полос сохраняется. Если площадь уменьшается меньше чем на IMAGE_ROI_MIN_SAVING,
+    возвращается исходное изображение.
+    """
+    img = img.convert("RGB")
+    scale = min(1.0, IMAGE_ROI_ANALYSIS_SIDE / max(img.size))
+    small = img if scale == 1.0 else img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))))
+    bands, (left, right) = content_regions(ink_mask(np.asarray(small.convert("L"), dtype=np.int16)))
+    if not bands:
+        return img
+
+    # Координаты копии для анализа переводятся в исходные с запасом на округление
+    pad = IMAGE_ROI_PADDING
+    left, right = max(0, int(left / scale) - pad), min(img.width, int(np.ceil(right / scale)) + pad)
+    tiles = [img.crop((left, max(0, int(top / scale) - pad), right, min(img.height, int(np.ceil(bottom / scale)) + pad)))
+             for top, bottom in bands]
+    width, height = right - left, sum(tile.height for tile in tiles) + pad * (len(tiles) - 1)
+    if width * height > (1 - IMAGE_ROI_MIN_SAVING) * img.width * img.height:
+        return img
+    background = tuple(int(v) for v in np.median(np.asarray(img)[[0, -1]].reshape(-1, 3), axis=0))
+    canvas = Image.new("RGB", (width, height), background)
+    y = 0
+    for tile in tiles:
+        canvas.paste(tile, (0, y))
+        y += tile.height + pad
+    logger.info(f"Изображение обрезано до {len(tiles)} полос содержимого: {img.width}x{img.height} -> {width}x{height}")
+    return canvas
+
+
+@lru_cache(maxsize=IMAGE_ROI_CACHE_SIZE)
+def _cropped(image_path: str, size: int, mtime_ns: int) -> Tuple[Image.Image, Tuple[int, int]]:
+    with Image.open(image_path) as img:
+        return crop_to_regions(img), img.size
+
+
+def open_dashboard_image(image_path: str) -> Tuple[Image.Image, Tuple[int, int]]:
+    """Изображение дашборда в том виде, в каком оно отправляется модели (копия, которую можно изменять),
+    и размер исходного файла."""
+    if not IMAGE_ROI_ENABLED:
+        with Image.open(image_path) as img:
+            return img.convert("RGB"), img.size
+    stat = os.stat(image_path)
+    img, original_size = _cropped(os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+    return img.copy(), original_size
@@ -0,0 +1,179 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import logger, INCREMENTAL_DIR, INCREMENTAL_MAX_APPEND_RATIO
+from local_features import LocalFeatures
+from prompt_registry import PROMPTS_VERSION
+from timeseries_analyzer import TimeSeriesAnalyzer, format_date_for_human
+
+
+def series_hash(dates: Optional[np.ndarray], values: np.ndarray, count: int) -> str:
+    """Хеш первых count точек ряда (даты и значения)."""
+    digest = hashlib.sha1()
+    if dates is not None:
+        digest.update(np.ascontiguousarray(dates[:count]).tobytes())
+    digest.update(np.ascontiguousarray(values[:count]).tobytes())
+    return digest.hexdigest()
+
+
+def describe_point(index: int, date: Optional[int]) -> str:
+    return format_date_for_human(pd.Timestamp(date)) if date is not None else f"Запись {index}"
+
+
+class IncrementalAnnotator:
+    """Распознает дозапись новых точек в уже проаннотированный ряд и решает, нужна ли новая аннотация.
+
+    Для каждого файла данных хранится снимок: хеш ряда, локальные характеристики, ts_features и аннотация.
+    Если новый ряд начинается с уже известного префикса, характеристики обновляются только по хвосту,
+    а LLM привлекается лишь при существенных изменениях (новый экстремум, аномалия или разладка).
+    """
+
+    def __init__(self, timeseries_analyzer: Optional[TimeSeriesAnalyzer] = None, store_dir: str = INCREMENTAL_DIR):
+        self.timeseries_analyzer = timeseries_analyzer or TimeSeriesAnalyzer()
+        self.store_dir = Path(store_dir)
+
+    def _snapshot_path(self, data_path: str) -> Path:
+        key = hashlib.sha1(Path(data_path).name.encode("utf-8")).hexdigest()
+        return self.store_dir / f"{key}.json"
+
+    def load_snapshot(self, data_path: str) -> Optional[Dict]:
+        path = self._snapshot_path(data_path)
+        if not path.exists():
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения снимка {path}: {str(e)}")
+            return None
+
+    def plan(self, data_path: str, df: pd.DataFrame, main_metric: str, domain: str) -> Dict:
+        """Сравнивает ряд с сохраненным снимком и определяет вид обработки: full, reuse или revise."""
+        if len(df.columns) > 2:
+            logger.info(f"Полный анализ {data_path}: инкрементальное обновление поддерживается только для одного ряда")
+            return {"kind": "full", "features": None}
+        dates, values = self.timeseries_analyzer.series_arrays(df)
+        snapshot = self.load_snapshot(data_path)
+        plan = {
+            "kind": "full",
+            "count": len(values),
+            "hash": series_hash(dates, values, len(values)),
+            "metric": main_metric,
+            "domain": domain,
+            "changes": [],
+            "features": None,
+            "ts_features": None,
+            "snapshot": snapshot
+        }
+
+        reason = self._reuse_blocker(snapshot, dates, values, main_metric, domain)
+        if reason:
+            logger.info(f"Полный анализ ряда {data_path}: {reason}")
+            plan["features"] = LocalFeatures.from_series(values, dates).to_dict()
+            return plan
+
+        previous_count = snapshot["count"]
+        features = LocalFeatures.from_dict(snapshot["features"])
+        features.update(values[previous_count:], dates[previous_count:] if dates is not None else None)
+        plan["features"] = features.to_dict()
+        plan["changes"] = self._material_changes(snapshot["features"], features)
+
+        ts_features = dict(snapshot["ts_features"])
+        if plan["changes"]:
+            plan["kind"] = "revise"
+            ts_features.update(self._updated_ts_features(snapshot, features))
+        else:
+            plan["kind"] = "reuse"
+        plan["ts_features"] = ts_features
+        logger.info(f"Ряд {data_path}: дозаписано {len(values) - previous_count} точек, режим {plan['kind']}, "
+                    f"изменения: {plan['changes']}")
+        return plan
+
+    def _reuse_blocker(self, snapshot: Optional[Dict], dates: Optional[np.ndarray], values: np.ndarray,
+                       main_metric: str, domain: str) -> Optional[str]:
+        """Возвращает причину, по которой снимок нельзя использовать, или None."""
+        if snapshot is None:
+            return "снимок отсутствует"
+        if snapshot.get("prompts_version") != PROMPTS_VERSION:
+            return "изменились промпты"
+        if snapshot.get("metric") != main_metric or snapshot.get("domain") != domain:
+            return "изменились метрика или область дашборда"
+        previous_count = snapshot.get("count", 0)
+        if len(values) < previous_count:
+            return "ряд стал короче"
+        if series_hash(dates, values, previous_count) != snapshot.get("hash"):
+            return "изменились ранее загруженные точки"
+        if len(values) - previous_count > INCREMENTAL_MAX_APPEND_RATIO * previous_count:
+            return "дозаписано слишком много точек"
+        return None
+
+    def _material_changes(self, previous: Dict, features: LocalFeatures) -> List[str]:
+        """Перечисляет существенные изменения характеристик, появившиеся в хвосте ряда."""
+        changes = []
+        if features.min_index != previous["min_index"]:
+            changes.append(f"Новый минимум: {round(features.min_value, 2)} "
+                           f"{describe_point(features.min_index, features.min_date)}")
+        if features.max_index != previous["max_index"]:
+            changes.append(f"Новый максимум: {round(features.max_value, 2)} "
+                           f"{describe_point(features.max_index, features.max_date)}")
+        for anomaly in features.anomalies:
+            if anomaly["index"] >= previous["count"]:
+                changes.append(f"Аномалия: значение {round(anomaly['value'], 2)} "
+                               f"{describe_point(anomaly['index'], anomaly['date'])} "
+                               f"(отклонение {anomaly['score']} σ)")
+        for changepoint in features.changepoints:
+            if changepoint["index"] >= previous["count"]:
+                changes.append(f"Смена режима ({changepoint['direction']}) "
+                               f"{describe_point(changepoint['index'], changepoint['date'])}")
+        return changes
+
+    def _updated_ts_features(self, snapshot: Dict, features: LocalFeatures) -> Dict:
+        """Обновляет экстремумы и аномалии в ts_features по локальным характеристикам."""
+        previous = snapshot["features"]
+        updates = {}
+        if features.min_index != previous["min_index"]:
+            updates["min_value"] = f"{round(features.min_value, 2)} {describe_point(features.min_index, features.min_date)}"
+        if features.max_index != previous["max_index"]:
+            updates["max_value"] = f"{round(features.max_value, 2)} {describe_point(features.max_index, features.max_date)}"
+        new_anomalies = [
+            {
+                "value": round(anomaly["value"], 2),
+                "date": describe_point(anomaly["index"], anomaly["date"]),
+                "description": f"Отклонение {anomaly['score']} σ от сглаженного уровня ряда"
+            }
+            for anomaly in features.anomalies if anomaly["index"] >= previous["count"]
+        ]
+        if new_anomalies:
+            updates["anomalies"] = list(snapshot["ts_features"].get("anomalies", [])) + new_anomalies
+        return updates
+
+    def save(self, data_path: str, plan: Dict, ts_features: Dict, final_annotation: str) -> None:
+        """Сохраняет снимок после успешной аннотации."""
+        if plan.get("features") is None:
+            return
+        if ts_features.get("trend", "неизвестно") == "неизвестно" or final_annotation.startswith("Ошибка"):
+            logger.info(f"Снимок для {data_path} не сохранен: анализ завершился с ошибкой")
+            return
+        snapshot = {
+            "count": plan["count"],
+            "hash": plan["hash"],
+            "metric": plan["metric"],
+            "domain": plan["domain"],
+            "prompts_version": PROMPTS_VERSION,
+            "features": plan["features"],
+            "ts_features": ts_features,
+            "final_annotation": final_annotation
+        }
+        path = self._snapshot_path(data_path)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            logger.info(f"Снимок ряда {data_path} сохранен: {path}")
+        except Exception as e:
+            logger.error(f"Ошибка сохранения снимка {path}: {str(e)}")
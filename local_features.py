@@ -0,0 +1,191 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import (ANOMALY_EWMA_ALPHA, ANOMALY_Z_THRESHOLD, ANOMALY_WARMUP, CHANGEPOINT_DRIFT,
+                    CHANGEPOINT_THRESHOLD, LOCAL_FEATURES_MAX_EVENTS)
+
+
+class LocalFeatures:
+    """Локально вычисляемые характеристики ряда: экстремумы, онлайн-оценка аномалий и точки разладки.
+
+    Состояние обновляется инкрементально: обработка ряда целиком и по частям дает одинаковый результат,
+    поэтому при дозаписи новых точек достаточно передать в update только хвост ряда.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.min_value: Optional[float] = None
+        self.min_index: Optional[int] = None
+        self.min_date: Optional[int] = None
+        self.max_value: Optional[float] = None
+        self.max_index: Optional[int] = None
+        self.max_date: Optional[int] = None
+        # Экспоненциально сглаженные среднее и дисперсия для онлайн-оценки аномалий
+        self.ewm_mean: Optional[float] = None
+        self.ewm_var = 0.0
+        # Двусторонний CUSUM по стандартизированным отклонениям
+        self.cusum_pos = 0.0
+        self.cusum_neg = 0.0
+        self.anomalies: List[Dict] = []
+        self.changepoints: List[Dict] = []
+
+    @classmethod
+    def from_series(cls, values: np.ndarray, dates: Optional[np.ndarray] = None) -> "LocalFeatures":
+        return cls().update(values, dates)
+
+    def update(self, values: np.ndarray, dates: Optional[np.ndarray] = None) -> "LocalFeatures":
+        """Добавляет новые точки ряда (в хронологическом порядке) и обновляет характеристики."""
+        values = np.asarray(values, dtype=np.float64)
+        size = len(values)
+        if size == 0:
+            return self
+        start = self.count
+        index = np.arange(start, start + size)
+
+        def date_at(i: int) -> Optional[int]:
+            return int(dates[i]) if dates is not None else None
+
+        # Экстремумы: при равенстве сохраняется более ранняя точка
+        i = int(np.argmin(values))
+        if self.min_value is None or values[i] < self.min_value:
+            self.min_value, self.min_index, self.min_date = float(values[i]), start + i, date_at(i)
+        i = int(np.argmax(values))
+        if self.max_value is None or values[i] > self.max_value:
+            self.max_value, self.max_index, self.max_date = float(values[i]), start + i, date_at(i)
+
+        # Онлайн-оценка аномалий: отклонение точки от EWMA, рассчитанного по предыдущим точкам
+        alpha = ANOMALY_EWMA_ALPHA
+        prev_mean = self.ewm_mean if self.ewm_mean is not None else float(values[0])
+        means = pd.Series(np.concatenate(([prev_mean], values))).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+        residuals = values - means[:-1]
+        variances = pd.Series(np.concatenate(([self.ewm_var], (1 - alpha) * residuals ** 2))) \
+            .ewm(alpha=alpha, adjust=False).mean().to_numpy()
+        std = np.sqrt(variances[:-1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = np.where(std > 0, residuals / std, 0.0)
+        scores[index < ANOMALY_WARMUP] = 0.0
+        self.ewm_mean = float(means[-1])
+        self.ewm_var = float(variances[-1])
+
+        for i in np.nonzero(np.abs(scores) > ANOMALY_Z_THRESHOLD)[0]:
+            self.anomalies.append({
+                "index": int(start + i),
+                "date": date_at(i),
+                "value": float(values[i]),
+                "score": round(float(scores[i]), 2)
+            })
+        self.anomalies = self.anomalies[-LOCAL_FEATURES_MAX_EVENTS:]
+
+        # CUSUM с перезапуском после каждой обнаруженной разладки
+        offset = 0
+        while offset < size:
+            segment = scores[offset:]
+            up = np.cumsum(segment - CHANGEPOINT_DRIFT)
+            up = up - np.minimum(np.minimum.accumulate(up), -self.cusum_pos)
+            down = np.cumsum(-segment - CHANGEPOINT_DRIFT)
+            down = down - np.minimum(np.minimum.accumulate(down), -self.cusum_neg)
+            alarms = np.nonzero((up > CHANGEPOINT_THRESHOLD) | (down > CHANGEPOINT_THRESHOLD))[0]
+            if len(alarms) == 0:
+                self.cusum_pos, self.cusum_neg = float(up[-1]), float(down[-1])
+                break
+            i = offset + int(alarms[0])
+            self.changepoints.append({
+                "index": int(start + i),
+                "date": date_at(i),
+                "direction": "рост" if up[alarms[0]] > CHANGEPOINT_THRESHOLD else "снижение"
+            })
+            self.cusum_pos = self.cusum_neg = 0.0
+            offset = i + 1
+        self.changepoints = self.changepoints[-LOCAL_FEATURES_MAX_EVENTS:]
+
+        self.count += size
+        return self
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LocalFeatures":
+        features = cls()
+        features.__dict__.update(data)
+        features.anomalies = list(features.anomalies)
+        features.changepoints = list(features.changepoints)
+        return features
+
+
+def series_summaries(dates: Optional[np.ndarray], values: np.ndarray, names: List[str],
+                     max_anomalies: int = 3) -> List[Dict]:
+    """Сводные характеристики сразу всех рядов набора за один векторизованный проход.
+
+    dates — int64 (нс) в хронологическом порядке или None, values — матрица n x k (пропуски — NaN).
+    Аномалии оцениваются по робастному z-score остатков от линейного тренда.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    size, width = values.shape
+    columns = np.arange(width)
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    safe_counts = np.maximum(counts, 1)
+
+    min_index = np.where(valid, values, np.inf).argmin(axis=0)
+    max_index = np.where(valid, values, -np.inf).argmax(axis=0)
+    first_index = valid.argmax(axis=0)
+    last_index = size - 1 - valid[::-1].argmax(axis=0)
+    filled = np.where(valid, values, 0.0)
+    mean = filled.sum(axis=0) / safe_counts
+    std = np.sqrt((np.where(valid, values - mean, 0.0) ** 2).sum(axis=0) / safe_counts)
+
+    # Линейный тренд: время в годах при наличии дат, иначе в номерах точек
+    if dates is not None:
+        x = (dates - dates[0]) / (365.25 * 24 * 3600 * 1e9)
+    else:
+        x = np.arange(size, dtype=np.float64)
+    x = np.broadcast_to(x[:, None], values.shape)
+    x_mean = np.where(valid, x, 0.0).sum(axis=0) / safe_counts
+    dx = np.where(valid, x - x_mean, 0.0)
+    denominator = (dx ** 2).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(denominator > 0, (dx * (filled - mean)).sum(axis=0) / denominator, 0.0)
+        residuals = np.where(valid, values - (mean + slope * (x - x_mean)), np.nan)
+        median = np.nanmedian(residuals, axis=0)
+        mad = np.nanmedian(np.abs(residuals - median), axis=0)
+        scores = np.where(mad > 0, 0.6745 * (residuals - median) / mad, 0.0)
+    scores = np.nan_to_num(scores)
+    flagged = np.abs(scores) > ANOMALY_Z_THRESHOLD
+    top = np.argsort(-np.abs(scores), axis=0)[:max_anomalies]
+
+    def date_at(i: int) -> Optional[int]:
+        return int(dates[i]) if dates is not None else None
+
+    summaries = []
+    for j in columns:
+        if counts[j] == 0:
+            summaries.append({"name": names[j], "count": 0})
+            continue
+        first, last = values[first_index[j], j], values[last_index[j], j]
+        summaries.append({
+            "name": names[j],
+            "count": int(counts[j]),
+            "min": float(values[min_index[j], j]),
+            "min_index": int(min_index[j]),
+            "min_date": date_at(min_index[j]),
+            "max": float(values[max_index[j], j]),
+            "max_index": int(max_index[j]),
+            "max_date": date_at(max_index[j]),
+            "first": float(first),
+            "last": float(last),
+            "change_pct": round(float((last - first) / abs(first) * 100), 2) if first != 0 else None,
+            "mean": float(mean[j]),
+            "std": float(std[j]),
+            "slope": float(slope[j]),
+            "slope_unit": "год" if dates is not None else "точка",
+            "anomalies": [
+                {"index": int(i), "date": date_at(i), "value": float(values[i, j]), "score": round(float(scores[i, j]), 2)}
+                for i in top[:, j] if flagged[i, j]
+            ]
+        })
+    return summaries
@@ -0,0 +1,175 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from config import (logger, MODEL_NAME, NODE_MODELS, NODE_LATENCY_SLO, DEFAULT_LATENCY_SLO, MODEL_ERROR_RATE_SLO,
+                    MODEL_AUTO_SELECT, MODEL_STATS_ALPHA, MODEL_MIN_SAMPLES, MODEL_PROBE_INTERVAL)
+from gateway_scheduler import gateway_scheduler
+from session_usage import session_usage
+
+T = TypeVar("T")
+
+
+def is_retryable(error: Exception) -> bool:
+    """Слишком большой запрос отклонит и другая модель; остальные ошибки — повод попробовать следующую."""
+    return "413" not in str(error) and "request too large" not in str(error).lower()
+
+
+class ModelRouter:
+    """Выбор модели для узла графа.
+
+    Для каждого узла задан список моделей-кандидатов в порядке предпочтения (NODE_MODELS). Без
+    автоматического выбора используется первый кандидат. С ним по каждой паре «узел, модель» ведутся
+    скользящие средние задержки успешных ответов и доли ошибок: первой выбирается самая предпочтительная
+    модель, укладывающаяся в SLO узла, а не уложившиеся получают пробный запрос раз в MODEL_PROBE_INTERVAL
+    секунд. При ошибке запрос повторяется на следующем кандидате.
+    """
+
+    def __init__(self, node_models: Optional[Dict] = None, auto_select: bool = MODEL_AUTO_SELECT):
+        self.node_models = NODE_MODELS if node_models is None else node_models
+        self.auto_select = auto_select
+        self._stats: Dict = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._in_flight = 0
+        self._last_foreground = 0.0
+
+    def candidates(self, node: str) -> List[str]:
+        # Без отдельной быстрой модели кандидаты совпадают: повторять запрос на той же модели незачем
+        return list(dict.fromkeys(self.node_models.get(node) or (MODEL_NAME,)))
+
+    def _within_slo(self, node: str, stats: Dict) -> bool:
+        if stats["samples"] < MODEL_MIN_SAMPLES:
+            return True
+        latency_ok = stats["latency"] is None or stats["latency"] <= NODE_LATENCY_SLO.get(node, DEFAULT_LATENCY_SLO)
+        return latency_ok and stats["error_rate"] <= MODEL_ERROR_RATE_SLO
+
+    def _score(self, node: str, stats: Dict) -> float:
+        # Насколько модель выходит за SLO по задержке и ошибкам: меньше — лучше
+        latency = stats["latency"] if stats["latency"] is not None else 0.0
+        return (latency / NODE_LATENCY_SLO.get(node, DEFAULT_LATENCY_SLO)
+                + stats["error_rate"] / max(MODEL_ERROR_RATE_SLO, 1e-6))
+
+    def choose(self, node: str) -> List[str]:
+        """Порядок, в котором модели пробуются для очередного запроса узла."""
+        models = self.candidates(node)
+        if not self.auto_select or len(models) == 1:
+            return models
+        now = time.monotonic()
+        preferred, demoted = [], []
+        with self._lock:
+            for model in models:
+                stats = self._stats.get((node, model))
+                if stats is None or self._within_slo(node, stats):
+                    preferred.append(model)
+                elif now - stats["last_call"] >= MODEL_PROBE_INTERVAL:
+                    # Пробный запрос: иначе однажды пониженная модель не вернулась бы после восстановления
+                    stats["last_call"] = now
+                    preferred.append(model)
+                else:
+                    demoted.append((self._score(node, stats), model))
+        return preferred + [model for _, model in sorted(demoted)]
+
+    def record(self, node: str, model: str, seconds: float, ok: bool):
+        with self._lock:
+            stats = self._stats.setdefault((node, model), {"samples": 0, "latency": None, "error_rate": 0.0,
+                                                           "last_call": 0.0})
+            was_within = self._within_slo(node, stats)
+            stats["samples"] += 1
+            stats["last_call"] = time.monotonic()
+            stats["error_rate"] += MODEL_STATS_ALPHA * ((0.0 if ok else 1.0) - stats["error_rate"])
+            if ok:
+                stats["latency"] = seconds if stats["latency"] is None else \
+                    stats["latency"] + MODEL_STATS_ALPHA * (seconds - stats["latency"])
+            within = self._within_slo(node, stats)
+        if was_within != within:
+            logger.warning(f"Модель {model} на узле {node} {'снова укладывается' if within else 'не укладывается'} "
+                           f"в SLO: задержка {stats['latency'] or 0:.2f} с, доля ошибок {stats['error_rate']:.2f}")
+
+    @contextmanager
+    def background(self, priority: str = "speculative"):
+        """Запросы внутри блока — фоновые: не мешают определению простоя, считаются в background_requests
+        и встают в очередь к шлюзу с классом priority (speculative или batch)."""
+        self._local.background = True
+        self._local.requests = 0
+        try:
+            with gateway_scheduler.context(priority):
+                yield
+        finally:
+            self._local.background = False
+
+    @property
+    def background_requests(self) -> int:
+        """Число запросов к шлюзу, отправленных текущим потоком в фоновом блоке."""
+        return getattr(self._local, "requests", 0)
+
+    def idle_seconds(self) -> float:
+        """Сколько секунд нет запросов пользователя к модели (0, пока такой запрос выполняется)."""
+        with self._lock:
+            if self._in_flight:
+                return 0.0
+            return time.monotonic() - self._last_foreground
+
+    def call(self, node: str, request: Callable[[str], T]) -> T:
+        """Выполняет request(model) на выбранной модели, при ошибке — на следующих кандидатах.
+
+        Исключение последней попытки передается вызывающему коду, который обрабатывает его как прежде.
+        Сессия сверх квоты получает SessionQuotaExceeded до отправки запроса.
+        """
+        session_usage.admit(node)
+        if getattr(self._local, "background", False):
+            return self._call(node, request)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return self._call(node, request)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._last_foreground = time.monotonic()
+
+    def _call(self, node: str, request: Callable[[str], T]) -> T:
+        models = self.choose(node)
+        for attempt, model in enumerate(models):
+            # Ожидание в очереди планировщика не входит в задержку модели
+            with gateway_scheduler.slot(node):
+                started = time.perf_counter()
+                if getattr(self._local, "background", False):
+                    self._local.requests += 1
+                session_usage.record(requests=1, node=node)
+                try:
+                    result = request(model)
+                except Exception as e:
+                    if not is_retryable(e):
+                        # Размер запроса не характеризует модель и в ее статистику не входит
+                        raise
+                    self.record(node, model, time.perf_counter() - started, False)
+                    if attempt == len(models) - 1:
+                        raise
+                    logger.warning(f"{node}: ошибка модели {model} ({str(e)[:200]}), "
+                                   f"запрос повторяется на {models[attempt + 1]}")
+                    continue
+            self.record(node, model, time.perf_counter() - started, True)
+            usage = getattr(result, "usage", None)
+            if usage is not None:
+                # Ответ клиента OpenAI; у цепочек LangChain usage учитывает usage_callback
+                session_usage.record(getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0),
+                                     node=node)
+            return result
+
+    def report(self) -> Dict[str, Dict[str, Dict]]:
+        """Наблюдаемые задержки и доли ошибок по узлам и моделям."""
+        with self._lock:
+            result: Dict[str, Dict[str, Dict]] = {}
+            for (node, model), stats in self._stats.items():
+                result.setdefault(node, {})[model] = {
+                    "samples": stats["samples"],
+                    "latency": round(stats["latency"], 3) if stats["latency"] is not None else None,
+                    "error_rate": round(stats["error_rate"], 3),
+                    "within_slo": self._within_slo(node, stats)
+                }
+            return result
+
+
+model_router = ModelRouter()
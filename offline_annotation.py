@@ -0,0 +1,237 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import logger, SEASONALITY_MIN_AUTOCORRELATION
+from local_features import series_summaries
+from timeseries_analyzer import TimeSeriesAnalyzer, MONTHS_GENITIVE, format_date_for_human
+
+MONTHS_NOMINATIVE = ('январь', 'февраль', 'март', 'апрель', 'май', 'июнь', 'июль', 'август', 'сентябрь',
+                     'октябрь', 'ноябрь', 'декабрь')
+WEEKDAYS_ACCUSATIVE = ('понедельник', 'вторник', 'среду', 'четверг', 'пятницу', 'субботу', 'воскресенье')
+
+DAY_NS = 24 * 3600 * 10 ** 9
+
+# Шаг ряда в днях -> (период сезонности в точках, единица цикла)
+SEASONAL_PERIODS = (
+    ((0.5, 1.5), 7, "недельный"),
+    ((6, 8), 52, "годовой"),
+    ((27, 32), 12, "годовой"),
+    ((88, 93), 4, "годовой")
+)
+
+LOCAL_HYPOTHESES = ("Характеристики рассчитаны локально по данным без обращения к модели; "
+                    "причины наблюдаемых изменений требуют отдельной проверки")
+
+
+def format_number(value: float) -> str:
+    return f"{round(float(value), 2):g}".replace(".", ",")
+
+
+def sentence(text: str) -> str:
+    text = str(text).strip()
+    return text if text.endswith((".", "!", "?")) else f"{text}."
+
+
+class OfflineAnnotator:
+    """Детерминированная аннотация ряда по локально рассчитанным характеристикам, без обращения к LLM.
+
+    Используется как мгновенный черновик, пока модель готовит полноценную аннотацию, и как запасной
+    вариант, когда API недоступен или отвечает ошибкой. Характеристики возвращаются в формате ts_features.
+    """
+
+    def __init__(self, timeseries_analyzer: Optional[TimeSeriesAnalyzer] = None):
+        self.timeseries_analyzer = timeseries_analyzer or TimeSeriesAnalyzer()
+
+    def features(self, df: pd.DataFrame, main_metric: str, domain: str) -> Dict:
+        """Тренд, сезонность, экстремумы и аномалии всех рядов набора в формате ts_features."""
+        names = [str(col) for col in df.columns[1:]]
+        dates, values = self.timeseries_analyzer.multi_series_arrays(df)
+        summaries = series_summaries(dates, values, names)
+        described = []
+        for j, summary in enumerate(summaries):
+            column = values[:, j] if values.ndim == 2 else values
+            mask = ~np.isnan(column)
+            described.append(self._describe_series(dates[mask] if dates is not None else None,
+                                                   column[mask], summary))
+
+        features = {
+            "metric": main_metric,
+            "domain": domain,
+            **{key: described[0][key] for key in ("trend", "seasonality", "min_value", "max_value", "anomalies")},
+            "hypotheses": LOCAL_HYPOTHESES,
+            "source": "local"
+        }
+        if len(described) > 1:
+            features["series"] = {summary["name"]: item for summary, item in zip(summaries, described)}
+            features["anomalies"] = [{**anomaly, "series": summary["name"]}
+                                     for summary, item in zip(summaries, described) for anomaly in item["anomalies"]]
+            features["comparison"] = self._compare(summaries)
+        return features
+
+    def annotate(self, ts_features: Dict) -> str:
+        """Связный текст аннотации по характеристикам ряда (локальным или полученным от LLM)."""
+        metric = ts_features.get("metric", "неизвестно")
+        domain = ts_features.get("domain") or "неизвестно"
+        subject = f"Дашборд из области «{domain}»" if domain != "неизвестно" else "Дашборд"
+        parts = []
+        if metric != "неизвестно":
+            parts.append(f"{subject} отражает показатель «{metric}».")
+        else:
+            parts.append(f"{subject} отражает динамику временного ряда.")
+
+        series = ts_features.get("series")
+        if series:
+            for name, item in series.items():
+                described = [self._lower_first(sentence(item.get("trend", "неизвестно")))]
+                if item.get("seasonality", "неизвестно") != "неизвестно":
+                    described.append(sentence(item["seasonality"]))
+                if item.get("min_value", "неизвестно") != "неизвестно":
+                    described.append(f"Минимум — {item['min_value']}, максимум — {item.get('max_value', 'неизвестно')}.")
+                parts.append(f"Ряд «{name}»: {' '.join(described)}")
+            if ts_features.get("comparison"):
+                parts.append(sentence(ts_features["comparison"]))
+        else:
+            if ts_features.get("trend", "неизвестно") != "неизвестно":
+                parts.append(sentence(ts_features["trend"]))
+            if ts_features.get("seasonality", "неизвестно") != "неизвестно":
+                parts.append(sentence(ts_features["seasonality"]))
+            if ts_features.get("min_value", "неизвестно") != "неизвестно":
+                parts.append(f"Минимальное значение — {ts_features['min_value']}, "
+                             f"максимальное — {ts_features.get('max_value', 'неизвестно')}.")
+
+        anomalies = ts_features.get("anomalies") or []
+        if anomalies:
+            listed = ", ".join(
+                (f"{format_number(a['value']) if isinstance(a.get('value'), (int, float)) else a.get('value')}"
+                 f" {a.get('date', '')}" + (f" (ряд «{a['series']}»)" if a.get("series") else "")).strip()
+                for a in anomalies[:5]
+            )
+            parts.append(f"Выделяются аномальные значения: {listed}.")
+        else:
+            parts.append("Выраженных аномалий не обнаружено.")
+
+        hypotheses = ts_features.get("hypotheses")
+        if hypotheses and hypotheses != "неизвестно" and not str(hypotheses).startswith("Ошибка"):
+            parts.append(sentence(hypotheses))
+        return " ".join(parts)
+
+    def draft(self, df: pd.DataFrame, main_metric: str, domain: str) -> str:
+        """Черновик аннотации без обращения к LLM."""
+        try:
+            return self.annotate(self.features(df, main_metric, domain))
+        except Exception as e:
+            logger.error(f"Ошибка построения локальной аннотации: {str(e)}")
+            return ""
+
+    def _describe_series(self, dates: Optional[np.ndarray], values: np.ndarray, summary: Dict) -> Dict:
+        if not summary["count"]:
+            return {"trend": "неизвестно", "seasonality": "неизвестно", "min_value": "неизвестно",
+                    "max_value": "неизвестно", "anomalies": []}
+        return {
+            "trend": self._trend(dates, values, summary),
+            "seasonality": self._seasonality(dates, values),
+            "min_value": f"{format_number(summary['min'])} {self._point(summary['min_index'], dates, summary['min_date'])}",
+            "max_value": f"{format_number(summary['max'])} {self._point(summary['max_index'], dates, summary['max_date'])}",
+            "anomalies": [
+                {
+                    "value": round(anomaly["value"], 2),
+                    "date": self._point(anomaly["index"], dates, anomaly["date"]),
+                    "description": f"Отклонение {format_number(anomaly['score'])} σ от линейного тренда"
+                }
+                for anomaly in summary["anomalies"]
+            ]
+        }
+
+    @staticmethod
+    def _point(index: int, dates: Optional[np.ndarray], date: Optional[int]) -> str:
+        return format_date_for_human(pd.Timestamp(date)) if date is not None and dates is not None \
+            else f"(запись {index})"
+
+    @staticmethod
+    def _lower_first(text: str) -> str:
+        return text[:1].lower() + text[1:]
+
+    def _trend(self, dates: Optional[np.ndarray], values: np.ndarray, summary: Dict) -> str:
+        """Описание тренда по трем равным отрезкам ряда с объединением соседних отрезков одного направления."""
+        size = len(values)
+        change = summary.get("change_pct")
+        overall = (f"За период значение изменилось с {format_number(summary['first'])} "
+                   f"до {format_number(summary['last'])}"
+                   + (f" ({'+' if change > 0 else ''}{format_number(change)}%)" if change is not None else ""))
+        if size < 9:
+            return overall
+        std = float(np.std(values)) or 1.0
+        bounds = np.linspace(0, size, 4).astype(int)
+        segments = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            x = np.arange(end - start, dtype=np.float64) - (end - start - 1) / 2
+            slope = float(x @ values[start:end]) / float(x @ x)
+            shift = slope * (end - start) / std
+            direction = "рост" if shift > 0.5 else "снижение" if shift < -0.5 else "стабилизация"
+            if segments and segments[-1][0] == direction:
+                segments[-1][2] = end - 1
+            else:
+                segments.append([direction, start, end - 1])
+
+        def label(index: int, case: str) -> str:
+            if dates is None:
+                return f"записи {index}"
+            timestamp = pd.Timestamp(int(dates[index]))
+            if timestamp.month == 1 and timestamp.day == 1:
+                return f"{timestamp.year} {case}"
+            return f"{timestamp.day} {MONTHS_GENITIVE[timestamp.month - 1]} {timestamp.year} года"
+
+        if len(segments) == 1:
+            phases = f"на всем периоде наблюдается {segments[0][0]}"
+        else:
+            phases = ", ".join(f"с {label(start, 'года')} по {label(end, 'год')} — {direction}"
+                               for direction, start, end in segments)
+        return f"{overall}; {phases}"
+
+    def _seasonality(self, dates: Optional[np.ndarray], values: np.ndarray) -> str:
+        """Сезонность по автокорреляции первых разностей на лаге, соответствующем шагу ряда."""
+        if dates is None or len(dates) < 3:
+            return "Сезонность не оценивалась: в данных нет дат"
+        step = float(np.median(np.diff(dates))) / DAY_NS
+        for (low, high), period, cycle in SEASONAL_PERIODS:
+            if low <= step <= high:
+                break
+        else:
+            return "Выраженной сезонности не обнаружено: шаг ряда слишком крупный для оценки внутригодового цикла"
+        if len(values) < 2 * period + 1:
+            return "Сезонность не оценивалась: ряд короче двух полных циклов"
+
+        # Первые разности убирают тренд и блуждание уровня, сохраняя сезонную составляющую
+        differences = np.diff(values)
+        differences = differences - differences.mean()
+        denominator = float((differences ** 2).sum())
+        if denominator == 0:
+            return "Выраженной сезонности не обнаружено"
+        autocorrelation = float((differences[period:] * differences[:-period]).sum()) / denominator
+        if autocorrelation < SEASONALITY_MIN_AUTOCORRELATION:
+            return "Выраженной сезонности не обнаружено"
+
+        x = np.arange(len(values), dtype=np.float64)
+        residuals = values - np.polyval(np.polyfit(x, values, 1), x)
+        timestamps = pd.DatetimeIndex(dates.view("datetime64[ns]"))
+        if period == 7:
+            profile = pd.Series(residuals).groupby(timestamps.dayofweek).mean()
+            names = WEEKDAYS_ACCUSATIVE
+        else:
+            profile = pd.Series(residuals).groupby(timestamps.month - 1).mean()
+            names = MONTHS_NOMINATIVE
+        return (f"Присутствует {cycle} цикл (автокорреляция {format_number(autocorrelation)}): "
+                f"пики приходятся на {names[int(profile.idxmax())]}, спады — на {names[int(profile.idxmin())]}")
+
+    def _compare(self, summaries: List[Dict]) -> str:
+        changes = [(summary["name"], summary["change_pct"]) for summary in summaries
+                   if summary["count"] and summary.get("change_pct") is not None]
+        if len(changes) < 2:
+            return ""
+        leader = max(changes, key=lambda item: item[1])
+        outsider = min(changes, key=lambda item: item[1])
+        return (f"Наибольшее изменение за период у ряда «{leader[0]}» ({format_number(leader[1])}%), "
+                f"наименьшее — у ряда «{outsider[0]}» ({format_number(outsider[1])}%)")
+
@@ -0,0 +1,247 @@
+import cProfile
+import itertools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from typing import Dict, List, Optional
+
+from config import (logger, PROFILING_ENABLED, PROFILING_MEMORY, PROFILING_DIR, PROFILING_TOP_N,
+                    PROFILING_SAMPLE_INTERVAL)
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StackSampler(threading.Thread):
+    """Снимает стек потока thread_id каждые interval секунд; стеки копятся в свернутом виде (folded)."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="profiling-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._finished = threading.Event()
+
+    def run(self):
+        while not self._finished.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            if labels:
+                self.stacks[";".join(reversed(labels))] += 1
+
+    def finish(self) -> Counter:
+        self._finished.set()
+        self.join()
+        return self.stacks
+
+
+def top_functions(stats: pstats.Stats, top_n: int = PROFILING_TOP_N, key: str = "self") -> List[Dict]:
+    """Функции с наибольшим собственным (key="self") или полным (key="total") временем."""
+    rows = []
+    for (filename, line, name), (_, calls, self_time, total_time, _) in stats.stats.items():
+        rows.append({"function": f"{name} ({os.path.basename(filename)}:{line})", "calls": calls,
+                     "self_seconds": round(self_time, 4), "total_seconds": round(total_time, 4)})
+    rows.sort(key=lambda row: row[f"{key}_seconds"], reverse=True)
+    return rows[:top_n]
+
+
+class StageProfiler:
+    """Профилирование этапов обработки: процессор и память для каждого вызова этапа.
+
+    Включается PROFILE=1. Для каждого вызова этапа (узел графа, обработчик загрузки, перезапуск скрипта)
+    в PROFILING_DIR/<запуск>/ сохраняются:
+    - <N>-<этап>.prof — профиль cProfile (pstats, snakeviz, flameprof);
+    - <N>-<этап>.folded — стеки, снятые с периодом PROFILING_SAMPLE_INTERVAL, в формате flamegraph.pl,
+      speedscope и inferno;
+    - <N>-<этап>.json — время, процессорное время потока, функции с наибольшим собственным временем,
+      пик памяти и места выделения объектов, оставшихся после этапа (tracemalloc).
+    Общая сводка по этапам обновляется в summary.json после каждого вызова.
+
+    cProfile и снятие стеков относятся к потоку этапа; вложенный этап того же потока профилируется только
+    снятием стеков. tracemalloc общий для процесса, поэтому при одновременных этапах память одного
+    включает выделения другого.
+    """
+
+    def __init__(self, enabled: bool = PROFILING_ENABLED, directory: str = PROFILING_DIR,
+                 memory: bool = PROFILING_MEMORY, top_n: int = PROFILING_TOP_N):
+        self.enabled = enabled
+        self.directory = directory
+        self.memory = memory
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sequence = itertools.count(1)
+        self._run_dir: Optional[str] = None
+        self._traced_stages = 0
+        self._owns_tracing = False
+        self.stats: Dict[str, Dict] = {}
+
+    def run_dir(self) -> str:
+        """Директория профилей текущего процесса."""
+        with self._lock:
+            if self._run_dir is None:
+                self._run_dir = os.path.join(self.directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+                os.makedirs(self._run_dir, exist_ok=True)
+                logger.info(f"Профилирование этапов включено, профили сохраняются в {self._run_dir}")
+            return self._run_dir
+
+    @contextmanager
+    def profile(self, stage: str):
+        """Профилирует блок как один вызов этапа stage (без PROFILE=1 ничего не делает)."""
+        if not self.enabled:
+            yield
+            return
+        # Память и снятие стеков включаются до cProfile, чтобы не попасть в профиль этапа
+        traced = self._start_tracing() if self.memory else None
+        sampler = _StackSampler(threading.get_ident(), PROFILING_SAMPLE_INTERVAL)
+        sampler.start()
+        cpu = None
+        if not getattr(self._local, "active", False):
+            cpu = cProfile.Profile()
+            try:
+                cpu.enable()
+                self._local.active = True
+            except ValueError:
+                # Профилировщик уже активен (в Python 3.12+ он один на процесс) — остается снятие стеков
+                cpu = None
+        started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            if cpu is not None:
+                cpu.disable()
+                self._local.active = False
+            wall, cpu_seconds = time.perf_counter() - started, time.thread_time() - cpu_started
+            stacks = sampler.finish()
+            snapshot, peak = None, None
+            if traced is not None:
+                # Пик — прирост относительно памяти, выделенной к началу этапа
+                peak = tracemalloc.get_traced_memory()[1] - traced
+                snapshot = tracemalloc.take_snapshot()
+                self._stop_tracing()
+            try:
+                self._save(stage, wall, cpu_seconds, cpu, stacks, snapshot, peak)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить профиль этапа {stage}: {str(e)}")
+
+    def _start_tracing(self) -> int:
+        """Включает tracemalloc на время этапа; возвращает объем памяти, отслеживаемой к его началу.
+
+        Отслеживаются только выделения во время этапов: снимок содержит лишь живые объекты, выделенные
+        после начала этапа, и не требует сравнения со снимком всей памяти процесса (на большой куче
+        это занимает секунды).
+        """
+        with self._lock:
+            if self._traced_stages == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._owns_tracing = True
+            self._traced_stages += 1
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+
+    def _stop_tracing(self):
+        with self._lock:
+            self._traced_stages -= 1
+            if self._traced_stages == 0 and self._owns_tracing:
+                tracemalloc.stop()
+                self._owns_tracing = False
+
+    def profiled(self, stage: str):
+        """Декоратор: каждый вызов функции профилируется как этап stage."""
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.profile(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _save(self, stage: str, wall: float, cpu_seconds: float, cpu: Optional[cProfile.Profile], stacks: Counter,
+              snapshot: Optional[tracemalloc.Snapshot], peak: Optional[int]):
+        base = os.path.join(self.run_dir(), f"{next(self._sequence):04d}-{stage}")
+        entry = {"stage": stage, "wall_seconds": round(wall, 4), "cpu_seconds": round(cpu_seconds, 4),
+                 "samples": sum(stacks.values())}
+        if cpu is not None:
+            cpu.dump_stats(base + ".prof")
+            entry["top_functions"] = top_functions(pstats.Stats(cpu), self.top_n)
+        if stacks:
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        if snapshot is not None:
+            # Выделения самих tracemalloc и профилировщика в сводку не входят
+            ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            entry["peak_traced_kb"] = round(peak / 1024, 1)
+            entry["top_allocations"] = [
+                {"where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                 "size_kb": round(stat.size / 1024, 1), "count": stat.count}
+                for stat in snapshot.filter_traces(ignore).statistics("lineno")[:self.top_n]
+            ]
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=2)
+
+        with self._lock:
+            totals = self.stats.setdefault(stage, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                   "max_wall_seconds": 0.0, "peak_traced_kb": 0.0})
+            totals["calls"] += 1
+            totals["wall_seconds"] = round(totals["wall_seconds"] + wall, 4)
+            totals["cpu_seconds"] = round(totals["cpu_seconds"] + cpu_seconds, 4)
+            totals["max_wall_seconds"] = round(max(totals["max_wall_seconds"], wall), 4)
+            totals["peak_traced_kb"] = max(totals["peak_traced_kb"], entry.get("peak_traced_kb", 0.0))
+            summary = dict(sorted(self.stats.items(), key=lambda item: -item[1]["wall_seconds"]))
+        with open(os.path.join(self.run_dir(), "summary.json"), "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        logger.info(f"Профиль этапа {stage}: {wall:.3f} с, процессор {cpu_seconds:.3f} с, файлы {base}.*")
+
+    def report(self) -> Dict:
+        with self._lock:
+            return {stage: dict(totals) for stage, totals in self.stats.items()}
+
+
+stage_profiler = StageProfiler()
+
+
+def summarize(run_dir: str, top_n: int = PROFILING_TOP_N) -> str:
+    """Текстовая сводка по директории профилей: этапы по суммарному времени и для каждого этапа —
+    функции с наибольшим собственным временем по объединенным профилям cProfile всех его вызовов."""
+    by_stage: Dict[str, List[str]] = {}
+    for name in sorted(os.listdir(run_dir)):
+        if name.endswith(".prof"):
+            by_stage.setdefault(name.split("-", 1)[1][:-len(".prof")], []).append(os.path.join(run_dir, name))
+    lines = []
+    summary_path = os.path.join(run_dir, "summary.json")
+    if os.path.exists(summary_path):
+        with open(summary_path, encoding="utf-8") as f:
+            summary = json.load(f)
+        lines.append(f"{'этап':<28}{'вызовов':>8}{'время, с':>11}{'процессор, с':>14}{'пик памяти, КБ':>16}")
+        for stage, totals in summary.items():
+            lines.append(f"{stage:<28}{totals['calls']:>8}{totals['wall_seconds']:>11.3f}"
+                         f"{totals['cpu_seconds']:>14.3f}{totals['peak_traced_kb']:>16.1f}")
+    for stage, paths in by_stage.items():
+        lines.append(f"\n{stage}: {len(paths)} профилей, функции по собственному времени")
+        for row in top_functions(pstats.Stats(*paths), top_n):
+            lines.append(f"  {row['self_seconds']:>9.4f} с  {row['total_seconds']:>9.4f} с  {row['calls']:>8}  "
+                         f"{row['function']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # python profiling.py [директория запуска] — сводка по последнему запуску в PROFILING_DIR по умолчанию
+    if len(sys.argv) > 1:
+        target = sys.argv[1]
+    else:
+        runs = sorted(os.listdir(PROFILING_DIR)) if os.path.isdir(PROFILING_DIR) else []
+        if not runs:
+            sys.exit(f"Профилей в {PROFILING_DIR} нет: запустите приложение с PROFILE=1")
+        target = os.path.join(PROFILING_DIR, runs[-1])
+    print(summarize(target))
@@ -0,0 +1,235 @@
+import hashlib
+from functools import lru_cache
+from typing import Dict, List
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from config import get_llm, MODEL_NAME
+from session_usage import usage_callback
+
+
+class PromptSpec:
+    """Версионированный промпт: неизменная часть (инструкции) и переменная часть с подстановками.
+
+    Неизменная часть всегда идет первой и не зависит от запроса, поэтому у всех вызовов одного промпта
+    совпадает префикс и шлюз может кэшировать его. Внутри переменной части данные упорядочены от более
+    стабильных в рамках сессии (метрика, изображение, данные) к меняющимся (контекст и вопрос).
+    """
+
+    def __init__(self, name: str, version: int, static: str, dynamic: str):
+        self.name = name
+        self.version = version
+        self.static = static
+        self.dynamic = dynamic
+        self._template = None
+
+    @property
+    def template(self) -> ChatPromptTemplate:
+        if self._template is None:
+            # Фигурные скобки в инструкциях (примеры JSON) не являются подстановками
+            static = self.static.replace("{", "{{").replace("}", "}}")
+            self._template = ChatPromptTemplate.from_template(static + self.dynamic)
+        return self._template
+
+    def render(self, **values) -> str:
+        """Текст промпта для прямого вызова клиента API."""
+        return self.static + self.dynamic.format(**values)
+
+    def messages(self, attachments: List[Dict], **values) -> List:
+        """Сообщение для LLM: текст промпта и вложения (изображения) отдельными частями содержимого."""
+        from langchain_core.messages import HumanMessage
+        return [HumanMessage(content=[{"type": "text", "text": self.render(**values)}, *attachments])]
+
+
+ANALYZE_DASHBOARD = PromptSpec("analyze_dashboard", 1, """\
+Ты успешный аналитик данных. Проанализируй изображение дашборда, содержащее временной ряд.
+Извлеки из графика основную метрику/показатель у временного ряда (например, "Продажи золота", "Выручка", "Объем производства").
+Сформулируй понятно для человека, на русском языке. Будь внимателен, может быть такое, что метрика указана в названии графика или в легенде.
+Верни результат в формате JSON с полем "main_metric". Если метрику определить невозможно, укажи "неизвестно".
+Пример: {"main_metric": "Детская смертность в Бразилии с 1934 по 2023 год"}
+Ответ должен быть заключен в ```json ```.
+""", "")
+
+QUERY_DASHBOARD = PromptSpec("query_dashboard", 3, """\
+Ты аналитик дашбордов. Твоя роль — анализировать визуальные элементы дашборда (графики, метрики, подписи).
+Ответь на вопрос, если он связан с визуальными элементами дашборда (например, метрика, название графика, легенда).
+Используй переданную метрику и приложенное к сообщению изображение дашборда для ответа.
+Используй термины, специфичные для финансовой области, если применимо.
+Если вопрос не относится к твоей роли, верни "неизвестно".
+Верни ответ кратко, одним-двумя предложениями.
+""", """
+Основная метрика дашборда: {main_metric}
+Контекст: {context}
+Запрос пользователя: {query}""")
+
+SUGGEST_DOMAIN = PromptSpec("suggest_domain", 2, """\
+Ты аналитик данных. На основе изображения дашборда и данных временного ряда определи область применения дашборда.
+Извлеки контекст из полученных данных, а именно область применения дашборда (например, финансы, экономика, криптовалюта, медицина, политика, компьютерные вычисления и прочее, что можешь распознать).
+Верни результат в формате JSON с полем "domain" (например, {"domain": "Заболевания"}).
+Ответ должен быть заключен в ```json ```.
+Инструкция: Декодируй base64, проанализируй данные и изображение, выбери наиболее подходящую область.
+""", """
+Изображение в base64: {base64_image}
+Данные в CSV (base64): {base64_data}""")
+
+QUERY_DOMAIN = PromptSpec("query_domain", 2, """\
+Ты аналитик данных, специализирующийся на определении области применения дашборда.
+Ответь на вопрос, если он связан с областью применения дашборда (например, финансы, медицина, экономика).
+Используй указанную область для ответа.
+Используй термины, специфичные для финансовой области, если применимо.
+Если вопрос не относится к твоей роли, верни "неизвестно".
+Верни ответ кратко, одним-двумя предложениями.
+""", """
+Область дашборда: {domain}
+Контекст: {context}
+Запрос пользователя: {query}""")
+
+ANALYZE_TIME_SERIES = PromptSpec("analyze_time_series", 2, """\
+Ты успешный аналитик временных рядов. Проанализируй временной ряд, представленный в конце сообщения в CSV-файле (формат: Дата,Значение), закодированном в base64.
+Извлеки следующие характеристики и верни их в формате JSON:
+- metric: метрика временного ряда (используй переданную метрику)
+- domain: область дашборда (используй переданную область)
+- trend: подробное описание трендов временного ряда (например, 'С начала периода до 1990 года наблюдается восходящий тренд, затем с 1990 по 2000 год тренд стабилизируется', если применимо; если один тренд, опиши его детально)
+- seasonality: подробное описание наличия и характера сезонности (например, 'Сезонность присутствует с годовым циклом, с пиками в летние месяцы', если применимо; если отсутствует, укажи это с объяснением)
+- min_value: минимальное значение и дата (проверь и скорректируй на основе данных и изображения, например, '500 на 1 мая 1999 года')
+- max_value: максимальное значение и дата (проверь и скорректируй на основе данных и изображения, например, '5000 на 15 декабря 2000 года')
+- anomalies: список аномалий с подробным описанием (например, [{'value': 5000, 'date': '1 июня 1999 года', 'description': 'Резкий скачок, возможно, связанный с событием X'}])
+- hypotheses: подробные гипотезы, объясняющие характеристики временного ряда (например, 'Восходящий тренд с 1980 по 1990 год может быть связан с экономическим ростом, а скачок в 1995 году — с технологическим прорывом'), с объяснением каждого наблюдаемого тренда, пика или скачка
+Если аномалии отсутствуют, верни пустой список в anomalies.
+Если какие-то данные не удается определить, укажи 'неизвестно'.
+Верни результат в формате JSON, заключенном в ```json ```.
+Инструкция: Декодируй base64 в CSV, проанализируй данные и изображение, учти метрику, область и подсказку. Скорректируй даты для min_value и max_value в человеко-читаемом формате (например, 'в 1999 году' для года или 'на 1 мая 1999 года' для полной даты). Опиши тренды, сезонность и аномалии максимально детально, включая несколько этапов или пиков, если они есть. Сформируй гипотезы для каждого наблюдаемого явления.
+""", """
+Дашборд в области {domain} показывает метрику {main_metric}.
+Изображение дашборда в base64: {image_state}
+Подсказка по данным: {min_max_hint}
+```
+{encoded_csv}
+```""")
+
+ANALYZE_MULTI_SERIES = PromptSpec("analyze_multi_series", 2, """\
+Ты успешный аналитик временных рядов. Набор данных содержит несколько рядов с общей осью дат; их сводные характеристики, рассчитанные по данным, приведены в конце сообщения.
+Извлеки следующие характеристики и верни их в формате JSON:
+- metric: метрика временного ряда (используй переданную метрику)
+- domain: область дашборда (используй переданную область)
+- trend: подробное описание трендов всех рядов и их сравнение между собой
+- seasonality: подробное описание наличия и характера сезонности в рядах
+- min_value: минимальное значение с названием ряда и датой
+- max_value: максимальное значение с названием ряда и датой
+- anomalies: список аномалий с подробным описанием (например, [{'series': 'Ряд', 'value': 5000, 'date': '1 июня 1999 года', 'description': 'Резкий скачок'}])
+- hypotheses: подробные гипотезы, объясняющие характеристики и взаимосвязи рядов
+- series: объект, где для каждого ряда по его названию указаны trend, seasonality, min_value и max_value
+Если аномалии отсутствуют, верни пустой список в anomalies.
+Если какие-то данные не удается определить, укажи 'неизвестно'.
+Верни результат в формате JSON, заключенном в ```json ```.
+""", """
+Дашборд в области {domain} показывает метрику {main_metric}.
+Изображение дашборда: {image_state}
+Ряды ({series_count}, столбец дат '{date_col}'): {series_names}
+Сводные характеристики каждого ряда (JSON):
+```json
+{described}
+```""")
+
+COMBINED_ANALYSIS = PromptSpec("combined_analysis", 1, """\
+Ты успешный аналитик данных. Проанализируй приложенное к сообщению изображение дашборда и временной ряд, представленный в конце сообщения в CSV-файле (формат: Дата,Значение), закодированном в base64.
+Верни одним JSON-объектом следующие поля:
+- main_metric: основная метрика/показатель временного ряда на дашборде (например, "Продажи золота", "Выручка", "Объем производства"), понятно для человека, на русском языке; метрика может быть указана в названии графика или в легенде; если определить невозможно, укажи "неизвестно"
+- domain: область применения дашборда (например, финансы, экономика, криптовалюта, медицина, политика, компьютерные вычисления и прочее, что можешь распознать)
+- trend: подробное описание трендов временного ряда (например, 'С начала периода до 1990 года наблюдается восходящий тренд, затем с 1990 по 2000 год тренд стабилизируется', если применимо; если один тренд, опиши его детально)
+- seasonality: подробное описание наличия и характера сезонности (например, 'Сезонность присутствует с годовым циклом, с пиками в летние месяцы', если применимо; если отсутствует, укажи это с объяснением)
+- min_value: минимальное значение и дата (проверь и скорректируй на основе данных и изображения, например, '500 на 1 мая 1999 года')
+- max_value: максимальное значение и дата (проверь и скорректируй на основе данных и изображения, например, '5000 на 15 декабря 2000 года')
+- anomalies: список аномалий с подробным описанием (например, [{'value': 5000, 'date': '1 июня 1999 года', 'description': 'Резкий скачок, возможно, связанный с событием X'}])
+- hypotheses: подробные гипотезы, объясняющие характеристики временного ряда с учетом метрики и области, с объяснением каждого наблюдаемого тренда, пика или скачка
+Если аномалии отсутствуют, верни пустой список в anomalies.
+Если какие-то данные не удается определить, укажи 'неизвестно'.
+Верни результат в формате JSON, заключенном в ```json ```.
+Инструкция: Сначала по изображению определи метрику и область, затем декодируй base64 в CSV и проанализируй ряд с их учетом и с учетом подсказки. Даты для min_value и max_value укажи в человеко-читаемом формате (например, 'в 1999 году' для года или 'на 1 мая 1999 года' для полной даты).
+""", """
+Изображение дашборда: {image_state}
+Подсказка по данным: {min_max_hint}
+```
+{encoded_csv}
+```""")
+
+QUERY_TIMESERIES = PromptSpec("query_timeseries", 3, """\
+Ты аналитик временных рядов. Твоя роль — анализировать тренды, сезонность, аномалии и другие характеристики временного ряда.
+Ответь на вопрос, если он связан с характеристиками временного ряда (например, тренды, сезонность, аномалии, минимум/максимум).
+Используй предоставленные характеристики, данные и приложенное к сообщению изображение дашборда (если оно есть) для ответа.
+Если в данных несколько рядов, отвечай о ряде, упомянутом в вопросе, и называй ряды по именам столбцов.
+Используй термины, специфичные для финансовой области, если применимо.
+Если вопрос не относится к твоей роли, верни "неизвестно".
+Верни ответ кратко, одним-двумя предложениями.
+""", """
+Характеристики временного ряда: {ts_features}
+Данные временного ряда в CSV (base64): {encoded_data}
+Контекст: {context}
+Запрос пользователя: {query}""")
+
+GENERAL_ANNOTATION = PromptSpec("generate_general_annotation", 2, """\
+Ты аналитик данных. На основе характеристик временного ряда составь аннотацию по следующему плану:
+1. Опиши область и метрику дашборда одним предложением.
+2. Опиши тренды и сезонность, указав их характер и особенности.
+3. Укажи максимальное и минимальное значения с датами.
+4. Опиши обнаруженные аномалии, если они есть, или укажи их отсутствие.
+5. Предложи гипотезы, объясняющие тренды, сезонность или аномалии.
+Если в характеристиках есть поле series с несколькими рядами, по каждому пункту кратко сравни ряды между собой.
+Верни аннотацию одним абзацем, кратко и естественно, как для человека, используя термины в нужной области.
+Не используй подзаголовки или списки, только связный текст.
+Если данные отсутствуют или некорректны, укажи это в аннотации.
+""", """
+Характеристики временного ряда: {ts_features}""")
+
+REVISE_ANNOTATION = PromptSpec("revise_annotation", 2, """\
+Ты аналитик данных. Временной ряд дополнен новыми точками, и его характеристики изменились.
+Перепиши аннотацию с учетом изменений, сохранив ее структуру, стиль и верные утверждения.
+Верни аннотацию одним абзацем, без подзаголовков и списков.
+""", """
+Предыдущая аннотация: {previous_annotation}
+Обновленные характеристики временного ряда: {ts_features}
+Изменения: {changes}""")
+
+COMBINE_RESPONSES = PromptSpec("process_user_query", 2, """\
+Ты аналитик данных. Объедини ответы от трех агентов в один связный ответ на запрос пользователя.
+Правила:
+1. Если агент ответил "неизвестно", игнорируй его ответ.
+2. Сформируй связный ответ, объединяя информацию из всех содержательных ответов.
+3. Используй термины, специфичные для финансовой области, если применимо.
+4. Ответ должен быть кратким, естественным и адресованным человеку.
+5. Если есть противоречия между ответами, выбери наиболее логичный или укажи неопределенность.
+Верни объединенный ответ одним абзацем.
+""", """
+Контекст: {context}
+Запрос пользователя: {query}
+Ответы агентов:
+- Dashboard Agent: {dashboard_response}
+- Domain Agent: {domain_response}
+- Timeseries Agent: {timeseries_response}""")
+
+PROMPTS: Dict[str, PromptSpec] = {spec.name: spec for spec in (
+    ANALYZE_DASHBOARD, QUERY_DASHBOARD, SUGGEST_DOMAIN, QUERY_DOMAIN, ANALYZE_TIME_SERIES, ANALYZE_MULTI_SERIES,
+    COMBINED_ANALYSIS, QUERY_TIMESERIES, GENERAL_ANNOTATION, REVISE_ANNOTATION, COMBINE_RESPONSES
+)}
+
+# Общая версия набора промптов: меняется при изменении любого из них
+PROMPTS_VERSION = hashlib.sha1(
+    "".join(f"{spec.name}:{spec.version}:{spec.static}{spec.dynamic}" for spec in PROMPTS.values()).encode("utf-8")
+).hexdigest()[:12]
+
+
+def get_prompt(name: str) -> PromptSpec:
+    return PROMPTS[name]
+
+
+@lru_cache(maxsize=None)
+def get_chain(name: str, model: str = MODEL_NAME):
+    """Цепочка «промпт | LLM | парсер» собирается один раз на процесс для каждой модели."""
+    return PROMPTS[name].template | get_llm(model).with_config(callbacks=[usage_callback()]) | StrOutputParser()
+
+
+@lru_cache(maxsize=None)
+def get_message_chain(model: str = MODEL_NAME):
+    """Цепочка «LLM | парсер» для готовых сообщений с вложениями (PromptSpec.messages)."""
+    return get_llm(model).with_config(callbacks=[usage_callback()]) | StrOutputParser()
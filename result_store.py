@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, List, Optional, Tuple
+
+from config import logger, RESULT_STORE_DB, RESULT_PAGE_SIZE
+from prompt_registry import PROMPTS_VERSION
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ResultStore:
+    """Хранилище результатов анализа и сессий чата во встроенной базе SQLite.
+
+    Результат анализа (dash_features, domain_features, ts_features, final_annotation) хранится по паре
+    хешей содержимого изображения и данных и версии набора промптов, поэтому повторный анализ тех же
+    файлов любым пользователем и после перезапуска берется из хранилища, а после изменения промптов
+    выполняется заново. Сессия чата хранится по идентификатору из адреса страницы
+    и восстанавливается после обновления браузера.
+    """
+
+    def __init__(self, db_path: str = RESULT_STORE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.db_path)
+        if not self._initialized:
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(analyses)")]
+            if columns and "prompts_version" not in columns:
+                # Результаты без версии промптов построены неизвестными промптами и не могут быть использованы
+                logger.info("Таблица результатов анализа без версии промптов пересоздается")
+                connection.execute("DROP TABLE analyses")
+            connection.executescript(
+                """CREATE TABLE IF NOT EXISTS analyses (
+                    image_hash TEXT NOT NULL,
+                    data_hash TEXT NOT NULL,
+                    prompts_version TEXT NOT NULL,
+                    dash_features TEXT,
+                    domain_features TEXT,
+                    ts_features TEXT,
+                    final_annotation TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (image_hash, data_hash, prompts_version)
+                );
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    image_hash TEXT,
+                    data_hash TEXT,
+                    chat_history TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS sessions_by_files ON sessions (image_hash, data_hash, updated_at);
+                CREATE INDEX IF NOT EXISTS sessions_by_time ON sessions (updated_at);
+                CREATE INDEX IF NOT EXISTS analyses_by_time ON analyses (created_at);"""
+            )
+            self._initialized = True
+        return connection
+
+    def file_hash(self, path: Optional[str]) -> str:
+        """SHA-1 содержимого файла; пересчитывается только при изменении размера или времени изменения."""
+        if not path:
+            return ""
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._hashes:
+                return self._hashes[key]
+        digest = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        with self._lock:
+            self._hashes[key] = digest.hexdigest()
+        return self._hashes[key]
+
+    def load_analysis(self, image_path: Optional[str], data_path: Optional[str]) -> Optional[Dict]:
+        """Сохраненный результат анализа тех же файлов текущей версией промптов или None."""
+        try:
+            keys = (self.file_hash(image_path), self.file_hash(data_path), PROMPTS_VERSION)
+            with closing(self._connect()) as connection:
+                row = connection.execute(
+                    "SELECT dash_features, domain_features, ts_features, final_annotation FROM analyses "
+                    "WHERE image_hash = ? AND data_hash = ? AND prompts_version = ?", keys
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка чтения результата анализа из хранилища: {str(e)}")
+            return None
+        if row is None:
+            return None
+        logger.info(f"Результат анализа {image_path}, {data_path} взят из хранилища")
+        return {
+            "dash_features": json.loads(row[0]) if row[0] else None,
+            "domain_features": json.loads(row[1]) if row[1] else None,
+            "ts_features": json.loads(row[2]) if row[2] else None,
+            "final_annotation": row[3]
+        }
+
+    def save_analysis(self, image_path: Optional[str], data_path: Optional[str], state: Dict) -> bool:
+        """Сохраняет результат анализа; аннотации с ошибкой и локальные черновики не сохраняются."""
+        annotation = state.get("final_annotation")
+        ts_features = state.get("ts_features") or {}
+        if not annotation or annotation.startswith("Ошибка") or "Слишком большой объем" in annotation \
+                or ts_features.get("source") == "local":
+            return False
+        try:
+            keys = (self.file_hash(image_path), self.file_hash(data_path), PROMPTS_VERSION)
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO analyses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*keys,
+                     *(json.dumps(state.get(key), ensure_ascii=False) if state.get(key) is not None else None
+                       for key in ("dash_features", "domain_features", "ts_features")),
+                     annotation, time.time())
+                )
+            logger.info(f"Результат анализа {image_path}, {data_path} сохранен в хранилище")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка сохранения результата анализа: {str(e)}")
+            return False
+
+    def save_session(self, session_id: str, image_path: Optional[str], data_path: Optional[str],
+                     chat_history: List[Dict]) -> None:
+        try:
+            keys = (self.file_hash(image_path), self.file_hash(data_path))
+            with closing(self._connect()) as connection, connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                    (session_id, *keys, json.dumps(chat_history, ensure_ascii=False), time.time())
+                )
+        except Exception as e:
+            logger.error(f"Ошибка сохранения сессии {session_id}: {str(e)}")
+
+    def load_session(self, session_id: str, image_path: Optional[str], data_path: Optional[str]) -> Optional[List[Dict]]:
+        """История чата сессии, если она велась по тем же файлам, что загружены сейчас."""
+        try:
+            keys = (self.file_hash(image_path), self.file_hash(data_path))
+            with closing(self._connect()) as connection:
+                row = connection.execute(
+                    "SELECT chat_history FROM sessions WHERE session_id = ? AND image_hash = ? AND data_hash = ?",
+                    (session_id, *keys)
+                ).fetchone()
+        except Exception as e:
+            logger.error(f"Ошибка чтения сессии {session_id}: {str(e)}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def list_sessions(self, page: int = 0, page_size: int = RESULT_PAGE_SIZE) -> List[Dict]:
+        """Страница сессий, начиная с последних обновленных."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT session_id, image_hash, data_hash, chat_history, updated_at FROM sessions "
+                "ORDER BY updated_at DESC LIMIT ? OFFSET ?", (page_size, page * page_size)
+            ).fetchall()
+        return [{"session_id": row[0], "image_hash": row[1], "data_hash": row[2],
+                 "messages": len(json.loads(row[3])), "updated_at": row[4]} for row in rows]
+
+    def list_analyses(self, page: int = 0, page_size: int = RESULT_PAGE_SIZE) -> List[Dict]:
+        """Страница сохраненных результатов анализа, начиная с последних."""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT image_hash, data_hash, prompts_version, final_annotation, created_at FROM analyses "
+                "ORDER BY created_at DESC LIMIT ? OFFSET ?", (page_size, page * page_size)
+            ).fetchall()
+        return [{"image_hash": row[0], "data_hash": row[1], "prompts_version": row[2], "final_annotation": row[3],
+                 "created_at": row[4]} for row in rows]
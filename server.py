@@ -1,19 +1,18 @@
-import tempfile
-
 import streamlit as st
 from templates.page_config import set_page_config
 import os
-import pandas as pd
 from pathlib import Path
 import shutil
 from templates.interface import setup_interface
-from config import UPLOAD_DIR, DATA_DIR, logger, ALLOWED_IMAGE_EXTENSIONS
+from config import (UPLOAD_DIR, DATA_DIR, logger, ALLOWED_IMAGE_EXTENSIONS, OFFLINE_DRAFT_ENABLED, RESTORE_COOKIE,
+                    RESTORE_COOKIE_MAX_AGE)
+from file_cache import file_cache
+from profiling import stage_profiler
 import asyncio
-from graph_workflow import AgentState, create_graph
-from PIL import Image
 import io
 
-from timeseries_analyzer import TimeSeriesAnalyzer
+# Тяжелые модули (langgraph, langchain, openai, pandas, PIL) импортируются лениво там, где они нужны:
+# скрипт выполняется заново при каждом взаимодействии, а граф и анализаторы создаются один раз на процесс
 
 logger.info("Начало инициализации приложения")
 
@@ -35,35 +34,30 @@ def initialize_directories():
 
 initialize_directories()
 
-# создание и компиляция графа
-try:
-    graph = create_graph()
-    logger.info("Граф создан")
-except Exception as e:
-    logger.error(f"Ошибка при создании графа: {str(e)}")
-    raise
-
-def get_current_file(directory):
+@st.cache_resource(show_spinner=False)
+def load_graph():
+    """Создает и компилирует граф один раз на процесс, при первом запуске анализа."""
+    from graph_workflow import create_graph
     try:
-        files = os.listdir(directory)
-        logger.info(f"Получены файлы в {directory}: {files}")
-        return files[0] if files else None
+        graph = create_graph()
+        logger.info("Граф создан")
+        return graph
     except Exception as e:
-        logger.error(f"Ошибка в get_current_file для {directory}: {str(e)}")
-        return None
+        logger.error(f"Ошибка при создании графа: {str(e)}")
+        raise
+
+@st.cache_resource(show_spinner=False)
+def load_timeseries_analyzer():
+    from timeseries_analyzer import TimeSeriesAnalyzer
+    return TimeSeriesAnalyzer()
+
+def get_current_file(directory):
+    # Состояние директории кэшируется до загрузки или удаления файла, поэтому rerun не читает диск
+    return file_cache.current_file(directory)
 
 def read_data_preview(file_path):
-    try:
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path, nrows=5)
-            return df
-        elif file_path.endswith('.xlsx'):
-            df = pd.read_excel(file_path, nrows=5)
-            return df
-        return ""
-    except Exception as e:
-        logger.error(f"Ошибка в read_data_preview для {file_path}: {str(e)}")
-        return ""
+    from columnar_store import read_data_preview as load_preview
+    return load_preview(file_path)
 
 def clear_directory(directory):
     try:
@@ -77,10 +71,14 @@ def clear_directory(directory):
     except Exception as e:
         st.error(f'Ошибка при очистке {directory}: {e}')
         logger.error(f'Ошибка при очистке {directory}: {e}')
+    finally:
+        file_cache.invalidate(directory)
 
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB
 
+@stage_profiler.profiled("upload_image")
 def upload_image_callback(uploaded_image):
+    from PIL import Image
     try:
         if uploaded_image.size > MAX_FILE_SIZE:
             st.error(f"Ошибка: Размер файла {uploaded_image.name} превышает допустимый лимит (10 МБ).")
@@ -98,6 +96,7 @@ def upload_image_callback(uploaded_image):
         file_path = os.path.join(UPLOAD_DIR, uploaded_image.name)
         with open(file_path, "wb") as f:
             f.write(image_data)
+        file_cache.invalidate(UPLOAD_DIR)
         if not os.path.exists(file_path):
             st.error(f"Ошибка: Не удалось сохранить изображение {uploaded_image.name}")
             logger.error(f"Не удалось сохранить файл: {file_path}")
@@ -112,23 +111,13 @@ def upload_image_callback(uploaded_image):
         st.error(f"Ошибка: Загруженный файл не является изображением: {str(e)}")
         logger.error(f"Ошибка валидации изображения {uploaded_image.name}: {str(e)}")
 
+@stage_profiler.profiled("upload_data")
 def upload_data_callback(uploaded_data):
+    from columnar_store import save_columnar
     try:
-        # Проверяем данные перед сохранением
-        with tempfile.NamedTemporaryFile(delete=False, suffix=uploaded_data.name, mode='wb') as temp_file:
-            temp_file.write(uploaded_data.getbuffer())
-            temp_file_path = temp_file.name
-
-        # Проверяем данные с помощью TimeSeriesAnalyzer
-        timeseries_analyzer = TimeSeriesAnalyzer()
-        df, message = timeseries_analyzer.read_data(Path(temp_file_path))
-
-        # Удаляем временный файл
-        try:
-            os.unlink(temp_file_path)
-            logger.info(f"Временный файл удален: {temp_file_path}")
-        except Exception as e:
-            logger.error(f"Ошибка при удалении временного файла {temp_file_path}: {str(e)}")
+        # Проверяем данные перед сохранением прямо из загруженного буфера
+        timeseries_analyzer = load_timeseries_analyzer()
+        df, message = timeseries_analyzer.read_data(Path(uploaded_data.name), source=uploaded_data)
 
         if df is None:
             st.error(message)  # Отображаем сообщение об ошибке
@@ -136,8 +125,11 @@ def upload_data_callback(uploaded_data):
             return
 
         clear_directory(DATA_DIR)
-        with open(os.path.join(DATA_DIR, uploaded_data.name), "wb") as f:
+        data_path = os.path.join(DATA_DIR, uploaded_data.name)
+        with open(data_path, "wb") as f:
             f.write(uploaded_data.getbuffer())
+        save_columnar(data_path, df)
+        file_cache.invalidate(DATA_DIR)
         st.session_state.last_data = uploaded_data.name
         st.session_state.run_triggered = False
         st.session_state.rerun_count = 0
@@ -153,10 +145,12 @@ def display_image_callback(current_image):
     try:
         if current_image:
             file_path = os.path.join(UPLOAD_DIR, current_image)
-            if os.path.exists(file_path):
-                st.image(file_path, use_container_width=True)
+            try:
+                thumbnail, _ = file_cache.thumbnail(file_path)
+                st.image(thumbnail, use_container_width=True)
                 logger.info(f"Отображено изображение: {file_path}")
-            else:
+            except FileNotFoundError:
+                file_cache.invalidate(UPLOAD_DIR)
                 st.error(f"Ошибка: Файл {current_image} не найден в {UPLOAD_DIR}")
                 logger.error(f"Файл не найден: {file_path}")
             if st.button("Удалить изображение", key="remove_image"):
@@ -176,10 +170,11 @@ def display_image_callback(current_image):
         logger.error(f"Ошибка в display_image_callback: {str(e)}")
 
 def display_data_callback(current_data):
+    import pandas as pd
     try:
         if current_data:
             data_path = os.path.join(DATA_DIR, current_data)
-            preview = read_data_preview(data_path)
+            preview = file_cache.data_preview(data_path, read_data_preview)
             if isinstance(preview, pd.DataFrame):
                 st.dataframe(preview)
             else:
@@ -202,13 +197,76 @@ def display_data_callback(current_data):
 
 async def run_graph(state):
     try:
-        result = await graph.ainvoke(state)
+        result = await load_graph().ainvoke(state)
         logger.info("Граф успешно выполнен")
         return result
     except Exception as e:
         logger.error(f"Ошибка в run_graph: {str(e)}")
         return {"final_annotation": f"Ошибка выполнения графа: {str(e)}"}
 
+@st.cache_resource(show_spinner=False)
+def load_offline_annotator():
+    from offline_annotation import OfflineAnnotator
+    return OfflineAnnotator(load_timeseries_analyzer())
+
+@st.cache_resource(show_spinner=False)
+def load_result_store():
+    from result_store import ResultStore
+    return ResultStore()
+
+def restore_session(current_image, current_data):
+    """Определяет сессию и восстанавливает ее чат после обновления браузера.
+
+    session_id (учет квот, очередь шлюза, вложения) создается сервером и не берется из адреса страницы,
+    иначе новая квота получалась бы сменой параметра. Сохраненный чат определяется токеном в cookie
+    RESTORE_COOKIE этого браузера, а не параметром адреса: ссылка на страницу не открывает чужой чат.
+    Вкладки одного браузера делят токен, поэтому восстанавливается чат последней из них.
+    """
+    from uuid import uuid4
+    st.session_state.session_id = uuid4().hex
+    if "session" in st.query_params:
+        # Прежние ссылки несли идентификатор чата в адресе; он больше не используется
+        del st.query_params["session"]
+    restore_id = st.context.cookies.get(RESTORE_COOKIE)
+    if not restore_id:
+        restore_id = uuid4().hex
+        st.html(f"<script>document.cookie = '{RESTORE_COOKIE}={restore_id}; path=/; "
+                f"max-age={RESTORE_COOKIE_MAX_AGE}; SameSite=Strict';</script>", unsafe_allow_javascript=True)
+    st.session_state.restore_id = restore_id
+    if not current_image or not current_data or st.session_state.chat_history:
+        return
+    chat_history = load_result_store().load_session(
+        restore_id, os.path.join(UPLOAD_DIR, current_image), os.path.join(DATA_DIR, current_data)
+    )
+    if chat_history:
+        st.session_state.chat_history = chat_history
+        st.session_state.has_initial_annotation = True
+        logger.info(f"Сессия {restore_id} восстановлена: {len(chat_history)} сообщений")
+
+def persist_session(image_path, data_path):
+    load_result_store().save_session(st.session_state.restore_id, image_path, data_path,
+                                     st.session_state.chat_history)
+
+def show_offline_draft(chat_container, image_path, data_path):
+    """Показывает локальную аннотацию сразу, пока граф готовит ответ LLM."""
+    from image_index import ImageFeatureIndex
+    try:
+        series, _ = load_timeseries_analyzer().load_series(data_path)
+        if series is None:
+            return
+        match = ImageFeatureIndex().lookup(image_path) if image_path else None
+        main_metric = match["dash_features"].get("main_metric", "неизвестно") if match else "неизвестно"
+        domain = match["domain_features"].get("domain", "неизвестно") if match else "неизвестно"
+        draft = load_offline_annotator().draft(series.to_frame(), main_metric, domain)
+        if draft:
+            with chat_container:
+                with st.chat_message("assistant"):
+                    st.markdown(draft)
+                    st.caption("Черновик по локальному анализу данных, аннотация модели готовится...")
+            logger.info("Показан локальный черновик аннотации")
+    except Exception as e:
+        logger.error(f"Ошибка при построении черновика аннотации: {str(e)}")
+
 def chat_callback(chat_container):
     try:
         if 'chat_history' not in st.session_state:
@@ -240,6 +298,8 @@ def chat_callback(chat_container):
 
         current_image = get_current_file(UPLOAD_DIR)
         current_data = get_current_file(DATA_DIR)
+        if 'session_id' not in st.session_state:
+            restore_session(current_image, current_data)
         logger.info(f"chat_callback: current_image={current_image}, current_data={current_data}, run_triggered={st.session_state.run_triggered}, rerun_count={st.session_state.rerun_count}, image_uploaded={st.session_state.image_uploaded}, data_uploaded={st.session_state.data_uploaded}, processing={st.session_state.processing}, pending_processing={st.session_state.pending_processing}")
 
         # Определяем, нужно ли скрывать элементы
@@ -299,16 +359,22 @@ def chat_callback(chat_container):
                 st.session_state.chat_history.append({"role": "user", "content": user_input})
                 image_path = os.path.join(UPLOAD_DIR, current_image) if current_image else None
                 data_path = os.path.join(DATA_DIR, current_data) if current_data else None
+                # Характеристики из хранилища избавляют от повторного анализа файлов при каждом вопросе
+                stored = load_result_store().load_analysis(image_path, data_path) or {}
+                from graph_workflow import AgentState
                 state = AgentState(
                     image_path=image_path,
                     data_path=data_path,
                     chat_history=st.session_state.chat_history,
                     user_query=user_input,
-                    dash_features=None,
-                    domain_features=None,
-                    ts_features=None,
+                    dash_features=stored.get("dash_features"),
+                    domain_features=stored.get("domain_features"),
+                    ts_features=stored.get("ts_features"),
                     final_annotation=None,
-                    response=None
+                    response=None,
+                    incremental=None,
+                    image_match=None,
+                    session_id=st.session_state.get("session_id")
                 )
                 result = asyncio.run(run_graph(state))
                 st.session_state.processing = False
@@ -324,6 +390,7 @@ def chat_callback(chat_container):
                             {"role": "assistant", "content": result["response"]}
                         )
                         logger.info(f"Сгенерирован ответ: {result['response']}")
+                persist_session(image_path, data_path)
                 st.session_state.rerun_count = 0
                 st.session_state.reset_uploaders = True
                 st.rerun()
@@ -369,18 +436,29 @@ def chat_callback(chat_container):
                 st.session_state.rerun_count += 1
                 image_path = os.path.join(UPLOAD_DIR, current_image) if current_image else None
                 data_path = os.path.join(DATA_DIR, current_data) if current_data else None
-                state = AgentState(
-                    image_path=image_path,
-                    data_path=data_path,
-                    chat_history=st.session_state.chat_history,
-                    dash_features=None,
-                    domain_features=None,
-                    ts_features=None,
-                    final_annotation=None,
-                    user_query=None,
-                    response=None
-                )
-                result = asyncio.run(run_graph(state))
+                # Повторный анализ тех же файлов берется из хранилища результатов
+                result_store = load_result_store()
+                result = result_store.load_analysis(image_path, data_path)
+                if result is None:
+                    if OFFLINE_DRAFT_ENABLED:
+                        show_offline_draft(chat_container, image_path, data_path)
+                    from graph_workflow import AgentState
+                    state = AgentState(
+                        image_path=image_path,
+                        data_path=data_path,
+                        chat_history=st.session_state.chat_history,
+                        dash_features=None,
+                        domain_features=None,
+                        ts_features=None,
+                        final_annotation=None,
+                        user_query=None,
+                        response=None,
+                        incremental=None,
+                        image_match=None,
+                        session_id=st.session_state.get("session_id")
+                    )
+                    result = asyncio.run(run_graph(state))
+                    result_store.save_analysis(image_path, data_path, result)
                 st.session_state.processing = False
                 if result["final_annotation"]:
                     if "Слишком большой объем" in result["final_annotation"]:
@@ -392,6 +470,7 @@ def chat_callback(chat_container):
                         )
                         logger.info(f"Создана начальная аннотация: {result['final_annotation']}")
                         st.session_state.has_initial_annotation = True
+                        persist_session(image_path, data_path)
                 st.session_state.run_triggered = False
                 st.session_state.image_uploaded = False
                 st.session_state.data_uploaded = False
@@ -422,16 +501,18 @@ def chat_callback(chat_container):
             logger.info(f"Чат отображен при ошибке, chat_history: {len(st.session_state.chat_history)} сообщений")
 
 try:
-    setup_interface(
-        upload_image_callback=upload_image_callback,
-        upload_data_callback=upload_data_callback,
-        display_image_callback=display_image_callback,
-        display_data_callback=display_data_callback,
-        chat_callback=chat_callback,
-        get_current_image=lambda: get_current_file(UPLOAD_DIR),
-        get_current_data=lambda: get_current_file(DATA_DIR),
-        clear_directory_callback=clear_directory
-    )
+    # Перезапуск скрипта целиком (отрисовка, обработчики и запуск графа) — отдельный этап профилирования
+    with stage_profiler.profile("streamlit_rerun"):
+        setup_interface(
+            upload_image_callback=upload_image_callback,
+            upload_data_callback=upload_data_callback,
+            display_image_callback=display_image_callback,
+            display_data_callback=display_data_callback,
+            chat_callback=chat_callback,
+            get_current_image=lambda: get_current_file(UPLOAD_DIR),
+            get_current_data=lambda: get_current_file(DATA_DIR),
+            clear_directory_callback=clear_directory
+        )
     logger.info("Интерфейс успешно настроен")
 except Exception as e:
     logger.error(f"Ошибка при настройке интерфейса: {str(e)}")
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from functools import lru_cache
+from typing import Dict, Optional
+
+from config import (logger, SESSION_QUOTA_WINDOW, SESSION_TOKEN_QUOTA, SESSION_REQUEST_QUOTA, SESSION_SOFT_QUOTA_SHARE,
+                    SESSION_OVER_QUOTA_ACTION, SESSION_DEGRADE_LIMIT, SESSION_QUEUE_MAX_WAIT, SESSION_USAGE_SESSIONS,
+                    GATEWAY_BACKGROUND_PRIORITIES)
+from gateway_scheduler import current_session, gateway_scheduler
+
+
+class SessionQuotaExceeded(Exception):
+    """Сессия исчерпала квоту токенов или запросов к шлюзу."""
+
+
+class SessionUsage:
+    """Учет запросов и токенов (по usage ответов шлюза) по сессиям и допуск запросов по квотам.
+
+    Квота задается на скользящее окно SESSION_QUOTA_WINDOW: токены запроса и ответа и число запросов.
+    Учитываются только запросы пользователя; фоновая подготовка ответов считается отдельно. После
+    SESSION_SOFT_QUOTA_SHARE квоты запросы сессии собираются с уменьшенными данными (ступени TokenBudget,
+    низкая детализация изображения), а при исчерпании квоты поступают по SESSION_OVER_QUOTA_ACTION:
+    queue — ждут освобождения квоты, degrade — выполняются с минимальными данными до SESSION_DEGRADE_LIMIT
+    квоты, reject — отклоняются.
+    """
+
+    def __init__(self, token_quota: int = SESSION_TOKEN_QUOTA, request_quota: int = SESSION_REQUEST_QUOTA,
+                 window: float = SESSION_QUOTA_WINDOW, action: str = SESSION_OVER_QUOTA_ACTION):
+        self.token_quota = token_quota
+        self.request_quota = request_quota
+        self.window = window
+        self.action = action
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def _session(self, session: str) -> Dict:
+        entry = self._sessions.get(session)
+        if entry is None:
+            entry = {"events": deque(), "tokens": 0, "requests": 0,
+                     "totals": {"prompt_tokens": 0, "completion_tokens": 0, "requests": 0,
+                                "background_tokens": 0, "background_requests": 0, "rejected": 0}}
+            self._sessions[session] = entry
+            while len(self._sessions) > SESSION_USAGE_SESSIONS:
+                self._sessions.popitem(last=False)
+        self._sessions.move_to_end(session)
+        # Из окна выбывают события старше SESSION_QUOTA_WINDOW
+        now = time.monotonic()
+        events = entry["events"]
+        while events and now - events[0][0] >= self.window:
+            _, tokens, requests = events.popleft()
+            entry["tokens"] -= tokens
+            entry["requests"] -= requests
+        return entry
+
+    def record(self, prompt_tokens: int = 0, completion_tokens: int = 0, requests: int = 0,
+               node: Optional[str] = None, session: Optional[str] = None):
+        """Учитывает запрос и/или токены из usage ответа для сессии из контекста планировщика."""
+        session = session or current_session()
+        if not session:
+            return
+        prompt_tokens, completion_tokens = int(prompt_tokens or 0), int(completion_tokens or 0)
+        background = gateway_scheduler.priority_for(node or "") in GATEWAY_BACKGROUND_PRIORITIES
+        with self._lock:
+            entry = self._session(session)
+            totals = entry["totals"]
+            if background:
+                totals["background_tokens"] += prompt_tokens + completion_tokens
+                totals["background_requests"] += requests
+                return
+            totals["prompt_tokens"] += prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["requests"] += requests
+            entry["events"].append((time.monotonic(), prompt_tokens + completion_tokens, requests))
+            entry["tokens"] += prompt_tokens + completion_tokens
+            entry["requests"] += requests
+
+    def quota_share(self, session: Optional[str] = None) -> float:
+        """Израсходованная доля квоты сессии в текущем окне (наибольшая из долей токенов и запросов)."""
+        session = session or current_session()
+        if not session:
+            return 0.0
+        with self._lock:
+            entry = self._session(session)
+            return max(entry["tokens"] / max(self.token_quota, 1), entry["requests"] / max(self.request_quota, 1))
+
+    def payload_tier(self, session: Optional[str] = None) -> int:
+        """0 — полный запрос, 1 — уменьшенный (мягкий предел квоты), 2 — минимальный (квота исчерпана)."""
+        share = self.quota_share(session)
+        if share >= 1.0:
+            return 2
+        return 1 if share >= SESSION_SOFT_QUOTA_SHARE else 0
+
+    def admit(self, node: str, session: Optional[str] = None):
+        """Допуск запроса узла: возвращает управление, если запрос можно выполнять, иначе SessionQuotaExceeded."""
+        session = session or current_session()
+        if not session:
+            return
+        priority = gateway_scheduler.priority_for(node)
+        if priority == "batch":
+            return
+        share = self.quota_share(session)
+        if priority == "speculative":
+            # Фоновая подготовка ответов для сессии у предела квоты не окупится
+            if share >= SESSION_SOFT_QUOTA_SHARE:
+                raise SessionQuotaExceeded(f"{node}: фоновая подготовка пропущена, сессия у предела квоты")
+            return
+        if share < 1.0 or (self.action == "degrade" and share < SESSION_DEGRADE_LIMIT):
+            return
+        if self.action == "queue":
+            started = time.monotonic()
+            while time.monotonic() - started < SESSION_QUEUE_MAX_WAIT:
+                time.sleep(min(1.0, SESSION_QUEUE_MAX_WAIT))
+                if self.quota_share(session) < 1.0:
+                    logger.info(f"{node}: запрос сессии {session} ждал квоту {time.monotonic() - started:.1f} с")
+                    return
+        with self._lock:
+            self._session(session)["totals"]["rejected"] += 1
+        logger.warning(f"{node}: сессия {session} исчерпала квоту ({share:.0%}), запрос отклонен")
+        raise SessionQuotaExceeded(f"Превышен лимит обращений к модели для сессии: "
+                                   f"израсходовано {share:.0%} квоты за {self.window // 60:.0f} мин.")
+
+    def report(self, session: Optional[str] = None) -> Dict:
+        """Учет по сессии (или по всем): итоги, расход в окне и доля квоты."""
+        with self._lock:
+            sessions = [session] if session else list(self._sessions)
+            result = {}
+            for name in sessions:
+                entry = self._session(name)
+                result[name] = dict(entry["totals"], window_tokens=entry["tokens"], window_requests=entry["requests"],
+                                    quota_share=round(max(entry["tokens"] / max(self.token_quota, 1),
+                                                          entry["requests"] / max(self.request_quota, 1)), 3))
+            return result
+
+
+session_usage = SessionUsage()
+
+
+@lru_cache(maxsize=None)
+def usage_callback():
+    """Обработчик LangChain, учитывающий usage ответов цепочек (клиент OpenAI учитывается в model_router)."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class UsageCallback(BaseCallbackHandler):
+        def on_llm_end(self, response, **kwargs):
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            session_usage.record(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+
+    return UsageCallback()
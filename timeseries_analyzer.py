@@ -1,77 +1,161 @@
 import pandas as pd
 from pathlib import Path
-from typing import Optional, Tuple, Dict
-from config import logger, client, llm
+from typing import Callable, Optional, Tuple, Dict, BinaryIO, List
+from config import logger, get_client, MAX_SERIES, SERIES_CACHE_SIZE
 import json
 import re
 import base64
-import tempfile
 import os
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
+import threading
+from collections import OrderedDict
+import numpy as np
+from data_ingestion import SeriesArrays, compact_values, ingest_csv, read_excel, NAT_EPOCH
+from date_parsing import date_normalizer
+from columnar_store import load_columnar, save_columnar
+from local_features import series_summaries
+from image_attachments import choose_detail, image_attachments
+from model_router import model_router
+from prompt_registry import get_message_chain, get_prompt
+from token_budget import (TokenBudget, degradation_ladder, downsample_rows, encode_image_scaled, estimate_image_tokens,
+                          estimate_text_tokens, image_size)
+
+MONTHS_GENITIVE = ('января', 'февраля', 'марта', 'апреля', 'мая', 'июня', 'июля', 'августа', 'сентября',
+                   'октября', 'ноября', 'декабря')
+
+
+def format_date_for_human(date) -> str:
+    """Форматирует дату в человеко-читаемый вид ('на 1 мая 1999 года' или 'на 1999 год')."""
+    if pd.isna(date):
+        return "неизвестно"
+    if isinstance(date, str):
+        return date
+    if date.month == 1 and date.day == 1:
+        return f"на {date.year} год"
+    return f"на {date.day} {MONTHS_GENITIVE[date.month - 1]} {date.year} года"
+
+
+def format_dates_for_human(dates: np.ndarray, rows: np.ndarray) -> List[str]:
+    """Человеко-читаемые даты только для выбранных строк; нераспознанная дата заменяется номером записи."""
+    timestamps = pd.DatetimeIndex(dates[rows].view("datetime64[ns]"))
+    return [format_date_for_human(timestamp) if not pd.isna(timestamp) else f"Запись {row}"
+            for timestamp, row in zip(timestamps, rows)]
+
+
+# Прочитанные ряды: (путь, размер, mtime) -> SeriesArrays. Массивы не изменяются после чтения,
+# поэтому один экземпляр передается по ссылке всем анализаторам и сессиям
+_series_cache: "OrderedDict[Tuple[str, int, int], SeriesArrays]" = OrderedDict()
+_series_lock = threading.Lock()
 
 
 class TimeSeriesAnalyzer:
-    def read_data(self, file_path: Path) -> Tuple[Optional[pd.DataFrame], str]:
-        """Читает данные временного ряда с проверкой порядка столбцов (дата/значение или значение/дата)."""
+    def read_data(self, file_path: Path, source: Optional[BinaryIO] = None) -> Tuple[Optional[pd.DataFrame], str]:
+        """Читает данные временного ряда с проверкой порядка столбцов (дата/значение или значение/дата).
+
+        source — открытый файл (например, загруженный через интерфейс); если не задан, читается file_path:
+        при наличии актуальной колоночной копии данные открываются из нее через memory-map, иначе файл
+        разбирается и копия создается для следующих чтений.
+        """
+        if source is None:
+            series = load_columnar(file_path)
+            if series is not None:
+                return series.to_frame(), "Данные успешно прочитаны"
+            df, message = self._parse_data(file_path, file_path)
+            if df is not None:
+                save_columnar(file_path, df)
+            return df, message
+        return self._parse_data(file_path, source)
+
+    def load_series(self, data_path) -> Tuple[Optional[SeriesArrays], str]:
+        """Ряд файла в компактном виде; повторные обращения к тому же файлу получают тот же экземпляр."""
+        data_path = Path(data_path)
+        try:
+            stat = os.stat(data_path)
+        except OSError as e:
+            return None, f"Ошибка чтения файла: {str(e)}"
+        key = (str(data_path.resolve()), stat.st_size, stat.st_mtime_ns)
+        with _series_lock:
+            if key in _series_cache:
+                _series_cache.move_to_end(key)
+                return _series_cache[key], "Данные успешно прочитаны"
+
+        series = load_columnar(data_path)
+        message = "Данные успешно прочитаны"
+        if series is None:
+            df, message = self.read_data(data_path)
+            if df is None:
+                return None, message
+            series = self.to_series(df)
+
+        with _series_lock:
+            _series_cache[key] = series
+            while len(_series_cache) > SERIES_CACHE_SIZE:
+                _series_cache.popitem(last=False)
+        logger.info(f"Ряд {data_path} загружен: {len(series)} строк, тип значений {series.values.dtype}")
+        return series, message
+
+    def to_series(self, df: pd.DataFrame) -> SeriesArrays:
+        """Переводит проверенные данные в SeriesArrays: даты int64 (нераспознанные — NaT), значения float32/float64."""
+        date_col, value_cols = df.columns[0], list(df.columns[1:])
+        dates = df[date_col]
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            dates = self.parse_dates(dates, tuple(df.columns))
+        if dates is None:
+            epochs = np.full(len(df), NAT_EPOCH, dtype=np.int64)
+        else:
+            epochs = dates.to_numpy(dtype="datetime64[ns]").view(np.int64)
+        values = df[value_cols]
+        if all(values.dtypes == np.float32):
+            values = values.to_numpy(dtype=np.float32)
+        else:
+            values = compact_values(values.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64))
+        return SeriesArrays(epochs, values, str(date_col), [str(col) for col in value_cols])
+
+    def _parse_data(self, file_path: Path, source) -> Tuple[Optional[pd.DataFrame], str]:
+        """Разбирает CSV/XLSX и проверяет столбцы даты и значения."""
         try:
             if file_path.suffix == '.csv':
-                df = pd.read_csv(file_path)
+                series = ingest_csv(source)
+                if series is not None:
+                    return series.to_frame(), "Данные успешно прочитаны"
+                df = pd.read_csv(source)
                 logger.info(f"CSV файл прочитан: {file_path}, размер: {df.shape}, колонки: {df.columns.tolist()}")
                 logger.info(f"Типы данных колонок:\n{df.dtypes}")
             elif file_path.suffix in ['.xlsx', '.xls']:
-                with pd.ExcelFile(file_path, engine='openpyxl') as xls:
-                    for sheet_name in xls.sheet_names:
-                        df = pd.read_excel(xls, sheet_name=sheet_name)
-                        if not df.empty and len(df.columns) >= 2:
-                            logger.info(f"Данные Excel найдены на листе '{sheet_name}', размер: {df.shape}")
-                            # Проверка на количество столбцов
-                            if len(df.columns) > 2:
-                                logger.error(f"Ошибка: Файл {file_path} содержит более двух столбцов ({len(df.columns)})")
-                                return None, "Ошибка: Файл должен содержать только два столбца (дата и значение) для временного ряда."
-                            break
-                    else:
-                        return None, "Подходящие данные в файле Excel не найдены"
+                df, sheet_name = read_excel(source)
+                if df is None:
+                    return None, "Подходящие данные в файле Excel не найдены"
+                logger.info(f"Данные Excel найдены на листе '{sheet_name}', размер: {df.shape}")
             else:
                 return None, f"Неподдерживаемый формат файла: {file_path.suffix}"
 
             # Проверка на количество столбцов
-            if len(df.columns) != 2:
-                logger.error(f"Ошибка: Файл {file_path} должен содержать ровно два столбца, найдено: {len(df.columns)}")
-                return None, "Ошибка: Файл должен содержать ровно два столбца (дата и значение) для временного ряда."
+            if not 2 <= len(df.columns) <= MAX_SERIES + 1:
+                logger.error(f"Ошибка: Файл {file_path} содержит недопустимое число столбцов: {len(df.columns)}")
+                return None, (f"Ошибка: Файл должен содержать столбец дат и от одного до {MAX_SERIES} "
+                              f"столбцов числовых значений.")
 
             if df.empty:
                 return None, "Таблица данных пуста"
 
-            # Определяем столбцы с датами и значениями
-            col1, col2 = df.columns[0], df.columns[1]
-            date_col, value_col = None, None
+            if len(df.columns) > 2:
+                return self._select_multi_series(df, file_path)
 
-            # Проверяем, является ли первый столбец датой
-            try:
-                pd.to_datetime(df[col1], errors='coerce')
-                if df[col1].notna().sum() > 0 and pd.api.types.is_numeric_dtype(df[col2]):
-                    date_col, value_col = col1, col2
-                    logger.info(f"Первый столбец '{col1}' определен как дата, второй '{col2}' как значение")
-            except Exception:
-                pass
-
-            # Если первый столбец не дата, проверяем второй
-            if date_col is None:
-                try:
-                    pd.to_datetime(df[col2], errors='coerce')
-                    if df[col2].notna().sum() > 0 and pd.api.types.is_numeric_dtype(df[col1]):
-                        date_col, value_col = col2, col1
-                        logger.info(f"Второй столбец '{col2}' определен как дата, первый '{col1}' как значение")
-                        # Перестраиваем DataFrame, чтобы дата была первым столбцом
-                        df = df[[col2, col1]]
-                        df.columns = [col2, col1]  # Сохраняем оригинальные имена
-                except Exception:
-                    pass
-
-            if date_col is None or value_col is None:
+            # Определяем столбцы с датами и значениями: столбец значений должен быть числовым, а из двух
+            # вариантов предпочитается тот, у которого формат дат распознан по выборке
+            col1, col2 = df.columns[0], df.columns[1]
+            candidates = [(date, value) for date, value in ((col1, col2), (col2, col1))
+                          if df[date].notna().sum() > 0 and pd.api.types.is_numeric_dtype(df[value])]
+            if not candidates:
                 logger.error(f"Ошибка: Не удалось определить столбцы с датой и значением в {file_path}")
                 return None, "Ошибка: Один столбец должен содержать даты, а другой — числовые значения."
+            recognized = [pair for pair in candidates if date_normalizer.infer(df[pair[0]], tuple(df.columns))]
+            date_col, value_col = (recognized or candidates)[0]
+            if date_col == col1:
+                logger.info(f"Первый столбец '{col1}' определен как дата, второй '{col2}' как значение")
+            else:
+                logger.info(f"Второй столбец '{col2}' определен как дата, первый '{col1}' как значение")
+                # Перестраиваем DataFrame, чтобы дата была первым столбцом
+                df = df[[col2, col1]]
 
             return df, "Данные успешно прочитаны"
 
@@ -79,13 +163,99 @@ class TimeSeriesAnalyzer:
             logger.error(f"Ошибка чтения {file_path}: {str(e)}")
             return None, f"Ошибка чтения файла: {str(e)}"
 
-    def encode_image(self, image_path: str) -> str:
-        """Кодирует изображение в формат base64."""
+    def _select_multi_series(self, df: pd.DataFrame, file_path: Path) -> Tuple[Optional[pd.DataFrame], str]:
+        """Находит столбец дат в наборе из нескольких рядов; остальные столбцы должны быть числовыми."""
+        for date_col in df.columns:
+            value_cols = [col for col in df.columns if col != date_col]
+            if not all(pd.api.types.is_numeric_dtype(df[col]) for col in value_cols):
+                continue
+            if pd.api.types.is_numeric_dtype(df[date_col]) and date_col != df.columns[0]:
+                continue
+            dates = self.parse_dates(df[date_col], tuple(df.columns))
+            if dates is not None and dates.notna().mean() > 0.5:
+                logger.info(f"Столбец '{date_col}' определен как дата, ряды: {value_cols}")
+                return df[[date_col] + value_cols], "Данные успешно прочитаны"
+        logger.error(f"Ошибка: Не удалось определить столбец дат и числовые ряды в {file_path}")
+        return None, "Ошибка: Один столбец должен содержать даты, а остальные — числовые значения."
+
+    def parse_dates(self, column: pd.Series, schema: Optional[Tuple] = None) -> Optional[pd.Series]:
+        """Преобразует столбец дат в datetime; возвращает None, если преобразовать не удалось.
+
+        Формат определяется по выборке и запоминается для схемы файла schema (набора его столбцов),
+        столбец разбирается векторно (date_parsing.DateNormalizer).
+        """
+        name = column.name
+        try:
+            column, date_format = date_normalizer.normalize(column, schema)
+            if date_format is None:
+                logger.info(f"Колонка {name} преобразована в datetime (попытка автопреобразования)")
+            else:
+                logger.info(f"Колонка {name} преобразована в datetime по формату {date_format}")
+            return column.rename(name)
+        except Exception as e:
+            logger.error(f"Ошибка при преобразовании даты {name}: {str(e)}")
+            return None
+
+    def series_arrays(self, df: pd.DataFrame) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """Возвращает ряд в хронологическом порядке: даты (int64, нс) и значения (float64) без пропусков."""
+        dates = self.parse_dates(df[df.columns[0]], tuple(df.columns))
+        values = pd.to_numeric(df[df.columns[1]], errors='coerce').to_numpy(dtype=np.float64)
+        if dates is None:
+            mask = ~np.isnan(values)
+            return None, values[mask]
+        dates = dates.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        mask = ~np.isnan(values) & (dates != np.iinfo(np.int64).min)
+        dates, values = dates[mask], values[mask]
+        order = np.argsort(dates, kind='stable')
+        return dates[order], values[order]
+
+    def multi_series_arrays(self, df: pd.DataFrame) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """Возвращает набор рядов в хронологическом порядке: даты (int64, нс) и матрицу значений n x k."""
+        dates = self.parse_dates(df[df.columns[0]], tuple(df.columns))
+        values = df[df.columns[1:]].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        if dates is None:
+            return None, values
+        dates = dates.to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        mask = dates != np.iinfo(np.int64).min
+        dates, values = dates[mask], values[mask]
+        order = np.argsort(dates, kind='stable')
+        return dates[order], values[order]
+
+    def describe_summaries(self, summaries: List[Dict]) -> Dict[str, Dict]:
+        """Переводит локальные сводки рядов в человеко-читаемый вид для промпта и ts_features."""
+        def point(index, date):
+            return format_date_for_human(pd.Timestamp(date)) if date is not None else f"Запись {index}"
+
+        described = {}
+        for summary in summaries:
+            if not summary["count"]:
+                described[summary["name"]] = {"trend": "неизвестно", "min_value": "неизвестно",
+                                              "max_value": "неизвестно", "anomalies": []}
+                continue
+            described[summary["name"]] = {
+                "count": summary["count"],
+                "min_value": f"{round(summary['min'], 2)} {point(summary['min_index'], summary['min_date'])}",
+                "max_value": f"{round(summary['max'], 2)} {point(summary['max_index'], summary['max_date'])}",
+                "first_value": round(summary["first"], 2),
+                "last_value": round(summary["last"], 2),
+                "change_pct": summary["change_pct"],
+                "mean": round(summary["mean"], 2),
+                "std": round(summary["std"], 2),
+                "linear_trend": f"{round(summary['slope'], 4)} в {summary['slope_unit']}",
+                "anomalies": [
+                    {"value": round(anomaly["value"], 2), "date": point(anomaly["index"], anomaly["date"]),
+                     "score": anomaly["score"]}
+                    for anomaly in summary["anomalies"]
+                ]
+            }
+        return described
+
+    def encode_image(self, image_path: str, max_side: Optional[int] = None) -> str:
+        """Кодирует изображение в формат base64 (при заданном max_side — уменьшенное до этой длинной стороны)."""
         try:
-            with open(image_path, "rb") as image_file:
-                encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-                logger.info(f"Изображение {image_path} закодировано, длина: {len(encoded_string)}")
-                return encoded_string
+            encoded_string, _ = encode_image_scaled(image_path, max_side)
+            logger.info(f"Изображение {image_path} закодировано, длина: {len(encoded_string)}")
+            return encoded_string
         except Exception as e:
             logger.error(f"Ошибка при кодировании изображения {image_path}: {str(e)}")
             return f"Ошибка: Не удалось закодировать изображение: {str(e)}"
@@ -101,9 +271,66 @@ class TimeSeriesAnalyzer:
             logger.error(f"Ошибка при кодировании данных: {str(e)}")
             return f"Ошибка: Не удалось закодировать данные: {str(e)}"
 
-    def analyze_time_series(self, df: pd.DataFrame, image_path: Optional[str], main_metric: str, domain: str) -> Dict:
-        """Анализирует временной ряд с учетом изображения, данных, метрики и домена."""
-        if len(df.columns) != 2:
+    def estimate_request(self, prompt: str, image_path: Optional[str], base64_image: str,
+                         image_side: Optional[int]) -> Tuple[int, int]:
+        """Оценка токенов и размера тела запроса с текстом и изображением-вложением."""
+        tokens = estimate_text_tokens(prompt)
+        if base64_image and not base64_image.startswith("Ошибка"):
+            width, height = image_size(image_path, image_side)
+            tokens += estimate_image_tokens(width, height)
+        return tokens, len(prompt) + len(base64_image)
+
+    def prompt_frame(self, series: SeriesArrays, rows: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Таблица «Дата, Значение» для промпта; строки дат формируются только для выбранных точек."""
+        rows = np.arange(len(series)) if rows is None else rows
+        values = series.values.reshape(len(series))[rows].astype(np.float64)
+        return pd.DataFrame({
+            "Дата": format_dates_for_human(series.dates, rows),
+            "Значение": np.round(np.nan_to_num(values, nan=0.0), 2)
+        })
+
+    def min_max(self, series: SeriesArrays) -> Tuple[float, str, float, str]:
+        """Минимальное и максимальное значения ряда (округленные) с человеко-читаемыми датами."""
+        values = series.values.reshape(len(series))
+        if np.isnan(values).all():
+            return 0.0, "неизвестно", 0.0, "неизвестно"
+        min_index, max_index = int(np.nanargmin(values)), int(np.nanargmax(values))
+        min_date, max_date = format_dates_for_human(series.dates, np.array([min_index, max_index]))
+        return round(float(values[min_index]), 2), min_date, round(float(values[max_index]), 2), max_date
+
+    def series_request(self, name: str, series: SeriesArrays, image_path: Optional[str], max_tokens: int,
+                       render: Callable[[str, str], str]) -> Tuple[str, str]:
+        """Промпт с рядом в CSV (base64) и изображение, уложенные в бюджет запроса.
+
+        render(encoded_csv, image_state) возвращает текст промпта. Возвращает (промпт, изображение в base64).
+        """
+        values = series.values.reshape(len(series))
+        head = self.prompt_frame(series, np.arange(min(len(series), 200)))
+        logger.info(f"Первые 5 строк данных для LLM:\n{head.head().to_string()}")
+        # Размер CSV в base64 на строку по первым строкам: ступени, заведомо не укладывающиеся в бюджет,
+        # пропускаются без форматирования всех дат
+        bytes_per_row = len(self.encode_data(head)) / max(1, len(head))
+        budget = TokenBudget(max_tokens=max_tokens)
+
+        def build(options):
+            rows = downsample_rows(values, options["rows"])
+            estimated = bytes_per_row * (len(series) if rows is None else len(rows))
+            if not budget.fits(int(estimated / 6), int(estimated / 2)):
+                return None, int(estimated / 3), int(estimated)
+            encoded_csv = self.encode_data(self.prompt_frame(series, rows))
+            base64_image = self.encode_image(image_path, options["image_side"]) if image_path else ""
+            prompt = render(encoded_csv, "присутствует" if base64_image else "отсутствует")
+            tokens, size = self.estimate_request(prompt, image_path, base64_image, options["image_side"])
+            return (prompt, base64_image), tokens, size
+
+        return budget.fit(name, build, degradation_ladder(data=True, image=True))
+
+    def analyze_time_series(self, data, image_path: Optional[str], main_metric: str, domain: str) -> Dict:
+        """Анализирует временной ряд с учетом изображения, данных, метрики и домена.
+
+        data — SeriesArrays (передается по ссылке, без копирования) или DataFrame в формате read_data.
+        """
+        if len(data.value_cols if isinstance(data, SeriesArrays) else data.columns[1:]) != 1:
             logger.error("Число столбцов в данных не равно двум")
             return {
                 "metric": main_metric,
@@ -116,157 +343,62 @@ class TimeSeriesAnalyzer:
                 "hypotheses": "Данные отсутствуют"
             }
 
-        date_col_name, value_col_name = df.columns[0], df.columns[1]
-        logger.info(f"Используемые столбцы: дата - {date_col_name}, значение - {value_col_name}")
+        series = data if isinstance(data, SeriesArrays) else self.to_series(data)
+        logger.info(f"Используемые столбцы: дата - {series.date_col}, значение - {series.value_cols[0]}")
 
-        try:
-            if pd.api.types.is_numeric_dtype(df[date_col_name]):
-                df[date_col_name] = pd.to_datetime(df[date_col_name].astype(int).astype(str) + '-01-01',
-                                                  errors='coerce')
-                logger.info(f"Колонка {date_col_name} преобразована в datetime")
-            elif df[date_col_name].dtype == 'object':
-                if df[date_col_name].str.match(r'Занлись \d+').any():
-                    df[date_col_name] = df[date_col_name].str.extract(r'Занлись (\d+)').astype(float).astype(int) + 1945
-                    df[date_col_name] = pd.to_datetime(df[date_col_name].astype(str) + '-01-01')
-                    logger.info(f"Колонка {date_col_name} преобразована из формата 'Занлись \d+' в datetime")
-                else:
-                    df[date_col_name] = pd.to_datetime(df[date_col_name], errors='coerce')
-                    logger.info(f"Колонка {date_col_name} преобразована в datetime (попытка автопреобразования)")
-            if pd.api.types.is_datetime64_any_dtype(df[date_col_name]):
-                date_col = df[date_col_name]
-                logger.info(f"Колонка {date_col_name} успешно установлена как date_col с типом datetime")
-            else:
-                date_col = None
-                logger.warning(f"Колонка {date_col_name} не является datetime после преобразования")
-        except Exception as e:
-            logger.error(f"Ошибка при преобразовании даты {date_col_name}: {str(e)}")
-            date_col = None
-
-        def format_date_for_human(date):
-            if pd.isna(date):
-                return "неизвестно"
-            if isinstance(date, str):
-                return date
-            year = date.year
-            month = date.month
-            day = date.day
-            if month == 1 and day == 1:
-                return f"в {year} году" if "min" in context or "max" in context else f"на {year} год"
-            return f"на {day} {'января' if month == 1 else 'февраля' if month == 2 else 'марта' if month == 3 else 'апреля' if month == 4 else 'мая' if month == 5 else 'июня' if month == 6 else 'июля' if month == 7 else 'августа' if month == 8 else 'сентября' if month == 9 else 'октября' if month == 10 else 'ноября' if month == 11 else 'декабря'} {year} года"
-
-        context = {}
-        temp_df = pd.DataFrame({
-            "Дата": [format_date_for_human(row[date_col_name]) if date_col is not None and pd.notna(
-                row[date_col_name]) else f"Запись {idx}" for idx, row in df.iterrows()],
-            "Значение": [round(float(row[value_col_name]), 2) if pd.notna(row[value_col_name]) else 0.0 for _, row in df.iterrows()]
-        })
-
-        min_value = temp_df["Значение"].min()
-        max_value = temp_df["Значение"].max()
-        min_date = temp_df.loc[temp_df["Значение"].idxmin(), "Дата"]
-        max_date = temp_df.loc[temp_df["Значение"].idxmax(), "Дата"]
+        min_value, min_date, max_value, max_date = self.min_max(series)
         min_max_hint = f"Минимальное значение: {min_value} {min_date}, Максимальное значение: {max_value} {max_date}"
 
-        logger.info(f"Первые 5 строк данных для LLM:\n{temp_df.head().to_string()}")
-
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False, encoding='utf-8') as temp_file:
-            temp_df.to_csv(temp_file.name, index=False)
-            temp_file_path = temp_file.name
+        prompt, base64_image = self.series_request(
+            "analyze_time_series", series, image_path, 1000,
+            lambda encoded_csv, image_state: get_prompt("analyze_time_series").render(
+                domain=domain, main_metric=main_metric, min_max_hint=min_max_hint, encoded_csv=encoded_csv,
+                image_state=image_state
+            )
+        )
+        logger.info(f"Полный промпт для LLM (первые 500 символов):\n{prompt[:500]}...")
 
         try:
-            encoded_csv = self.encode_data(temp_df)
-            logger.info(f"CSV-файл закодирован в base64: {temp_file_path}")
-            base64_image = self.encode_image(image_path) if image_path else ""
-
-            prompt_parts = [
-                f"Дашборд в области {domain} показывает метрику {main_metric}.",
-                "Ты успешный аналитик временных рядов. Проанализируй временной ряд, представленный в CSV-файле (формат: Дата,Значение), закодированном в base64:",
-                f"```\n{encoded_csv}\n```",
-                f"Изображение дашборда в base64: {'присутствует' if base64_image else 'отсутствует'}",
-                f"Подсказка по данным: {min_max_hint}",
-                "Извлеки следующие характеристики и верни их в формате JSON:",
-                "- metric: метрика временного ряда (используй переданную метрику)",
-                "- domain: область дашборда (используй переданную область)",
-                "- trend: подробное описание трендов временного ряда (например, 'С начала периода до 1990 года наблюдается восходящий тренд, затем с 1990 по 2000 год тренд стабилизируется', если применимо; если один тренд, опиши его детально)",
-                "- seasonality: подробное описание наличия и характера сезонности (например, 'Сезонность присутствует с годовым циклом, с пиками в летние месяцы', если применимо; если отсутствует, укажи это с объяснением)",
-                "- min_value: минимальное значение и дата (проверь и скорректируй на основе данных и изображения, например, '500 на 1 мая 1999 года')",
-                "- max_value: максимальное значение и дата (проверь и скорректируй на основе данных и изображения, например, '5000 на 15 декабря 2000 года')",
-                "- anomalies: список аномалий с подробным описанием (например, [{'value': 5000, 'date': '1 июня 1999 года', 'description': 'Резкий скачок, возможно, связанный с событием X'}])",
-                "- hypotheses: подробные гипотезы, объясняющие характеристики временного ряда (например, 'Восходящий тренд с 1980 по 1990 год может быть связан с экономическим ростом, а скачок в 1995 году — с технологическим прорывом'), с объяснением каждого наблюдаемого тренда, пика или скачка",
-                "Если аномалии отсутствуют, верни пустой список в anomalies.",
-                "Если какие-то данные не удается определить, укажи 'неизвестно'.",
-                "Верни результат в формате JSON, заключенном в ```json ```.",
-                "Инструкция: Декодируй base64 в CSV, проанализируй данные и изображение, учти метрику, область и подсказку. Скорректируй даты для min_value и max_value в человеко-читаемом формате (например, 'в 1999 году' для года или 'на 1 мая 1999 года' для полной даты). Опиши тренды, сезонность и аномалии максимально детально, включая несколько этапов или пиков, если они есть. Сформируй гипотезы для каждого наблюдаемого явления."
-            ]
-            prompt = "\n".join(prompt_parts)
-            logger.info(f"Полный промпт для LLM (первые 500 символов):\n{prompt[:500]}...")
-
-            try:
-                response = client.chat.completions.create(
-                    model="aimediator.gpt-4.1-mini",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {"type": "text", "text": prompt},
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{base64_image}"
-                                    }
-                                } if base64_image and not base64_image.startswith("Ошибка") else {"type": "text",
-                                                                                                  "text": "Изображение отсутствует"}
-                            ]
-                        }
-                    ],
-                    max_tokens=1000,
-                    temperature=0.5,
-                    stream=False
-                )
-                content = response.choices[0].message.content
-                logger.info(f"Сырой ответ от LLM:\n{content}")
-
-                json_pattern = r"```json\s*([\s\S]*?)\s*```"
-                match = re.search(json_pattern, content)
-                if match:
-                    json_content = match.group(1).strip()
-                    try:
-                        result = json.loads(json_content)
-                        result["metric"] = main_metric
-                        result["domain"] = domain
-                        if "min_value" in result and result["min_value"] != f"{min_value} {min_date}":
-                            logger.warning(f"LLM изменил min_value: {result['min_value']} vs {min_value} {min_date}")
-                        if "max_value" in result and result["max_value"] != f"{max_value} {max_date}":
-                            logger.warning(f"LLM изменил max_value: {result['max_value']} vs {max_value} {max_date}")
-                        logger.info(f"Характеристики временного ряда: {result}")
-                        return result
-                    except json.JSONDecodeError:
-                        logger.error(f"Некорректный JSON от LLM: {json_content}")
-                        return {
-                            "metric": main_metric,
-                            "domain": domain,
-                            "trend": "неизвестно",
-                            "seasonality": "неизвестно",
-                            "min_value": f"{min_value} {min_date}",
-                            "max_value": f"{max_value} {max_date}",
-                            "anomalies": [],
-                            "hypotheses": "Некорректные данные от LLM"
-                        }
-                else:
-                    logger.error(f"JSON не найден в ответе LLM: {content}")
-                    return {
-                        "metric": main_metric,
-                        "domain": domain,
-                        "trend": "неизвестно",
-                        "seasonality": "неизвестно",
-                        "min_value": f"{min_value} {min_date}",
-                        "max_value": f"{max_value} {max_date}",
-                        "anomalies": [],
-                        "hypotheses": "JSON не найден в ответе LLM"
+            response = model_router.call("analyze_time_series", lambda model: get_client().chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                }
+                            } if base64_image and not base64_image.startswith("Ошибка") else {"type": "text",
+                                                                                              "text": "Изображение отсутствует"}
+                        ]
                     }
-            except Exception as e:
-                logger.error(f"Ошибка анализа временного ряда: {str(e)}")
-                if "413" in str(e) or "request too large" in str(e).lower():
+                ],
+                max_tokens=1000,
+                temperature=0.5,
+                stream=False
+            ))
+            content = response.choices[0].message.content
+            logger.info(f"Сырой ответ от LLM:\n{content}")
+
+            json_pattern = r"```json\s*([\s\S]*?)\s*```"
+            match = re.search(json_pattern, content)
+            if match:
+                json_content = match.group(1).strip()
+                try:
+                    result = json.loads(json_content)
+                    result["metric"] = main_metric
+                    result["domain"] = domain
+                    if "min_value" in result and result["min_value"] != f"{min_value} {min_date}":
+                        logger.warning(f"LLM изменил min_value: {result['min_value']} vs {min_value} {min_date}")
+                    if "max_value" in result and result["max_value"] != f"{max_value} {max_date}":
+                        logger.warning(f"LLM изменил max_value: {result['max_value']} vs {max_value} {max_date}")
+                    logger.info(f"Характеристики временного ряда: {result}")
+                    return result
+                except json.JSONDecodeError:
+                    logger.error(f"Некорректный JSON от LLM: {json_content}")
                     return {
                         "metric": main_metric,
                         "domain": domain,
@@ -275,8 +407,10 @@ class TimeSeriesAnalyzer:
                         "min_value": f"{min_value} {min_date}",
                         "max_value": f"{max_value} {max_date}",
                         "anomalies": [],
-                        "hypotheses": "Слишком большой объем данных или изображения. Пожалуйста, уменьшите размер файла."
+                        "hypotheses": "Некорректные данные от LLM"
                     }
+            else:
+                logger.error(f"JSON не найден в ответе LLM: {content}")
                 return {
                     "metric": main_metric,
                     "domain": domain,
@@ -285,58 +419,161 @@ class TimeSeriesAnalyzer:
                     "min_value": f"{min_value} {min_date}",
                     "max_value": f"{max_value} {max_date}",
                     "anomalies": [],
-                    "hypotheses": f"Ошибка анализа: {str(e)}"
+                    "hypotheses": "JSON не найден в ответе LLM"
                 }
-        finally:
-            try:
-                os.unlink(temp_file_path)
-                logger.info(f"Временный файл удален: {temp_file_path}")
-            except Exception as e:
-                logger.error(f"Ошибка при удалении временного файла {temp_file_path}: {str(e)}")
+        except Exception as e:
+            logger.error(f"Ошибка анализа временного ряда: {str(e)}")
+            if "413" in str(e) or "request too large" in str(e).lower():
+                return {
+                    "metric": main_metric,
+                    "domain": domain,
+                    "trend": "неизвестно",
+                    "seasonality": "неизвестно",
+                    "min_value": f"{min_value} {min_date}",
+                    "max_value": f"{max_value} {max_date}",
+                    "anomalies": [],
+                    "hypotheses": "Слишком большой объем данных или изображения. Пожалуйста, уменьшите размер файла."
+                }
+            return {
+                "metric": main_metric,
+                "domain": domain,
+                "trend": "неизвестно",
+                "seasonality": "неизвестно",
+                "min_value": f"{min_value} {min_date}",
+                "max_value": f"{max_value} {max_date}",
+                "anomalies": [],
+                "hypotheses": f"Ошибка анализа: {str(e)}"
+            }
+
+    def analyze_multi_series(self, df: pd.DataFrame, image_path: Optional[str], main_metric: str, domain: str) -> Dict:
+        """Анализирует набор рядов с общей осью дат одним запросом к LLM по локально рассчитанным сводкам."""
+        date_col_name, value_cols = df.columns[0], [str(col) for col in df.columns[1:]]
+        dates, values = self.multi_series_arrays(df)
+        described = self.describe_summaries(series_summaries(dates, values, value_cols))
+        logger.info(f"Сводки по {len(value_cols)} рядам рассчитаны: {value_cols}")
+
+        fallback = {
+            "metric": main_metric,
+            "domain": domain,
+            "trend": "неизвестно",
+            "seasonality": "неизвестно",
+            "min_value": "неизвестно",
+            "max_value": "неизвестно",
+            "anomalies": [],
+            "hypotheses": "неизвестно",
+            "series": described
+        }
+
+        def build(options):
+            base64_image = self.encode_image(image_path, options["image_side"]) if image_path else ""
+            prompt = get_prompt("analyze_multi_series").render(
+                domain=domain, main_metric=main_metric, series_count=len(value_cols), date_col=date_col_name,
+                series_names=", ".join(value_cols), described=json.dumps(described, ensure_ascii=False),
+                image_state="присутствует" if base64_image and not base64_image.startswith("Ошибка") else "отсутствует"
+            )
+            tokens, size = self.estimate_request(prompt, image_path, base64_image, options["image_side"])
+            return (prompt, base64_image), tokens, size
+
+        prompt, base64_image = TokenBudget(max_tokens=1500).fit("analyze_multi_series", build,
+                                                                degradation_ladder(image=True))
+        logger.info(f"Полный промпт для LLM (первые 500 символов):\n{prompt[:500]}...")
+
+        try:
+            response = model_router.call("analyze_multi_series", lambda model: get_client().chat.completions.create(
+                model=model,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": prompt},
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{base64_image}"
+                                }
+                            } if base64_image and not base64_image.startswith("Ошибка") else {"type": "text",
+                                                                                              "text": "Изображение отсутствует"}
+                        ]
+                    }
+                ],
+                max_tokens=1500,
+                temperature=0.5,
+                stream=False
+            ))
+            content = response.choices[0].message.content
+            logger.info(f"Сырой ответ от LLM:\n{content}")
+            match = re.search(r"```json\s*([\s\S]*?)\s*```", content)
+            if not match:
+                logger.error(f"JSON не найден в ответе LLM: {content}")
+                return {**fallback, "hypotheses": "JSON не найден в ответе LLM"}
+            result = json.loads(match.group(1).strip())
+        except json.JSONDecodeError:
+            logger.error("Некорректный JSON от LLM")
+            return {**fallback, "hypotheses": "Некорректные данные от LLM"}
+        except Exception as e:
+            logger.error(f"Ошибка анализа набора рядов: {str(e)}")
+            if "413" in str(e) or "request too large" in str(e).lower():
+                return {**fallback,
+                        "hypotheses": "Слишком большой объем данных или изображения. Пожалуйста, уменьшите размер файла."}
+            return {**fallback, "hypotheses": f"Ошибка анализа: {str(e)}"}
+
+        if not isinstance(result, dict):
+            logger.error(f"Ответ LLM не является объектом JSON: {result}")
+            return {**fallback, "hypotheses": "Некорректные данные от LLM"}
+        result["metric"] = main_metric
+        result["domain"] = domain
+        # Локальные сводки дополняют описание каждого ряда от LLM
+        series = result.get("series") if isinstance(result.get("series"), dict) else {}
+        series = {name: s for name, s in series.items() if isinstance(s, dict)}
+        result["series"] = {name: {**described[name], **series.get(name, {})} for name in described}
+        logger.info(f"Характеристики набора рядов: {result}")
+        return result
 
     def query_timeseries(self, query: str, image_path: Optional[str], data_path: Optional[str], context: str,
-                         ts_features: Optional[Dict] = None) -> str:
-        """Обрабатывает запрос пользователя, связанный с характеристиками временного ряда."""
+                         ts_features: Optional[Dict] = None, session_id: Optional[str] = None) -> str:
+        """Обрабатывает запрос пользователя, связанный с характеристиками временного ряда.
+
+        Изображение, если есть, передается вложением, общим для вопросов сессии.
+        """
         if not data_path or not ts_features:
             return "неизвестно"
 
         try:
-            base64_image = self.encode_image(image_path) if image_path else "отсутствует"
-            df, _ = self.read_data(Path(data_path))
-            if df is None:
-                return "неизвестно"
-            encoded_data = self.encode_data(df)
-            if encoded_data.startswith("Ошибка"):
+            series, _ = self.load_series(data_path)
+            if series is None:
                 return "неизвестно"
         except Exception as e:
             logger.error(f"Ошибка при доступе к данным: {str(e)}")
             return "неизвестно"
 
-        prompt = ChatPromptTemplate.from_template(
-            """Ты аналитик временных рядов. Твоя роль — анализировать тренды, сезонность, аномалии и другие характеристики временного ряда.
-            Запрос пользователя: {query}
-            Контекст: {context}
-            Характеристики временного ряда: {ts_features}
-            Изображение дашборда в base64: {base64_image}
-            Данные временного ряда в CSV (base64): {encoded_data}
-
-            Ответь на вопрос, если он связан с характеристиками временного ряда (например, тренды, сезонность, аномалии, минимум/максимум).
-            Используй предоставленные характеристики, изображение и данные для ответа.
-            Используй термины, специфичные для финансовой области, если применимо.
-            Если вопрос не относится к твоей роли, верни "неизвестно".
-            Верни ответ кратко, одним-двумя предложениями."""
-        )
+        prompt = get_prompt("query_timeseries")
 
-        chain = prompt | llm | StrOutputParser()
+        attachments = []
+        if image_path:
+            try:
+                attachments.append(image_attachments.get(image_path, choose_detail(query), session_id))
+            except Exception as e:
+                logger.error(f"Ошибка при подготовке изображения: {str(e)}")
+        image_tokens = sum(attachment["tokens"] for attachment in attachments)
+        image_bytes = sum(attachment["size"] for attachment in attachments)
 
-        try:
-            response = chain.invoke({
+        def build(options):
+            values = {
                 "query": query,
-                "context": context,
+                "context": context if options["history"] else "",
                 "ts_features": json.dumps(ts_features, ensure_ascii=False),
-                "base64_image": base64_image,
-                "encoded_data": encoded_data
-            })
+                "encoded_data": self.encode_data(series.take(downsample_rows(series.values, options["rows"])).to_frame())
+            }
+            text = prompt.render(**values)
+            return values, estimate_text_tokens(text) + image_tokens, len(text) + image_bytes
+
+        values = TokenBudget().fit("query_timeseries", build, degradation_ladder(data=True, history=True))
+        if values["encoded_data"].startswith("Ошибка"):
+            return "неизвестно"
+
+        try:
+            messages = prompt.messages([attachment["part"] for attachment in attachments], **values)
+            response = model_router.call("query_timeseries", lambda model: get_message_chain(model).invoke(messages))
             logger.info(f"Ответ Timeseries Agent: {response}")
             return response
         except Exception as e:
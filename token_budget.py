@@ -0,0 +1,153 @@
+import base64
+import io
+import math
+import os
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import (logger, MODEL_NAME, MODEL_TOKEN_BUDGETS, DEFAULT_TOKEN_BUDGET, MAX_REQUEST_BYTES,
+                    DATA_ROWS_LADDER, IMAGE_SIDE_LADDER, HISTORY_MESSAGES, HISTORY_TOKEN_LIMIT)
+from image_roi import open_dashboard_image
+from session_usage import session_usage
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Оценка числа токенов текста с запасом: ~3 символа ASCII (в том числе base64) и ~2 прочих символа на токен."""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return math.ceil(ascii_chars / 3 + (len(text) - ascii_chars) / 2)
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Оценка токенов изображения по плиткам 512x512 (после вписывания в 2048x2048 и 768 по короткой стороне)."""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def scaled_size(size: Tuple[int, int], original_size: Tuple[int, int], max_side: Optional[int]) -> Tuple[int, int]:
+    """Размер обрезанного изображения при том же масштабе, что и у исходного, уменьшенного до max_side.
+
+    Масштаб считается по исходному изображению: обрезка убирает поля, но не увеличивает содержимое,
+    поэтому текст остается того же размера, а изображение становится меньше.
+    """
+    scale = 1.0 if max_side is None else min(1.0, max_side / max(original_size))
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def image_size(image_path: str, max_side: Optional[int] = None) -> Tuple[int, int]:
+    """Размер изображения в том виде, в каком оно отправляется модели (после обрезки полей и уменьшения)."""
+    img, original_size = open_dashboard_image(image_path)
+    return scaled_size(img.size, original_size, max_side)
+
+
+def encode_image_scaled(image_path: str, max_side: Optional[int] = None, quality: int = 85) -> Tuple[str, Tuple[int, int]]:
+    """Кодирует изображение в base64; при заданном max_side уменьшает его и сохраняет в JPEG.
+
+    Изображение предварительно обрезается до областей с содержимым (image_roi).
+    """
+    img, original_size = open_dashboard_image(image_path)
+    if max_side is None:
+        if img.size != original_size:
+            # Обрезанное изображение в исходном масштабе сохраняется без потерь, чтобы не размыть мелкий текст
+            buffer = io.BytesIO()
+            img.save(buffer, format="PNG")
+            if buffer.tell() < os.path.getsize(image_path):
+                return base64.b64encode(buffer.getvalue()).decode("utf-8"), img.size
+        with open(image_path, "rb") as image_file:
+            return base64.b64encode(image_file.read()).decode("utf-8"), original_size
+    img = img.resize(scaled_size(img.size, original_size, max_side), Image.BICUBIC)
+    buffer = io.BytesIO()
+    img.save(buffer, format="JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8"), img.size
+
+
+def downsample_rows(values: np.ndarray, max_rows: Optional[int]) -> Optional[np.ndarray]:
+    """Индексы строк после прореживания до max_rows: равномерно по времени, плюс первая, последняя точки и экстремумы.
+
+    values — вектор или матрица n x k значений; None означает, что прореживание не нужно.
+    """
+    if max_rows is None or len(values) <= max_rows:
+        return None
+    keep = [np.linspace(0, len(values) - 1, max_rows, dtype=np.int64)]
+    columns = values.reshape(len(values), -1)
+    for j in range(columns.shape[1]):
+        column = columns[:, j]
+        if not np.isnan(column).all():
+            keep.append(np.array([np.nanargmin(column), np.nanargmax(column)]))
+    rows = np.unique(np.concatenate(keep))
+    logger.info(f"Данные прорежены для запроса: {len(values)} -> {len(rows)} строк")
+    return rows
+
+
+def history_context(chat_history: List[Dict], messages: int = HISTORY_MESSAGES,
+                    token_limit: int = HISTORY_TOKEN_LIMIT) -> str:
+    """Контекст из последних сообщений чата; самые старые отбрасываются, пока история не уложится в token_limit."""
+    lines = [f"{msg['role']}: {msg['content']}" for msg in chat_history[-messages:]] if messages else []
+    while lines and estimate_text_tokens("\n".join(lines)) > token_limit:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def degradation_ladder(data: bool = False, image_side: Optional[int] = None, image: bool = False,
+                       history: bool = False) -> List[Dict]:
+    """Ступени уменьшения запроса: сначала прореживание ряда, затем уменьшение изображения, затем отказ от истории.
+
+    image_side — текущая длинная сторона изображения у вызывающего кода (ступени не крупнее нее не используются).
+    """
+    current = {"rows": None, "image_side": image_side, "history": True}
+    ladder = [dict(current)]
+    if data:
+        for rows in DATA_ROWS_LADDER:
+            current["rows"] = rows
+            ladder.append(dict(current))
+    if image:
+        for side in IMAGE_SIDE_LADDER:
+            if image_side is None or side < image_side:
+                current["image_side"] = side
+                ladder.append(dict(current))
+    if history:
+        current["history"] = False
+        ladder.append(dict(current))
+    return ladder
+
+
+class TokenBudget:
+    """Предварительная проверка размера запроса к модели.
+
+    Вызывающий код передает функцию сборки запроса и ступени уменьшения; запрос собирается на каждой
+    ступени по очереди, пока оценка токенов и размера тела не уложится в бюджет модели.
+    """
+
+    def __init__(self, model: str = MODEL_NAME, max_tokens: int = 500):
+        self.model = model
+        self.limit = MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET) - max_tokens
+
+    def fits(self, tokens: int, size: int) -> bool:
+        return tokens <= self.limit and size <= MAX_REQUEST_BYTES
+
+    def fit(self, name: str, build: Callable[[Dict], Tuple[object, int, int]], ladder: List[Dict]):
+        """Возвращает первый запрос, уложившийся в бюджет; если не уложился ни один — самый уменьшенный.
+
+        Для сессии у предела квоты (session_usage.payload_tier) перебор начинается с середины лестницы,
+        а для исчерпавшей квоту сразу используется последняя ступень.
+        """
+        tier = session_usage.payload_tier()
+        if tier and len(ladder) > 1:
+            ladder = ladder[len(ladder) // 2 if tier == 1 else len(ladder) - 1:]
+            logger.info(f"{name}: сессия у предела квоты, запрос собирается начиная со ступени {ladder[0]}")
+        for step, options in enumerate(ladder):
+            payload, tokens, size = build(options)
+            if self.fits(tokens, size):
+                if step:
+                    logger.info(f"{name}: запрос уменьшен до ступени {options}: ~{tokens} токенов, {size} байт")
+                return payload
+            logger.warning(f"{name}: запрос ~{tokens} токенов, {size} байт превышает бюджет "
+                           f"{self.limit} токенов / {MAX_REQUEST_BYTES} байт")
+        logger.error(f"{name}: запрос не уложился в бюджет даже после всех ступеней уменьшения")
+        return payload